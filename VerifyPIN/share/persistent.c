@@ -0,0 +1,157 @@
+/**************************************************************************/
+/*                                                                        */
+/*  Persistent harness of the VerifyPIN examples, driven by chaosduck.py  */
+/*  (--persistent). It replaces src/main.c.                               */
+/*                                                                        */
+/**************************************************************************/
+
+/*$
+  One process runs verifyPIN for a whole batch of requests read on stdin,
+  instead of once per process. Each request sets the user PIN and may patch
+  the code of the program for this iteration only. The globals are reset
+  and the stack is zeroed before each iteration, the result of the oracle is
+  written on stdout.
+
+  Protocol, native endianness:
+    request  uint32 patch count, PIN_SIZE bytes of user PIN, then per patch
+             uint64 vaddr, uint32 size, the bytes
+    result   5 bytes: verifyPIN() return value, oracle(), g_countermeasure,
+             g_authenticated, g_ptc
+
+  The process exits on the end of stdin. A crash or a hang ends the batch,
+  chaosduck.py then starts a new process for the rest of it.
+*/
+
+#define _GNU_SOURCE
+#include <link.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+#include "interface.h"
+#include "types.h"
+#include "commons.h"
+
+#define MAX_PATCHES 16
+#define MAX_PATCH_SIZE 64
+#define CLEARED_STACK 65536 /* bytes */
+
+extern UBYTE g_countermeasure;
+extern BOOL g_authenticated;
+extern SBYTE g_ptc;
+extern UBYTE g_userPin[PIN_SIZE];
+
+BOOL verifyPIN(void);
+
+struct patch {
+    UBYTE *at;
+    uint32_t size;
+    UBYTE original[MAX_PATCH_SIZE];
+};
+
+static int read_all(void *buf, size_t len)
+{
+    char *p = buf;
+    while (len > 0) {
+        ssize_t n = read(0, p, len);
+        if (n <= 0)
+            return -1;
+        p += n;
+        len -= n;
+    }
+    return 0;
+}
+
+static int write_all(const void *buf, size_t len)
+{
+    const char *p = buf;
+    while (len > 0) {
+        ssize_t n = write(1, p, len);
+        if (n <= 0)
+            return -1;
+        p += n;
+        len -= n;
+    }
+    return 0;
+}
+
+/* load bias of the program, the first object reported */
+static int first_object(struct dl_phdr_info *info, size_t size, void *data)
+{
+    (void)size;
+    *(uintptr_t *)data = info->dlpi_addr;
+    return 1;
+}
+
+/* copy bytes over the code, the pages are made writable for the write */
+static void write_code(UBYTE *at, const UBYTE *data, uint32_t size)
+{
+    long page = sysconf(_SC_PAGESIZE);
+    uintptr_t start = (uintptr_t)at & ~(page - 1);
+    size_t len = (uintptr_t)at + size - start;
+
+    mprotect((void *)start, len, PROT_READ | PROT_WRITE | PROT_EXEC);
+    memcpy(at, data, size);
+    mprotect((void *)start, len, PROT_READ | PROT_EXEC);
+    __builtin___clear_cache((char *)at, (char *)at + size);
+}
+
+/* zero the stack below the caller, the faulted code may read uninitialized
+   variables: they must not depend on the previous iterations */
+static __attribute__((noinline)) void clear_stack(void)
+{
+    volatile UBYTE area[CLEARED_STACK];
+    size_t i;
+
+    for (i = 0; i < sizeof(area); i++)
+        area[i] = 0;
+}
+
+int main()
+{
+    struct patch patches[MAX_PATCHES];
+    UBYTE data[MAX_PATCH_SIZE];
+    UBYTE result[5];
+    uintptr_t bias = 0;
+    uint32_t count, i;
+    uint64_t vaddr;
+
+    dl_iterate_phdr(first_object, &bias);
+    while (read_all(&count, sizeof(count)) == 0 && count <= MAX_PATCHES) {
+        UBYTE pin[PIN_SIZE];
+
+        if (read_all(pin, PIN_SIZE) < 0)
+            break;
+        for (i = 0; i < count; i++) {
+            if (read_all(&vaddr, sizeof(vaddr)) < 0
+                || read_all(&patches[i].size, sizeof(patches[i].size)) < 0
+                || patches[i].size > MAX_PATCH_SIZE
+                || read_all(data, patches[i].size) < 0)
+                return 1;
+            patches[i].at = (UBYTE *)(bias + vaddr);
+            memcpy(patches[i].original, patches[i].at, patches[i].size);
+            write_code(patches[i].at, data, patches[i].size);
+        }
+
+        /* resets g_authenticated, g_ptc and g_countermeasure (with the
+           booleans of the variant) and the PINs */
+        clear_stack();
+        initialize();
+        memcpy(g_userPin, pin, PIN_SIZE);
+        result[0] = verifyPIN();
+        result[1] = oracle();
+        result[2] = g_countermeasure;
+        result[3] = g_authenticated;
+        result[4] = (UBYTE)g_ptc;
+
+        /* in reverse order, the patches may overlap */
+        while (count-- > 0)
+            write_code(patches[count].at, patches[count].original, patches[count].size);
+        if (write_all(result, sizeof(result)) < 0)
+            break;
+    }
+    return 0;
+}
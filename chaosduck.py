@@ -1,545 +1,1310 @@
-import csv
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from array import array
 import os
-import shlex
-import shutil
+import re
+import sqlite3
 import sys
 import time
 from functools import partial
-from multiprocessing import Pool
+from itertools import count
 from pathlib import Path
-from subprocess import PIPE, Popen, TimeoutExpired
 
 from capstone import *
 from capstone.x86 import *
-from elftools.common.exceptions import ELFError
-from elftools.elf.elffile import ELFFile
 
 sys.path.insert(1, "swifitool")  # use swifitool folder for file exports
 
-from faults.flp import FLP
-from faults.jbe import JBE
-from faults.jmp import JMP
-from faults.nop import NOP
-from faults.z1b import Z1B
-from faults.z1w import Z1W
-from faults_inject import ExecConfig
+from image import BinaryImage
+from patch import patched_image
 
+from duck.calibrate import CEILING, FACTOR, FLOOR, GOLDEN_TIMEOUT
+from duck.calibrate import calibrated_timeout, golden_outputs, golden_times, percentile
+from duck.combine import Combinations, combined, combined_model, site_ranks
+from duck.dedup import equivalence_classes
+from duck.disasm import extract_chunks
+from duck.emulate import Emulator, emulation_available, function_snapshot
+from duck.forkserver import ForkServer, build_shim, premain_offsets
+from duck.forkserver import supports_fork_server
+from duck.cache import cached_extraction, default_cache_dir, image_hash
+from duck.memexec import fd_path, memfd_image
+from duck.oracle import Evaluation, parse_oracle
+from duck.persistent import RESULT, PersistentHarness, benchmark_ranges
+from duck.persistent import encode_request, probe, render
+from duck.pipeline import bounded_as_completed
+from duck.plan import MODELS, CampaignPlan, JumpTargets, plan_jump_retargets
+from duck.predict import VALIDATION_RATE, CrashPredictor, ValidationSample
+from duck.sandbox import DEFAULT_LIMITS, FILE_SIZE, OUTPUT_LIMIT, PROCESSES, Limits
+from duck.sandbox import run_sandboxed
+from duck.store import ResultStore, input_id
+from duck.table import KIND_BRANCH, KIND_IMM, KIND_INDIRECT, KIND_NONE
+from duck.table import InstructionTable, parse_imm
+from duck.target import address_ranges, function_ranges, line_ranges
+from duck.target import parse_address_range, parse_line_range, restrict
+from duck.trace import executed_ranges, golden_coverage, peak_coverage
+from duck.transient import inject
 
-def extract_x86_instructions(infile):
+# bump when the output of the extractors changes, it invalidates the cache
+EXTRACTOR_VERSION = 5
+
+# input vectors of the campaign, each faulted binary runs with every pair
+KEYS = ["00010203040506070809", "01234567890987654321", "deadbeafdeadc0debabe"]
+PLAINTEXTS = ["badf00dbadc0ffee", "deadbeafbabec0de", "1ceb00dab10sf00d"]
+# user PINs of the persistent VerifyPIN harness, a wrong one and the card PIN
+PINS = ["00000000", "01020304"]
+QEMU_ARM = ["qemu-arm", "-L", "/usr/arm-linux-gnueabi/"]
+BUDGET = 1000000  # instructions, an emulated run executing more is stopped
+
+
+def extract_x86_instructions(image, processes=None):
     print("Disassembling the binary and parsing instructions...\n")
-    infile = open(infile, "rb")
-    # ELFFile looks for magic number, if there's none, ELFError is raised
-    try:
-        elffile = ELFFile(infile)
-        parsing = False
-        startAddress = 65535
-        endAddress = 0
-        # all jump instr supported by Intel x86 CPU
-        supjumps = [
-            "jne",
-            "je",
-            "jbe",
-            "jae",
-            "jb",
-            "jo",
-            "jmp",
-            "ja",
-            "jle",
-            "js",
-            "jc",
-            "jcxz",
-            "jecxz",
-            "jrcxz",
-            "jg",
-            "jge",
-            "jl",
-            "jle",
-            "jna",
-            "jnae",
-            "jnbe",
-            "jnc",
-            "jng",
-            "jnge",
-            "jnl",
-            "jnle",
-            "jno",
-            "jnp",
-            "jns",
-            "jnz",
-            "jp",
-            "jpe",
-            "jpo",
-            "jz",
-        ]
-        jumps = []  # array for jmp instructions
-        cmpsmovs = []  # array for cmp and mov instructions
-        allinstr = []  # all instructions' addresses and their size in bytes
-        for section in elffile.iter_sections():
-            ops = section.data()
-            addr = section["sh_addr"]
-            name = section.name
-            md = Cs(CS_ARCH_X86, CS_MODE_32)
-            md.detail = True
-            # print("%x\t%s\t%s" %(i.address, i.mnemonic, i.op_str))
-            # print("%x:\t%s\t%s\t" %(i.address, i.mnemonic, i.op_str) +
-            # ' '.join(format(x, '02x') for x in i.bytes)) # with bytes
-            # below code finds and parses only certain elf sections
-            # this is consistent with "objdump -S binary" command output
-            if name == ".rodata":
-                parsing = False
-            elif name == ".init" or parsing:
-                parsing = True
-                for i in md.disasm(ops, addr):
-                    # determine the heap range
-                    if i.address < startAddress:
-                        startAddress = i.address
-                    if i.address > endAddress:
-                        endAddress = i.address
-                    allinstr.append({"addr": i.address, "size": i.size})
-                    # print("%x\t%s\t%s\t%d" %(i.address, i.mnemonic, i.op_str, i.size))
-                    # determine the instruction type and parse accordingly
-                    if i.mnemonic in supjumps:  # select only jump instructions
-                        if len(i.op_str) == 6:  # process only simple jumps e.g 0x3eef
-                            # print("%x\t%s\t%s" %(i.address, i.mnemonic, i.op_str))
-                            type = i.mnemonic
-                            jumpfrom = hex(i.address)  # 0xdead
-                            jumpto = i.op_str  # 0xbeef
-                            jump = {"type": type, "from": jumpfrom, "to": jumpto}
-                            jumps.append(jump)
-                    # zero static compare values and static variables
-                    elif (
-                        i.mnemonic == "cmp" or i.mnemonic == "mov"
-                    ):  # select cmp or mov instructions
-                        # print("%x:\t%s\t%s\t%d" %(i.address, i.mnemonic, i.op_str, i.size))
-                        lastoperand = i.operands[len(i.operands) - 1]
-                        operands = i.op_str.split()
-                        value = operands[len(operands) - 1]
-                        # ignore comparisons with zero and values stored in registers
-                        if (
-                            value != "0"
-                            and "]" not in value
-                            and lastoperand.type != X86_OP_REG
-                        ):
-                            # print("%x:\t%s\t%s\t%d" %(i.address, i.mnemonic, i.op_str, i.size))
-                            size = 0
-                            loc = 0
-                            if len(value) <= 4:  # '0x' + 1 byte i.e. max 255
-                                size = 1
-                                if "byte" in operands:
-                                    loc = hex(i.address + (i.size - 1))
-                                elif "word" in operands:
-                                    loc = hex(i.address + (i.size - 2))  # 2 bytes
-                                elif "dword" in operands:
-                                    loc = hex(i.address + (i.size - 4))  # 4 bytes
-                            elif len(value) <= 6:  # '0x' + 2 bytes i.e. uint16_t
-                                size = 2
-                                if "word" in operands:
-                                    loc = hex(i.address + (i.size - 2))  # 2 bytes
-                                elif "dword" in operands:
-                                    loc = hex(i.address + (i.size - 4))  # 4 bytes
-                            elif (
-                                len(value) <= 10
-                            ):  # '0x' + 4 bytes i.e. uint32_t or int
-                                size = 4
-                                if "dword" in operands:
-                                    loc = hex(i.address + (i.size - 4))  # 4 bytes
-                            if loc != 0:
-                                cmpsmovs.append(
-                                    {"type": i.mnemonic, "size": size, "loc": loc}
-                                )
-        return allinstr, jumps, cmpsmovs
-    except ELFError:
-        logging.info("%s is invalid elf file" % elffile)
-
-
-def extract_arm_instructions(infile):
+    # BinaryImage looks for the ELF magic number, if there's none, elf is None
+    if image.elf is not None:
+        # the code is split on symbol starts and the chunks decoded in parallel
+        return extract_chunks(image, decode_x86_chunk, processes)
+    else:
+        print("%s is invalid elf file" % image.path)
+
+
+def decode_x86_chunk(image, chunk):
+    # all jump instr supported by Intel x86 CPU
+    supjumps = [
+        "jne",
+        "je",
+        "jbe",
+        "jae",
+        "jb",
+        "jo",
+        "jmp",
+        "ja",
+        "jle",
+        "js",
+        "jc",
+        "jcxz",
+        "jecxz",
+        "jrcxz",
+        "jg",
+        "jge",
+        "jl",
+        "jle",
+        "jna",
+        "jnae",
+        "jnbe",
+        "jnc",
+        "jng",
+        "jnge",
+        "jnl",
+        "jnle",
+        "jno",
+        "jnp",
+        "jns",
+        "jnz",
+        "jp",
+        "jpe",
+        "jpo",
+        "jz",
+    ]
+    jumps = []  # array for jmp instructions
+    cmpsmovs = []  # array for cmp and mov instructions
+    table = InstructionTable()  # all instructions, one column per field
+    mode = CS_MODE_64 if image.elf.elfclass == 64 else CS_MODE_32
+    md = Cs(CS_ARCH_X86, mode)  # lightweight decoding, no operand details
+    md_detail = Cs(CS_ARCH_X86, mode)
+    md_detail.detail = True  # only used on the cmp/mov candidates
+    addr, offset, length = chunk
+    ops = image.code_view(offset, offset + length)  # no copy
+    file_offset = addr - offset
+    for address, size, mnemonic, op_str in md.disasm_lite(ops, addr):
+        at = address - file_offset
+        target = -1
+        kind = KIND_NONE
+        # determine the instruction type and parse accordingly
+        if mnemonic in supjumps:  # select only jump instructions
+            dest = parse_imm(op_str)  # None for register/memory
+            if dest is None:
+                kind = KIND_INDIRECT
+            elif image.vaddr_to_offset(dest) is not None:
+                target = image.vaddr_to_offset(dest)
+                kind = KIND_BRANCH
+                jump = {
+                    "type": mnemonic,
+                    "from": hex(at),
+                    "to": hex(target),
+                }
+                jumps.append(jump)
+        # zero static compare values and static variables
+        elif mnemonic == "cmp" or mnemonic == "mov":  # select cmp or mov instructions
+            operands = op_str.split()
+            value = operands[len(operands) - 1]
+            # ignore comparisons with zero and values stored in memory
+            if value != "0" and "]" not in value:
+                start = address - addr
+                i = next(md_detail.disasm(ops[start : start + size], address))
+                lastoperand = i.operands[len(i.operands) - 1]
+                # ignore values stored in registers
+                if lastoperand.type != X86_OP_REG:
+                    kind = KIND_IMM
+                    loc = static_value_location(at + size, value, operands)
+                    if loc != 0:
+                        cmpsmovs.append(
+                            {
+                                "type": mnemonic,
+                                "size": loc[1],
+                                "loc": loc[0],
+                            }
+                        )
+        table.append(at, size, mnemonic, target, kind)
+    return table, jumps, cmpsmovs
+
+
+def static_value_location(end, value, operands):
+    # locate the immediate value at the end of the instruction from its size
+    size = 0
+    loc = 0
+    if len(value) <= 4:  # '0x' + 1 byte i.e. max 255
+        size = 1
+        if "byte" in operands:
+            loc = hex(end - 1)
+        elif "word" in operands:
+            loc = hex(end - 2)  # 2 bytes
+        elif "dword" in operands:
+            loc = hex(end - 4)  # 4 bytes
+    elif len(value) <= 6:  # '0x' + 2 bytes i.e. uint16_t
+        size = 2
+        if "word" in operands:
+            loc = hex(end - 2)  # 2 bytes
+        elif "dword" in operands:
+            loc = hex(end - 4)  # 4 bytes
+    elif len(value) <= 10:  # '0x' + 4 bytes i.e. uint32_t or int
+        size = 4
+        if "dword" in operands:
+            loc = hex(end - 4)  # 4 bytes
+    if loc != 0:
+        return loc, size
+    return 0
+
+
+def extract_arm_instructions(image, processes=None):
     print("Disassembling the binary and parsing instructions...\n")
-    infile = open(infile, "rb")
-    # ELFFile looks for magic number, if there's none, ELFError is raised
-    try:
-        elffile = ELFFile(infile)
-        parsing = False
-        startAddress = 65535
-        endAddress = 0
-        # all ARM branch instructions
-        branch_instr = [
-            "b",
-            "beq",
-            "bne",
-            "bcs",
-            "bhs",
-            "bcc",
-            "blo",
-            "bmi",
-            "bpl",
-            "bvs",
-            "bvc",
-            "bhi",
-            "bls",
-            "bge",
-            "blt",
-            "bgt",
-            "ble",
-            "bl",
-            "bleq",
-            "bllt",
-            "blx",
-            "bx",
-            "bxeq",
-            "bxne",
-            "bxcs",
-            "bxcc",
-            "bxhi",
-            "bxls",
-            "bxgt",
-            "bxle",
-        ]
-        jumps = []  # array for jmp instructions
-        cmpsmovs = []  # array for cmp and mov instructions
-        allinstr = []  # all instructions' addresses and their size in bytes
-        for section in elffile.iter_sections():
-            ops = section.data()
-            addr = section["sh_addr"]  # section start address
-            offset = section["sh_offset"]
-            file_offset = addr - offset
-            name = section.name
-            md = Cs(CS_ARCH_ARM, CS_MODE_ARM)
-            # below code finds and parses only certain elf sections
-            # this is consistent with "objdump -S binary" command output
-            if name == ".rodata":
-                parsing = False
-            elif name == ".init" or parsing:
-                parsing = True
-                for i in md.disasm(ops, addr):
-                    # determine the heap range
-                    if i.address < startAddress:
-                        startAddress = i.address
-                    if i.address > endAddress:
-                        endAddress = i.address
-                    allinstr.append({"addr": i.address - file_offset, "size": i.size})
-                    # determine the instruction type and parse accordingly
-                    if i.mnemonic in branch_instr:  # select only branch instructions
-                        if (
-                            len(i.op_str) > 4
-                        ):  # process proper jump addresses and ignore registers
-                            type = i.mnemonic
-                            jumpfrom = hex(i.address - file_offset)
-                            jumpto = hex(
-                                int(i.op_str.split("#")[1], 0) - file_offset
-                            )  # remove # from '#0x14f30'
-                            jump = {"type": type, "from": jumpfrom, "to": jumpto}
-                            jumps.append(jump)
-                    # zero static compare values and static variables
-                    elif (
-                        i.mnemonic == "cmp" or i.mnemonic == "mov"
-                    ):  # select cmp or mov instructions
-                        operands = i.op_str.split()
-                        op_value = operands[len(operands) - 1]
-                        # ignore comparisons with zero and values stored in registers
-                        if op_value != "#0" and "#" in op_value:
-                            val = op_value.split("#")[1]
-                            loc = hex(i.address)
-                            if len(val) <= 4:  # '0x' + 1 byte i.e. max 255
-                                size = 1
-                            elif len(val) <= 6:  # '0x' + 2 bytes
-                                size = 2
-                            cmpsmovs.append(
-                                {"type": i.mnemonic, "size": size, "loc": loc}
-                            )
-        return allinstr, jumps, cmpsmovs
-    except ELFError:
-        logging.info("%s is invalid elf file" % elffile)
-
-
-def inject_jump_faults(jumps, allinstr, infile, arch):
-    # General configuration
-    config = ExecConfig(
-        os.path.expanduser(infile), None, arch, None
-    )  # None for outfile and wordsize
-    # prepare the fault models
-    fm_list = []
-    jump_targets = [j["to"] for j in jumps]
-    jump_targets = list(dict.fromkeys(jump_targets))  # remove duplicates
-    # try valid jump targets from the existing ones
-    # for jump in jumps:
-    #     for target in jump_targets:
-    #         if target!=jump['to']:
-    #             try:
-    #                 if jump['type'] == ('jmp' or 'b'):
-    #                     fault = {'type':jump['type'],'at':jump['from'],
-    #                         'from':jump['to'],'to':target,
-    #                         'fault':JMP(config, [jump['from'],target])}
-    #                 else:
-    #                     fault = {'type':jump['type'],'at':jump['from'],
-    #                         'from':jump['to'],'to':target,
-    #                         'fault':JBE(config, [jump['from'],target])}
-    #                 fm_list.append(fault)
-    #             except SystemExit:
-    #                 pass # skip targets causing out of range erors and move on
-    # try setting jump targets to all possible instruction addresses
-    # this includes jumping in the middle of an instruction
-    for jump in jumps:
-        for target in allinstr:
-            print(target)
-            if target["addr"] != jump["to"]:
-                try:
-                    for offset in range(0, target["size"]):
-                        loc = hex(target["addr"] + offset)
-                        print(loc)
-                        raise
-                        if jump["type"] == ("jmp" or "b"):
-                            if offset > 0:
-                                type = jump["type"] + "_middlejmp"
-                                print(type)
-                                fault = {
-                                    "type": type,
-                                    "at": jump["from"],
-                                    "from": jump["to"],
-                                    "to": loc,
-                                    "fault": JMP(config, [jump["from"], loc]),
-                                }
-                            else:
-                                fault = {
-                                    "type": jump["type"],
-                                    "at": jump["from"],
-                                    "from": jump["to"],
-                                    "to": loc,
-                                    "fault": JMP(config, [jump["from"], loc]),
-                                }
-                        else:
-                            if offset > 0:
-                                type = jump["type"] + "_middlejmp"
-                                fault = {
-                                    "type": type,
-                                    "at": jump["from"],
-                                    "from": jump["to"],
-                                    "to": loc,
-                                    "fault": JBE(config, [jump["from"], loc]),
-                                }
-                            else:
-                                fault = {
-                                    "type": jump["type"],
-                                    "at": jump["from"],
-                                    "from": jump["to"],
-                                    "to": loc,
-                                    "fault": JBE(config, [jump["from"], loc]),
-                                }
-                        fm_list.append(fault)
-                except SystemExit:
-                    pass  # skip targets causing out of range erors and move on
+    # BinaryImage looks for the ELF magic number, if there's none, elf is None
+    if image.elf is not None:
+        # the code is split on symbol starts and the chunks decoded in parallel
+        return extract_chunks(image, decode_arm_chunk, processes)
+    else:
+        print("%s is invalid elf file" % image.path)
+
+
+def decode_arm_chunk(image, chunk):
+    # all ARM branch instructions
+    branch_instr = [
+        "b",
+        "beq",
+        "bne",
+        "bcs",
+        "bhs",
+        "bcc",
+        "blo",
+        "bmi",
+        "bpl",
+        "bvs",
+        "bvc",
+        "bhi",
+        "bls",
+        "bge",
+        "blt",
+        "bgt",
+        "ble",
+        "bl",
+        "bleq",
+        "bllt",
+        "blx",
+        "bx",
+        "bxeq",
+        "bxne",
+        "bxcs",
+        "bxcc",
+        "bxhi",
+        "bxls",
+        "bxgt",
+        "bxle",
+    ]
+    jumps = []  # array for jmp instructions
+    cmpsmovs = []  # array for cmp and mov instructions
+    table = InstructionTable()  # all instructions, one column per field
+    md = Cs(CS_ARCH_ARM, CS_MODE_ARM)  # lightweight decoding, no details
+    addr, offset, length = chunk
+    ops = image.code_view(offset, offset + length)  # no copy
+    file_offset = addr - offset
+    for address, size, mnemonic, op_str in md.disasm_lite(ops, addr):
+        at = address - file_offset
+        target = -1
+        kind = KIND_NONE
+        # determine the instruction type and parse accordingly
+        if mnemonic in branch_instr:  # select only branch instructions
+            dest = parse_imm(op_str)  # '#0x14f30', None for registers
+            if dest is None:
+                kind = KIND_INDIRECT
+            elif image.vaddr_to_offset(dest) is not None:
+                target = image.vaddr_to_offset(dest)
+                kind = KIND_BRANCH
+                jump = {
+                    "type": mnemonic,
+                    "from": hex(at),
+                    "to": hex(target),
+                }
+                jumps.append(jump)
+        # zero static compare values and static variables
+        elif mnemonic == "cmp" or mnemonic == "mov":  # select cmp or mov instructions
+            operands = op_str.split()
+            op_value = operands[len(operands) - 1]
+            # ignore comparisons with zero, values stored in registers and
+            # shifted registers (e.g. 'r0, r1, lsl #2')
+            if len(operands) == 2 and op_value.startswith("#") and op_value != "#0":
+                kind = KIND_IMM
+                # the immediate is imm8 rotated by the 4 bits above it, imm8 is
+                # the low byte of the little-endian word whatever the value
+                cmpsmovs.append({"type": mnemonic, "size": 1, "loc": hex(at)})
+        table.append(at, size, mnemonic, target, kind)
+    return table, jumps, cmpsmovs
+
 
+def plan_jump_faults(plan, jumps, table, image):
+    count = len(plan)
+    # try setting jump targets to all possible instruction addresses reachable
+    # by the jump encoding, this includes jumping in the middle of an instruction
+    candidates = JumpTargets(table)
+    for jump in jumps:
+        plan_jump_retargets(plan, jump, candidates, image)
     print("Number of detected jumps: ", len(jumps))
-    print("Number of new binaries with changed jumps: ", len(fm_list))
-    # create a folder for faulted binaries
-    Path("faulted-binaries").mkdir(parents=True, exist_ok=True)
-    # Duplicate the input and then apply the faults
-    for f in fm_list:
-        outfile = "faulted-binaries/%s_at_%s_from_%s_to_%s" % (
-            f["type"],
-            f["at"],
-            f["from"],
-            f["to"],
-        )
-        shutil.copy(infile, outfile)
-        with open(outfile, "r+b") as file:
-            f["fault"].apply(file)
+    print("Number of new binaries with changed jumps: ", len(plan) - count)
 
 
-def inject_zero_faults(targets, infile, arch):
-    # prepare the fault models
-    fm_list = []
+def plan_zero_faults(plan, targets):
+    count = len(plan)
     for target in targets:
-        try:
-            if target["size"] == 1:
-                config = ExecConfig(
-                    os.path.expanduser(infile), None, arch, None
-                )  # None for outfile and wordsize
-                fault = {
-                    "type": target["type"],
-                    "loc": target["loc"],
-                    "fault": Z1B(config, [target["loc"]]),
-                }
-                fm_list.append(fault)
-            else:
-                config = ExecConfig(
-                    os.path.expanduser(infile), None, arch, target["size"]
-                )
-                fault = {
-                    "type": target["type"],
-                    "loc": target["loc"],
-                    "fault": Z1W(config, [target["loc"]]),
-                }
-                fm_list.append(fault)
-        except SystemExit:
-            pass  # skip targets causing out of range erors and move on
+        if target["size"] == 1:
+            plan.append("Z1B", target["type"], int(target["loc"], 16))
+        else:
+            plan.append("Z1W", target["type"], int(target["loc"], 16), target["size"])
     # print("Number of locations to zero: ", len(targets))
-    print("Number of new binaries with zeroed values: ", len(fm_list))
-    # create a folder for faulted binaries
-    Path("faulted-binaries").mkdir(parents=True, exist_ok=True)
-    # Duplicate the input and then apply the faults
-    for f in fm_list:
-        outfile = "faulted-binaries/%s_at_%s_zeroed" % (f["type"], f["loc"])
-        shutil.copy(infile, outfile)
-        with open(outfile, "r+b") as file:
-            f["fault"].apply(file)
-
-
-def inject_nop_faults(targets, infile, arch):
-    # prepare the fault models
-    fm_list = []
-    for target in targets:
-        try:
-            config = ExecConfig(
-                os.path.expanduser(infile), None, arch, None
-            )  # None for outfile and wordsize
-            addr_from = target["addr"]
-            addr_till = target["addr"] + target["size"] - 1
-            noprange = hex(addr_from) + "-" + hex(addr_till)
-            # print("From %x till %x = Range %s" %(addr_from,addr_till,range))
-            fault = {"range": noprange, "fault": NOP(config, [noprange])}
-            fm_list.append(fault)
-        except SystemExit:
-            pass  # skip targets causing out of range erors and move on
-    # print("Number of instructions to be NOPed: ", len(targets))
-    print("Number of new binaries with NOPed instructions: ", len(fm_list))
-    # create a folder for faulted binaries
-    Path("faulted-binaries").mkdir(parents=True, exist_ok=True)
-    # Duplicate the input and then apply the faults
-    for f in fm_list:
-        outfile = "faulted-binaries/nop_%s" % f["range"]
-        shutil.copy(infile, outfile)
-        with open(outfile, "r+b") as file:
-            f["fault"].apply(file)
-
-
-def inject_flp_faults(targets, infile, arch):
-    # prepare the fault models
-    fm_list = []
-    for target in targets:
-        try:
-            config = ExecConfig(
-                os.path.expanduser(infile), None, arch, None
-            )  # None for outfile and wordsize
-            addr_from = target["addr"]
-            for offset in range(0, target["size"]):
-                loc = hex(addr_from + offset)
-
-                # with static significance bit
-                # sgnf = 5
-                # fault = {'loc':loc, 'sgnf':sgnf, 'fault':FLP(config,[loc,sgnf])}
-                # fm_list.append(fault)
-
-                # or with varied significance bit
-                for sgnf in range(0, 8):
-                    fault = {
-                        "loc": loc,
-                        "sgnf": sgnf,
-                        "fault": FLP(config, [loc, sgnf]),
-                    }
-                    fm_list.append(fault)
-        except SystemExit:
-            pass  # skip targets causing out of range erors and move on
-    # print("Number of instructions to be FLPed: ", len(targets))
-    print("Number of new binaries with FLPed instructions: ", len(fm_list))
-    # create a folder for faulted binaries
-    Path("faulted-binaries").mkdir(parents=True, exist_ok=True)
-    # Duplicate the input and then apply the faults
-    for f in fm_list:
-        outfile = "faulted-binaries/flp_at_%s_sgnf_%d" % (f["loc"], f["sgnf"])
-        shutil.copy(infile, outfile)
-        with open(outfile, "r+b") as file:
-            f["fault"].apply(file)
-
-
-def run_faulty_binaries(infile, arch):
+    print("Number of new binaries with zeroed values: ", len(plan) - count)
+
+
+def plan_nop_faults(plan, table):
+    count = len(plan)
+    # one NOP range per instruction, straight from the table columns
+    plan.extend_rows(len(table), "NOP", "nop", table.addr, array("q", table.size))
+    # print("Number of instructions to be NOPed: ", len(table))
+    print("Number of new binaries with NOPed instructions: ", len(plan) - count)
+
+
+def plan_flp_faults(plan, table):
+    count = len(plan)
+    # every byte of every instruction
+    locs = array("q")
+    for addr, size in zip(table.addr, table.size):
+        locs.extend(range(addr, addr + size))
+    # with static significance bit
+    # plan.extend_rows(len(locs), 'FLP', 'flp', locs, 5)
+
+    # or with varied significance bit
+    sgnfs = range(0, 8)
+    offsets = array("q", (loc for loc in locs for sgnf in sgnfs))
+    params = array("q", sgnfs) * len(locs)
+    plan.extend_rows(len(offsets), "FLP", "flp", offsets, params)
+    # print("Number of instructions to be FLPed: ", len(table))
+    print("Number of new binaries with FLPed instructions: ", len(plan) - count)
+
+
+def build_plan(table, jumps, cmpsmovs, image, arch, targets=None):
+    # the plan only holds a few integers per fault, the fault model objects are
+    # built right before the execution, the jumps are retargeted
+    # to the instructions of targets (default: table)
+    plan = CampaignPlan(image.path, arch)
+    if targets is None:
+        targets = table
+    plan_jump_faults(plan, jumps, targets, image)
+    plan_zero_faults(plan, cmpsmovs)
+    plan_nop_faults(plan, table)
+    plan_flp_faults(plan, table)
+    return plan
+
+
+def run_faulty_binaries(
+    plan,
+    in_memory=False,
+    keep=False,
+    concurrency=50,
+    fork_server=None,
+    emulate=None,
+    budget=BUDGET,
+    persistent=False,
+    timeout=None,
+    timeout_factor=FACTOR,
+    timeout_floor=FLOOR,
+    timeout_ceiling=CEILING,
+    limits=DEFAULT_LIMITS,
+    oracles=(),
+    oracle_specs=(),
+    store=None,
+    resume=False,
+    export=None,
+    dedup=True,
+    predictor=None,
+    validation_rate=VALIDATION_RATE,
+    order=1,
+    ranks=None,
+):
+    # a single event loop drives the faulted binaries, fed with (fault index,
+    # input) work items in binary-major order: the runs of a faulted binary
+    # with all the input vectors are adjacent, the results are stored as
+    # they complete
+    infile, arch = plan.infile, plan.arch
     print("\nRunning the faulty binaries and recording the results...\n")
     print("This may take a while...\n")
-    keys = ["00010203040506070809", "01234567890987654321", "deadbeafdeadc0debabe"]
-    plaintexts = ["badf00dbadc0ffee", "deadbeafbabec0de", "1ceb00dab10sf00d"]
-    with open("results.csv", "w") as csvfile:
-        writer = csv.writer(csvfile, delimiter=",")
-        faulty_binaries_list = os.listdir("faulted-binaries")
-        batchsize = 1000  # execute files in batches of 1000
-        for key in keys:
-            for plaintext in plaintexts:
-                print("Using key %s and plaintext %s" % (key, plaintext))
-                # function to run the faulty binaries
-                func = partial(
-                    execute_file, key, plaintext, arch
-                )  # hack to pass more than 1 argument to execute_file function
-                for i in range(0, len(faulty_binaries_list), batchsize):
-                    batch = faulty_binaries_list[i : i + batchsize]
-                    with Pool(processes=50) as pool:
-                        results = pool.imap(func, batch)
-                        pool.close()
-                        for res in results:
-                            # if '0xba 0xdf 0x00 0xdb 0xad 0xc0 0xff 0xee' in res['stdout']:
-                            # if b'0xba 0xdf 0x00 0xdb 0xad 0xc0 0xff 0xee' in res['stdout']:
-                            # print("BINGO! Plaintext instead of cipher in",res['filename'])
-                            writer.writerow(
-                                [
-                                    infile,
-                                    res["filename"],
-                                    key,
-                                    plaintext,
-                                    res["stdout"],
-                                    res["stderr"],
-                                    res["exitcode"],
-                                    res["timedout"],
-                                ]
-                            )
-
-
-def execute_file(key, plaintext, arch, filename):
+    if not in_memory:
+        # create a folder for faulted binaries
+        Path("faulted-binaries").mkdir(parents=True, exist_ok=True)
+    image = BinaryImage(infile)  # original binary, patched for each run
+    if persistent:
+        inputs = [(pin, "") for pin in PINS]
+    else:
+        inputs = [(key, plaintext) for key in KEYS for plaintext in PLAINTEXTS]
+    if store is None:
+        store = ResultStore("results.db")
+        closing = store  # closed at the end, the last batch is committed
+    else:
+        closing = nullcontext()
+    binary = store.binary(image_hash(image), infile)
+    done = set()
+    known = set()
+    if resume:
+        # the runs already stored by an interrupted campaign are skipped
+        done = store.completed(binary)
+        known = store.load_goldens(binary)
+        print("Resuming the campaign, %d runs already stored\n" % len(done))
+    # the runs are stored as references to their outputs, flagged when they
+    # deviate from the golden run of their input
+    missing = [i for i in inputs if input_id(*i) not in known]
+    record_goldens(store, binary, image, arch, missing, persistent, limits.output)
+    duplicate, members = bytearray(len(plan)), {}
+    if dedup:
+        # the faults producing the same faulted binary run once, their
+        # representative's result is recorded for all of them
+        duplicate, members = equivalence_classes(plan, image)
+        print("Number of distinct faulted binaries: ", len(plan) - sum(duplicate))
+        print()
+    stream = None
+    if order > 1:
+        # the combinations of faults are streamed, pruned with the golden
+        # traces and with the crashes of the single faults stored
+        crashed = store.crashed(binary)
+        if not crashed:
+            print("No crash of a single fault stored, the pruning skips none\n")
+        stream = Combinations(plan, image, order, ranks, duplicate, crashed)
+        print("Number of combined faults: ", len(stream.candidates))
+        print("Number of combinations: ", len(stream))
+        print()
+        items = stream.items(inputs, done)
+        members = {}
+    else:
+        items = pending_items(plan, inputs, done, duplicate, members)
+    if timeout is not None:
+        timeouts = {i: timeout for i in inputs}
+    else:
+        timeouts = calibrate_timeouts(
+            image,
+            arch,
+            inputs,
+            persistent,
+            timeout_factor,
+            timeout_floor,
+            timeout_ceiling,
+            concurrency,
+        )
+    servers = None
+    if fork_server is not None:
+        # one fork server of the original binary per concurrent run
+        servers = asyncio.Queue()
+        premain = premain_offsets(image)
+        for _ in range(concurrency):
+            servers.put_nowait(ForkServer(image, fork_server, premain, limits))
+    emulators = None
+    if emulate is not None:
+        # one snapshot at the entry of the function per input, the faulted
+        # runs restart from it in emulators run by worker threads, off the
+        # event loop; an emulator is not thread-safe, it runs one run at a time
+        emulators = {}
+        workers = min(concurrency, os.cpu_count() or 1)
+        for key, plaintext in inputs:
+            snapshot = function_snapshot(image, emulate, [key, plaintext])
+            if snapshot is not None:
+                emulators[key, plaintext] = asyncio.Queue()
+                for _ in range(workers):
+                    emulators[key, plaintext].put_nowait(
+                        Emulator(image, snapshot, budget, limits.output)
+                    )
+    harnesses = None
+    if persistent:
+        # one persistent harness per concurrent run, each runs many iterations
+        harnesses = asyncio.Queue()
+        ranges = benchmark_ranges(image)
+        for _ in range(concurrency):
+            harnesses.put_nowait(PersistentHarness(image, ranges, limits))
+    injectors = None
+    if any(plan.occurrence):
+        # ptrace blocks its caller, the transient faults are injected by
+        # worker processes
+        injectors = ProcessPoolExecutor(concurrency)
+    func = partial(
+        execute_fault,
+        plan,
+        image,
+        arch,
+        in_memory,
+        keep,
+        servers,
+        emulators,
+        injectors,
+        harnesses,
+        timeouts,
+        limits,
+        oracles,
+        predictor,
+        ValidationSample(validation_rate),
+    )
+    predictions = {"skipped": 0, "run": 0, "confirmed": 0}
+
+    async def record():
+        try:
+            async for res in bounded_as_completed(func, items, concurrency):
+                if res is None:
+                    continue  # fault rejected by its fault model
+                i = res["index"]
+                if res["predicted"] is not None:
+                    if res["executed"]:
+                        predictions["run"] += 1
+                        confirmed = res["exitcode"] == res["predicted"]
+                        predictions["confirmed"] += confirmed
+                    else:
+                        predictions["skipped"] += 1
+                for j in [i] + members.get(i, []):
+                    name, model, site, occurrence = fault_columns(plan, j)
+                    for spec, verdict in zip(oracle_specs, res["verdicts"]):
+                        if verdict:
+                            print("BINGO!", spec, "holds in", name)
+                    store.add(
+                        {
+                            "binary": binary,
+                            "fault": name,
+                            "input": input_id(res["key"], res["plaintext"]),
+                            "model": model,
+                            "site": site,
+                            "occurrence": occurrence,
+                            "stdout": res["stdout"],
+                            "stderr": res["stderr"],
+                            "exitcode": res["exitcode"],
+                            "timedout": res["timedout"],
+                            "truncated": res["truncated"],
+                            "stopped": res["stopped"],
+                            "verdicts": res["verdicts"],
+                            "executed": res["executed"],
+                            "predicted": res["predicted"],
+                        }
+                    )
+        finally:
+            if servers is not None:
+                while not servers.empty():
+                    await servers.get_nowait().stop()
+            if harnesses is not None:
+                while not harnesses.empty():
+                    await harnesses.get_nowait().stop()
+            if injectors is not None:
+                injectors.shutdown()
+
+    with closing:
+        asyncio.run(record())
+        if stream is not None:
+            print(
+                "\nPruned runs: %d not executed by the golden run, %d after a "
+                "crash of the first fault, %d overlapping"
+                % (
+                    stream.pruned["unexecuted"],
+                    stream.pruned["crash"],
+                    stream.pruned["overlap"],
+                )
+            )
+        if predictor is not None:
+            print(
+                "\nPredicted crashes: %d runs skipped, %d of the %d runs for "
+                "validation crashed as predicted"
+                % (predictions["skipped"], predictions["confirmed"], predictions["run"])
+            )
+        if export is not None:
+            store.export(export, binary)
+            print("Results exported to", export)
+
+
+def fault_columns(plan, index):
+    """Name, model, site and occurrence of a fault, or of a tuple of faults run at once."""
+    if isinstance(index, tuple):
+        name = "+".join(plan.name(i) for i in index)
+        return name, combined_model(plan, index), plan.offset[index[0]], 0
+    model = MODELS[plan.model[index]].name
+    return plan.name(index), model, plan.offset[index], plan.occurrence[index]
+
+
+def pending_items(plan, inputs, done, duplicate, members):
+    """The (fault index, key, plaintext) work items whose run is not in done.
+
+    A representative runs while the run of one of the faults of its class is
+    missing, the other faults of a class never run.
+
+    :param done: set of (fault name, input id) of the runs already stored
+    :param duplicate: duplicate[i] is 1 if the i-th fault is not run
+    :param members: the other faults of the class of a representative
+    """
+    for index in range(len(plan)):
+        if duplicate[index]:
+            continue
+        names = []
+        if done:
+            names = [plan.name(j) for j in [index] + members.get(index, [])]
+        for key, plaintext in inputs:
+            input = input_id(key, plaintext)
+            if not done or any((name, input) not in done for name in names):
+                yield index, key, plaintext
+
+
+def calibrate_timeouts(
+    image, arch, inputs, persistent, factor, floor, ceiling, concurrency
+):
+    # a faulted run is killed after factor times the median duration of the
+    # golden runs with its input, measured in the same conditions: under qemu
+    # for ARM, fed with a request for a persistent harness
+    print("Calibrating the timeouts with the golden runs...\n")
+    path = os.path.abspath(image.path)
+    timeouts = {}
+    for key, plaintext in inputs:
+        if persistent:
+            times = golden_times([path], stdin=encode_request(image, [], key))
+        else:
+            times = golden_times(build_command(path, key, plaintext, arch))
+        timeout = calibrated_timeout(times, factor, floor, concurrency, ceiling)
+        timeouts[key, plaintext] = timeout
+        print("Timeout with %s %s: %.3f s" % (key, plaintext, timeout))
+        if percentile(times, 50) >= timeout:
+            print("The golden runs take longer, raise --timeout-ceiling")
+    print()
+    return timeouts
+
+
+def record_goldens(store, binary, image, arch, inputs, persistent, limit):
+    # the output of the original binary with each input, cut at the output
+    # limit of the faulted runs
+    path = os.path.abspath(image.path)
+    for key, plaintext in inputs:
+        if persistent:
+            stdin = encode_request(image, [], key)
+            golden = golden_outputs([path], stdin)
+            if golden is not None and len(golden[0]) == RESULT.size:
+                golden = (render(golden[0]),) + golden[1:]
+        else:
+            golden = golden_outputs(build_command(path, key, plaintext, arch))
+        if golden is None:
+            print("The golden run with %s %s does not finish" % (key, plaintext))
+            continue
+        stdout, stderr, exitcode = golden
+        store.set_golden(
+            binary, input_id(key, plaintext), stdout[:limit], stderr[:limit], exitcode
+        )
+
+
+def build_command(path, key, plaintext, arch):
     if arch == "x86":
-        command = "faulted-binaries/%s %s %s" % (filename, key, plaintext)
+        command = [path, key, plaintext]
     elif arch == "arm":
-        command = "qemu-arm -L /usr/arm-linux-gnueabi/ faulted-binaries/%s %s %s" % (
-            filename,
+        command = QEMU_ARM + [path, key, plaintext]
+    return command
+
+
+run_ids = count()  # distinguishes the copies of a faulted binary on disk
+
+
+async def execute_fault(
+    plan,
+    image,
+    arch,
+    in_memory,
+    keep,
+    servers,
+    emulators,
+    injectors,
+    harnesses,
+    timeouts,
+    limits,
+    oracles,
+    predictor,
+    validation,
+    item,
+):
+    index, key, plaintext = item
+    timeout = timeouts[key, plaintext]
+    if isinstance(index, tuple):
+        f = combined(plan, index, image)  # several faults at once
+    else:
+        f = plan.materialize(index, image)
+    if f is None:
+        return None
+    patches = f["patches"] if "patches" in f else [f["fault"].patch]
+    # the oracles are evaluated on the output as it comes, the run is stopped
+    # once they are all decided
+    evaluation = Evaluation(oracles)
+    res = None
+    predicted = None
+    if predictor is not None and "fault" in f and "occurrence" not in f:
+        predicted = predictor.predict(patches, input_id(key, plaintext))
+        chosen = predicted is not None and validation(f["name"], f["fault"].name)
+        if predicted is not None and not chosen:
+            # a predicted crash is not run, but for a sample of the faults
+            # validating the predictions
+            res = {
+                "filename": f["name"],
+                "stdout": b"",
+                "stderr": b"",
+                "exitcode": predicted,
+                "timedout": False,
+                "truncated": False,
+                "stopped": False,
+                "executed": False,
+            }
+    if res is None and "occurrence" in f:
+        res = await inject_fault(
+            injectors, image, f, patches, key, plaintext, timeout, limits, evaluation
+        )
+        evaluation = res.pop("evaluation")  # fed in the worker process
+    if res is None and emulators is not None:
+        res = await emulate_fault(
+            emulators, f["name"], patches, key, plaintext, evaluation
+        )
+    if res is None and servers is not None:
+        res = await fork_fault(
+            servers, f["name"], patches, key, plaintext, timeout, evaluation
+        )
+    request = None
+    if res is None and harnesses is not None:
+        res = await persistent_fault(
+            harnesses, f["name"], patches, key, timeout, evaluation
+        )
+        # a faulted harness binary runs the single iteration of its stdin
+        request = encode_request(image, [], key)
+    if res is None:
+        res = await exec_fault(
+            image,
+            f["name"],
+            patches,
             key,
             plaintext,
+            arch,
+            in_memory,
+            keep,
+            timeout,
+            limits,
+            request,
+            None if request is not None else evaluation,
+        )
+        if request is not None and len(res["stdout"]) == RESULT.size:
+            res["stdout"] = render(res["stdout"])
+            evaluation.feed(1, res["stdout"])
+    res["verdicts"] = evaluation.exit(res["exitcode"], res["timedout"])
+    res.setdefault("executed", True)
+    res["predicted"] = predicted
+    res["index"] = index
+    res["key"] = key
+    res["plaintext"] = plaintext
+    return res
+
+
+async def inject_fault(
+    injectors, image, f, patches, key, plaintext, timeout, limits, evaluation
+):
+    # run the original binary and apply the patches to its code during one
+    # execution of the instruction of the fault only
+    patches = [(p.offset, p.resolve(image[p.offset : p.end])) for p in patches]
+    args = [os.path.abspath(image.path), key, plaintext]
+    loop = asyncio.get_running_loop()
+    site, occurrence = f["site"], f["occurrence"]
+    outs, errs, exitcode, timedout, truncated, stopped, evaluation = (
+        await loop.run_in_executor(
+            injectors,
+            inject,
+            args,
+            site,
+            patches,
+            occurrence,
+            timeout,
+            limits,
+            evaluation,
         )
-    args = shlex.split(command)
-    # p = Popen(args,stdout=PIPE,stderr=PIPE,universal_newlines=True) # extract stdout in a textual utf-8 format
-    p = Popen(args, stdout=PIPE, stderr=PIPE)  # extract stdout in a binary-like format
+    )
+    return {
+        "filename": f["name"],
+        "stdout": outs,
+        "stderr": errs,
+        "exitcode": exitcode,
+        "timedout": timedout,
+        "truncated": truncated,
+        "stopped": stopped,
+        "evaluation": evaluation,
+    }
+
+
+async def emulate_fault(emulators, name, patches, key, plaintext, evaluation):
+    # run from the snapshot of the input in an emulator, None if the function
+    # is not called with this input or the patches hit code which already ran
+    queue = emulators.get((key, plaintext))
+    if queue is None:
+        return None
+    emulator = await queue.get()
+    if not emulator.patchable(patches):
+        queue.put_nowait(emulator)
+        return None
+    # up to the whole budget of instructions, in a worker thread
+    loop = asyncio.get_running_loop()
+    outs, errs, exitcode, timedout, truncated, stopped = await loop.run_in_executor(
+        None, emulator.run, patches, evaluation
+    )
+    queue.put_nowait(emulator)  # not if cancelled, its thread may still run it
+    return {
+        "filename": name,
+        "stdout": outs,
+        "stderr": errs,
+        "exitcode": exitcode,
+        "timedout": timedout,
+        "truncated": truncated,
+        "stopped": stopped,
+    }
+
+
+async def fork_fault(servers, name, patches, key, plaintext, timeout, evaluation):
+    # run main in a child of a fork server, patched in memory, None if the
+    # patches hit code which already ran before main
+    server = await servers.get()
     try:
-        outs, errs = p.communicate(timeout=3)  # 3 sec
-        # print(filename,outs,errs,p.returncode)
-        return {
-            "filename": filename,
-            "stdout": outs,
-            "stderr": errs,
-            "exitcode": p.returncode,
-            "timedout": False,
-        }
-    except TimeoutExpired:
-        p.kill()
-        outs, errs = p.communicate()
-        # print(filename,outs,errs,p.returncode)
-        return {
-            "filename": filename,
-            "stdout": outs,
-            "stderr": errs,
-            "exitcode": p.returncode,
-            "timedout": True,
-        }
+        if not server.patchable(patches):
+            return None
+        outs, errs, exitcode, timedout, truncated, stopped = await server.run(
+            patches, [key, plaintext], timeout, evaluation
+        )
     finally:
-        p.kill()
+        servers.put_nowait(server)
+    return {
+        "filename": name,
+        "stdout": outs,
+        "stderr": errs,
+        "exitcode": exitcode,
+        "timedout": timedout,
+        "truncated": truncated,
+        "stopped": stopped,
+    }
+
+
+async def persistent_fault(harnesses, name, patches, pin, timeout, evaluation):
+    # run an iteration of a persistent harness with the patches applied, None if
+    # the patches hit code which does not run in the iterations
+    harness = await harnesses.get()
+    try:
+        if not harness.patchable(patches):
+            return None
+        outs, errs, exitcode, timedout, truncated, stopped = await harness.run(
+            patches, pin, timeout, evaluation
+        )
+    finally:
+        harnesses.put_nowait(harness)
+    return {
+        "filename": name,
+        "stdout": outs,
+        "stderr": errs,
+        "exitcode": exitcode,
+        "timedout": timedout,
+        "truncated": truncated,
+        "stopped": stopped,
+    }
+
+
+async def exec_fault(
+    image,
+    name,
+    patches,
+    key,
+    plaintext,
+    arch,
+    in_memory,
+    keep,
+    timeout,
+    limits,
+    request=None,
+    evaluation=None,
+):
+    if in_memory:
+        # patch a copy of the original image held in an anonymous memfd and exec it
+        fd = memfd_image(image.data, patches, name)
+        try:
+            args = build_command(fd_path(fd), key, plaintext, arch)
+            return await execute_command(
+                args, name, timeout, limits, (fd,), request, evaluation
+            )
+        finally:
+            os.close(fd)
+    # write the faulted binary just before running it and discard it afterwards,
+    # the other inputs of the same binary may run concurrently so each run has
+    # its own copy
+    outfile = "faulted-binaries/%s.%d" % (name, next(run_ids))
+    with open(outfile, "wb") as file:
+        file.write(patched_image(image.data, patches))
+    os.chmod(outfile, 0o755)
+    try:
+        args = build_command(outfile, key, plaintext, arch)
+        return await execute_command(
+            args, name, timeout, limits, stdin=request, evaluation=evaluation
+        )
+    finally:
+        if keep:
+            os.replace(outfile, "faulted-binaries/%s" % name)
+        else:
+            os.remove(outfile)
+
+
+async def execute_command(
+    args, filename, timeout, limits, pass_fds=(), stdin=None, evaluation=None
+):
+    # the binary runs in its own process group (session) with rlimits, on
+    # timeout the whole group is killed, including the processes it may have
+    # spawned; only the beginning of its output is kept
+    outs, errs, exitcode, timedout, truncated, stopped = await run_sandboxed(
+        args, timeout, limits, pass_fds, stdin, evaluation
+    )
+    # print(filename,outs,errs,exitcode)
+    return {
+        "filename": filename,
+        "stdout": outs,
+        "stderr": errs,
+        "exitcode": exitcode,
+        "timedout": timedout,
+        "truncated": truncated,
+        "stopped": stopped,
+    }
+
+
+def target_ranges(image, args):
+    # union of the code selected by the --function, --source and --range filters
+    ranges = []
+    if args.function:
+        ranges += function_ranges(image, args.function)
+    for spec in args.source:
+        ranges += line_ranges(image, *parse_line_range(spec))
+    for spec in args.range:
+        ranges += address_ranges(image, *parse_address_range(spec))
+    return ranges
 
 
 def main(argv):
-    infile = argv[1]
-    arch = argv[2]
-    if arch == "x86":
-        allinstr, jumps, cmpsmovs = extract_x86_instructions(infile)
-    elif arch == "arm":
-        allinstr, jumps, cmpsmovs = extract_arm_instructions(infile)
-    print("Number of detected instructions: ", len(allinstr))
-    inject_jump_faults(jumps, allinstr, infile, arch)
-    inject_zero_faults(cmpsmovs, infile, arch)
-    inject_nop_faults(allinstr, infile, arch)
-    inject_flp_faults(allinstr, infile, arch)
-    run_faulty_binaries(infile, arch)
+    parser = argparse.ArgumentParser(
+        description="Inject faults in a binary and record the faulty executions"
+    )
+    parser.add_argument("infile", metavar="BINARY", help="binary to fault")
+    parser.add_argument(
+        "arch", choices=["x86", "arm"], help="architecture of the binary"
+    )
+    parser.add_argument(
+        "-m",
+        "--in-memory",
+        action="store_true",
+        help="patch and run the faulted binaries from memory instead of "
+        "writing them to faulted-binaries/",
+    )
+    parser.add_argument(
+        "-k",
+        "--keep-binaries",
+        action="store_true",
+        help="keep the faulted binaries in faulted-binaries/ after their execution",
+    )
+    parser.add_argument(
+        "--save-plan",
+        metavar="FILE",
+        help="save the campaign plan to FILE before running it",
+    )
+    parser.add_argument(
+        "--load-plan",
+        metavar="FILE",
+        help="run a campaign plan saved with --save-plan instead of disassembling",
+    )
+    parser.add_argument(
+        "--shard",
+        metavar="I/N",
+        help="only run the I-th of N interleaved parts of the plan (0 <= I < N)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        default=default_cache_dir(),
+        help="directory of the disassembly cache (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always disassemble the binary, do not read or write the cache",
+    )
+    parser.add_argument(
+        "-j",
+        "--disasm-jobs",
+        metavar="N",
+        type=int,
+        help="number of processes disassembling the binary (default: one per core)",
+    )
+    parser.add_argument(
+        "-f",
+        "--function",
+        action="append",
+        default=[],
+        metavar="NAME",
+        help="only fault the code of the function NAME (repeatable)",
+    )
+    parser.add_argument(
+        "--source",
+        action="append",
+        default=[],
+        metavar="FILE:FIRST-LAST",
+        help="only fault the code of lines FIRST to LAST of the source FILE, "
+        "from the DWARF line info (repeatable)",
+    )
+    parser.add_argument(
+        "--range",
+        action="append",
+        default=[],
+        metavar="START-END",
+        help="only fault the code between the virtual addresses START and END "
+        "included, as shown by objdump (repeatable)",
+    )
+    parser.add_argument(
+        "-c",
+        "--coverage",
+        action="store_true",
+        help="trace the original binary with every input and only fault the "
+        "instructions it executes",
+    )
+    parser.add_argument(
+        "--concurrency",
+        metavar="N",
+        type=int,
+        default=50,
+        help="number of faulted binaries running at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fork-server",
+        action="store_true",
+        help="x86 only: fork the faulted runs from the original binary stopped "
+        "before main and patch them in memory instead of executing each binary",
+    )
+    parser.add_argument(
+        "--transient",
+        metavar="N",
+        type=int,
+        help="x86 only: inject each fault at run time with ptrace into the "
+        "original binary, during each of the first N executions of its "
+        "instruction (a golden run caps N with --coverage)",
+    )
+    parser.add_argument(
+        "--emulate",
+        metavar="FUNCTION",
+        help="x86-64 only: snapshot the original binary at the entry of FUNCTION "
+        "and emulate the faulted runs from there with unicorn",
+    )
+    parser.add_argument(
+        "--budget",
+        metavar="N",
+        type=int,
+        default=BUDGET,
+        help="number of instructions after which an emulated run is stopped "
+        "and reported as timed out (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--persistent",
+        action="store_true",
+        help="x86 only: BINARY is a persistent VerifyPIN harness (make "
+        "x86-auth-persistent), run the faulted iterations in long-lived "
+        "harness processes with the user PINs as inputs",
+    )
+    parser.add_argument(
+        "--timeout",
+        metavar="SECONDS",
+        type=float,
+        help="kill the faulted runs after SECONDS instead of calibrating the "
+        "timeout of each input from the golden runs",
+    )
+    parser.add_argument(
+        "--timeout-factor",
+        metavar="K",
+        type=float,
+        default=FACTOR,
+        help="calibrated timeout: K times the median duration of the golden "
+        "runs, stretched by the load (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--timeout-floor",
+        metavar="SECONDS",
+        type=float,
+        default=FLOOR,
+        help="added to the calibrated timeout (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--timeout-ceiling",
+        metavar="SECONDS",
+        type=float,
+        default=CEILING,
+        help="the calibrated timeout never exceeds SECONDS (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output-limit",
+        metavar="BYTES",
+        type=int,
+        default=OUTPUT_LIMIT,
+        help="bytes of stdout and of stderr kept per run, the rest is dropped "
+        "and the run flagged truncated (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        metavar="MIB",
+        type=int,
+        default=DEFAULT_LIMITS.address_space >> 20,
+        help="address space of a faulted run, 0 for no limit, x86 only "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--oracle",
+        action="append",
+        default=[],
+        metavar="SPEC",
+        help="record whether the runs satisfy SPEC, one column per oracle "
+        "(repeatable): auth, ptc (VerifyPIN), contains[@stderr]:TEXT, "
+        "regex[@stderr]:REGEX, exit:CODE[,CODE...], !SPEC, combined with "
+        "' && ' or ' || '; a run is stopped once all its verdicts are known",
+    )
+    parser.add_argument(
+        "--predict-crashes",
+        action="store_true",
+        help="skip the runs of the faults predicted to crash from the golden "
+        "traces and the decoding of the patched code (x86), but for a sample",
+    )
+    parser.add_argument(
+        "--validation-rate",
+        type=float,
+        default=VALIDATION_RATE,
+        metavar="RATE",
+        help="fraction of the faults predicted to crash still run to validate "
+        "the predictions, at least one per fault model (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--order",
+        type=int,
+        default=1,
+        metavar="N",
+        help="fault N sites at once in each run (default: %(default)s), the "
+        "combinations are pruned with the golden traces and the crashes of "
+        "the single faults stored in the database",
+    )
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="run every fault, even when another one produces the same "
+        "faulted binary",
+    )
+    parser.add_argument(
+        "--db",
+        default="results.db",
+        metavar="FILE",
+        help="SQLite database storing the results (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the runs already stored in the database for this binary",
+    )
+    parser.add_argument(
+        "--export",
+        metavar="FILE",
+        help="export the results of the binary to FILE after the campaign, "
+        "as CSV or JSON lines depending on the extension (.csv or .jsonl)",
+    )
+    args = parser.parse_args(argv[1:])
+    if args.export is not None and not args.export.endswith((".csv", ".jsonl")):
+        parser.error("--export needs a .csv or a .jsonl file")
+    shard = None
+    if args.shard is not None:
+        match = re.fullmatch(r"(\d+)/(\d+)", args.shard)
+        if match is None:
+            parser.error("--shard needs I/N, two integers")
+        shard = int(match[1]), int(match[2])
+        if not 0 <= shard[0] < shard[1]:
+            parser.error("--shard I/N needs 0 <= I < N")
+    if args.persistent and args.coverage:
+        # the harness traced without a request on its stdin runs no iteration
+        parser.error("--persistent cannot be combined with --coverage")
+    if args.order < 1:
+        parser.error("--order needs at least one fault")
+    if args.order > 1 and (args.load_plan, args.transient) != (None, None):
+        parser.error("--order cannot be combined with --load-plan or --transient")
+    try:
+        oracles = [parse_oracle(spec) for spec in args.oracle]
+    except (ValueError, re.error) as e:
+        parser.error(e)
+    infile = args.infile
+    arch = args.arch
+    if args.load_plan is not None:
+        plan = CampaignPlan.load(args.load_plan)
+    else:
+        # the binary is mapped once and shared by the disassembler and the planner
+        image = BinaryImage(infile)
+        if arch == "x86":
+            extract = extract_x86_instructions
+        elif arch == "arm":
+            extract = extract_arm_instructions
+        extract = partial(extract, processes=args.disasm_jobs)
+        cache_dir = None if args.no_cache else args.cache_dir
+        table, jumps, cmpsmovs = cached_extraction(
+            image, arch, extract, EXTRACTOR_VERSION, cache_dir
+        )
+        print("Number of detected instructions: ", len(table))
+        if args.function or args.source or args.range:
+            try:
+                ranges = target_ranges(image, args)
+            except ValueError as e:
+                parser.error(e)
+            table, jumps, cmpsmovs = restrict(table, jumps, cmpsmovs, ranges)
+            print("Number of targeted instructions: ", len(table))
+        targets = table  # faults can still jump to code which never runs
+        if args.coverage:
+            print("Tracing the golden runs...\n")
+            commands = [[infile, k, p] for k in KEYS for p in PLAINTEXTS]
+            # the most executions in a single run cap the transient occurrences
+            coverage = peak_coverage(image, arch, commands, cache_dir, QEMU_ARM)
+            ranges = executed_ranges(table, coverage)
+            table, jumps, cmpsmovs = restrict(table, jumps, cmpsmovs, ranges)
+            print("Number of executed instructions: ", len(table))
+        plan = build_plan(table, jumps, cmpsmovs, image, arch, targets)
+        if args.transient is not None:
+            if arch != "x86":
+                parser.error("the transient faults are only injected in x86 binaries")
+            plan = plan.transient(
+                table, args.transient, coverage if args.coverage else None
+            )
+            print("Number of transient faults: ", len(plan))
+    if args.save_plan is not None:
+        plan.save(args.save_plan)
+    if shard is not None:
+        plan = plan.shard(*shard)
+    print("Number of planned faults: ", len(plan))
+    fork_server = None
+    if args.fork_server:
+        if plan.arch != "x86":
+            parser.error("the fork server only runs native x86 binaries")
+        image = BinaryImage(plan.infile)
+        if not supports_fork_server(image):
+            parser.error(
+                "the fork server needs a dynamically linked binary with a main symbol"
+            )
+        fork_server = build_shim(args.cache_dir, image.elf.elfclass)
+    emulate = None
+    if args.emulate is not None:
+        image = BinaryImage(plan.infile)
+        if plan.arch != "x86" or image.elf is None or image.elf.elfclass != 64:
+            parser.error("the emulation only snapshots native x86-64 binaries")
+        if not emulation_available():
+            parser.error("--emulate needs the unicorn module (pip install unicorn)")
+        try:
+            emulate = function_ranges(image, [args.emulate])[0][0]
+        except ValueError as e:
+            parser.error(e)
+    if args.persistent:
+        if plan.arch != "x86":
+            parser.error("the persistent harness only runs native x86 binaries")
+        if args.order > 1:
+            parser.error("--persistent cannot be combined with --order")
+        if fork_server is not None or emulate is not None or any(plan.occurrence):
+            parser.error(
+                "--persistent cannot be combined with --fork-server, --emulate "
+                "or --transient"
+            )
+        image = BinaryImage(plan.infile)
+        path = os.path.abspath(plan.infile)
+        if image.elf is None or not probe(path, image, PINS[0], GOLDEN_TIMEOUT):
+            parser.error("%s is not a persistent harness" % plan.infile)
+    predictor = None
+    if args.predict_crashes:
+        if plan.arch != "x86" or args.persistent:
+            parser.error("the crashes are only predicted for native x86 binaries")
+        image = BinaryImage(plan.infile)
+        cache_dir = None if args.no_cache else args.cache_dir
+        print("Tracing the golden runs...\n")
+        coverages = {
+            input_id(k, p): golden_coverage(
+                image, "x86", [[plan.infile, k, p]], cache_dir
+            )
+            for k in KEYS
+            for p in PLAINTEXTS
+        }
+        predictor = CrashPredictor(image, coverages)
+    ranks = None
+    if args.order > 1:
+        # when each fault site runs first in the golden run of each input
+        print("Tracing the golden runs...\n")
+        ranks = {
+            input_id(k, p): site_ranks(
+                plan,
+                table,
+                golden_coverage(image, arch, [[infile, k, p]], cache_dir, QEMU_ARM),
+            )
+            for k in KEYS
+            for p in PLAINTEXTS
+        }
+    if plan.arch == "x86":
+        memory = args.memory_limit << 20 or None
+        limits = Limits(None, memory, FILE_SIZE, PROCESSES, args.output_limit)
+    else:
+        # qemu-arm reserves the address space of the guest and starts threads
+        limits = Limits(None, None, FILE_SIZE, None, args.output_limit)
+    try:
+        store = ResultStore(args.db)
+    except (ValueError, sqlite3.Error) as e:
+        parser.error(e)
+    with store:
+        run_faulty_binaries(
+            plan,
+            args.in_memory,
+            args.keep_binaries,
+            args.concurrency,
+            fork_server,
+            emulate,
+            args.budget,
+            args.persistent,
+            args.timeout,
+            args.timeout_factor,
+            args.timeout_floor,
+            args.timeout_ceiling,
+            limits,
+            oracles,
+            args.oracle,
+            store,
+            args.resume,
+            args.export,
+            not args.no_dedup,
+            predictor,
+            args.validation_rate,
+            args.order,
+            ranks,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+
+from duck.table import InstructionTable
+
+
+def default_cache_dir():
+    """~/.cache/chaosduck, or under $XDG_CACHE_HOME when it is set."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "chaosduck")
+
+
+def image_hash(image):
+    """SHA-256 of the content of a BinaryImage, computed once per image."""
+    digest = getattr(image, "sha256", None)
+    if digest is None:
+        digest = image.sha256 = hashlib.sha256(image.data).hexdigest()
+    return digest
+
+
+def cache_path(cache_dir, image, arch, version):
+    """Path of the cache entry of the extraction of a binary.
+
+    The key is the content hash of the binary, the architecture and the version
+    of the extractor, a new binary or extractor never reuses a stale entry.
+    """
+    name = "%s-%s-v%d.dis" % (image_hash(image), arch, version)
+    return os.path.join(cache_dir, name)
+
+
+def save_extraction(path, table, jumps, cmpsmovs):
+    """Store the extraction: a JSON header line followed by the raw instruction columns.
+
+    The few jumps and cmp/mov candidates live in the header, the instruction
+    table is stored column after column as typed arrays.
+    """
+    header = {
+        "count": len(table),
+        "mnemonics": table.mnemonics,
+        "jumps": jumps,
+        "cmpsmovs": cmpsmovs,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(json.dumps(header).encode() + b"\n")
+        table.tofile(f)
+    os.replace(tmp, path)  # readers never see a partial entry
+
+
+def load_extraction(path):
+    """Load an extraction stored by save_extraction.
+
+    :return: (table, jumps, cmpsmovs), None if there is no valid entry
+    """
+    try:
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            table = InstructionTable.fromfile(f, header["mnemonics"], header["count"])
+    except (OSError, ValueError, EOFError, KeyError):
+        return None
+    return table, header["jumps"], header["cmpsmovs"]
+
+
+def cached_extraction(image, arch, extract, version, cache_dir):
+    """Run the extractor, or reuse its result from the on-disk cache.
+
+    :param image: the BinaryImage of the binary
+    :param arch: 'x86' or 'arm'
+    :param extract: the extractor function, called with the image on a miss
+    :param version: version of the extractor, part of the cache key
+    :param cache_dir: directory of the cache, None to disable it
+    :return: (table, jumps, cmpsmovs)
+    """
+    if cache_dir is None:
+        return extract(image)
+    path = cache_path(cache_dir, image, arch, version)
+    cached = load_extraction(path)
+    if cached is not None:
+        print("Using the cached disassembly %s\n" % path)
+        return cached
+    extracted = extract(image)
+    if extracted is not None:
+        save_extraction(path, *extracted)
+    return extracted
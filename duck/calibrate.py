@@ -0,0 +1,77 @@
+import math
+import os
+import time
+from subprocess import DEVNULL, PIPE, TimeoutExpired, run
+
+REPEAT = 20  # golden runs per input
+FACTOR = 10  # timeout = floor + FACTOR x median of the golden runs
+FLOOR = 0.2  # seconds, covers the jitter of the process start-up
+MAX_LOAD = 4  # cap of the stretch of the timeout by the load
+CEILING = 3.0  # seconds, the former fixed timeout, never exceeded by default
+GOLDEN_TIMEOUT = 60  # seconds, a golden run taking longer is not waited for
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of the samples, q in ]0, 100]."""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def golden_times(args, repeat=REPEAT, stdin=None):
+    """Wall-clock durations of repeated runs of the original binary.
+
+    :param args: the command line, with the qemu prefix for ARM binaries
+    :param repeat: number of runs
+    :param stdin: bytes written to the standard input, /dev/null if None
+    :return: a list of seconds, GOLDEN_TIMEOUT for a run which did not finish
+    """
+    redirect = {"stdin": DEVNULL} if stdin is None else {"input": stdin}
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            run(
+                args, stdout=DEVNULL, stderr=DEVNULL, timeout=GOLDEN_TIMEOUT, **redirect
+            )
+            times.append(time.perf_counter() - start)
+        except TimeoutExpired:
+            times.append(GOLDEN_TIMEOUT)
+    return times
+
+
+def calibrated_timeout(
+    times, factor=FACTOR, floor=FLOOR, concurrency=1, ceiling=CEILING
+):
+    """Timeout of the faulted runs of an input, from the durations of its golden runs.
+
+    The median ignores the golden runs delayed by the scheduler. The golden
+    runs are measured one at a time, the faulted runs share the cores with
+    concurrency - 1 others: the timeout is stretched by the load, up to
+    MAX_LOAD times.
+
+    :param times: the golden_times() of the input
+    :param factor: multiplier of the median
+    :param floor: seconds added to the timeout
+    :param concurrency: number of runs at once during the campaign
+    :param ceiling: seconds, the timeout never exceeds it
+    :return: seconds
+    """
+    load = min(MAX_LOAD, max(1, concurrency / (os.cpu_count() or 1)))
+    return min(ceiling, floor + factor * percentile(times, 50) * load)
+
+
+def golden_outputs(args, stdin=None):
+    """Output of a run of the original binary.
+
+    :param args: the command line, with the qemu prefix for ARM binaries
+    :param stdin: bytes written to the standard input, /dev/null if None
+    :return: (stdout, stderr, returncode), None if the run does not finish
+             within GOLDEN_TIMEOUT
+    """
+    redirect = {"stdin": DEVNULL} if stdin is None else {"input": stdin}
+    try:
+        p = run(args, stdout=PIPE, stderr=PIPE, timeout=GOLDEN_TIMEOUT, **redirect)
+    except TimeoutExpired:
+        return None
+    return p.stdout, p.stderr, p.returncode
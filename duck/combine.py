@@ -0,0 +1,148 @@
+from array import array
+from bisect import bisect_right
+from itertools import combinations
+
+from duck.dedup import effective_delta
+from duck.plan import MODELS
+from duck.store import input_id
+
+
+def site_ranks(plan, table, hits):
+    """Rank of the first execution of the instruction of each fault in a golden run.
+
+    :param plan: the CampaignPlan
+    :param table: the InstructionTable of the binary, sorted by offset
+    :param hits: the golden_coverage() of a single run, in the order of the
+                 first executions
+    :return: an array of the rank of the instruction containing the offset
+             of each fault, -1 if it is not executed
+    """
+    first = {at: rank for rank, at in enumerate(hits)}
+    ranks = array("q")
+    for i in range(len(plan)):
+        offset = plan.offset[i]
+        k = bisect_right(table.addr, offset) - 1
+        rank = -1
+        if k >= 0 and offset < table.addr[k] + table.size[k]:
+            rank = first.get(table.addr[k], -1)
+        ranks.append(rank)
+    return ranks
+
+
+def combined(plan, indexes, image=None):
+    """Build the fault models of a combination of faults, see CampaignPlan.materialize.
+
+    :return: a dict with the name (the names of the faults joined by +) and
+             the patches of the faults, None if a fault model rejects its fault
+    """
+    faults = [plan.materialize(i, image) for i in indexes]
+    if None in faults:
+        return None
+    return {
+        "name": "+".join(f["name"] for f in faults),
+        "patches": [f["fault"].patch for f in faults],
+    }
+
+
+class Combinations:
+    """The work items of a campaign faulting order sites at once, streamed.
+
+    The candidates are the static faults of the plan changing the binary
+    whose instruction runs in a golden run. The combinations of order
+    candidates are enumerated lazily, in the order of the plan, and a
+    combination runs with an input if:
+      - the instructions of all its faults run in the golden run of the input
+      - the fault whose instruction runs first did not crash alone with the
+        input (in the results of a single fault campaign); until then the run
+        is the single fault one
+      - its faults do not write the same bits, as with swifitool
+
+    :param plan: the CampaignPlan
+    :param image: the BinaryImage of the original binary
+    :param order: number of faults at once
+    :param ranks: dict input id -> the site_ranks() of its golden run
+    :param excluded: excluded[i] is 1 for a fault never combined, e.g. a
+                     duplicate of another one
+    :param crashed: set of (fault name, input id) of the single faults which
+                    crashed
+    """
+
+    def __init__(self, plan, image, order, ranks, excluded, crashed):
+        super().__init__()
+        self.plan = plan
+        self.image = image
+        self.order = order
+        self.ranks = ranks
+        self.candidates = array("q")
+        self.starts = array("q")  # patched bytes of the candidates
+        self.ends = array("q")
+        for i in range(len(plan)):
+            if excluded[i] or plan.occurrence[i]:
+                continue
+            if all(r[i] < 0 for r in ranks.values()):
+                continue
+            f = plan.materialize(i, image)
+            if f is None or not effective_delta(image.data, [f["fault"].patch]):
+                continue
+            self.candidates.append(i)
+            self.starts.append(f["fault"].patch.offset)
+            self.ends.append(f["fault"].patch.end)
+        # crashed[input][k] is 1 if the k-th candidate crashed alone
+        self.crashed = {input: bytearray(len(self.candidates)) for input in ranks}
+        if crashed:
+            for k, i in enumerate(self.candidates):
+                name = plan.name(i)
+                for input, flags in self.crashed.items():
+                    flags[k] = (name, input) in crashed
+        self.pruned = {"unexecuted": 0, "crash": 0, "overlap": 0}
+
+    def __len__(self):
+        """Number of combinations of the candidates, before any pruning."""
+        n, count = len(self.candidates), 1
+        for k in range(self.order):
+            count = count * (n - k) // (k + 1)
+        return count
+
+    def overlap(self, combo):
+        for a, b in combinations(combo, 2):
+            if self.starts[a] < self.ends[b] and self.starts[b] < self.ends[a]:
+                # the patches share bytes, they may still write other bits
+                fa, fb = (
+                    self.plan.materialize(self.candidates[k], self.image)
+                    for k in (a, b)
+                )
+                bits = set(fa["fault"].patch.edited_bits())
+                if bits.intersection(fb["fault"].patch.edited_bits()):
+                    return True
+        return False
+
+    def items(self, inputs, done=()):
+        """Generator of the (fault indexes, key, plaintext) work items.
+
+        :param inputs: the (key, plaintext) of the campaign
+        :param done: set of (name, input id) of the runs already stored
+        """
+        for combo in combinations(range(len(self.candidates)), self.order):
+            if self.overlap(combo):
+                self.pruned["overlap"] += len(inputs)
+                continue
+            indexes = tuple(self.candidates[k] for k in combo)
+            name = None
+            if done:
+                name = "+".join(self.plan.name(i) for i in indexes)
+            for key, plaintext in inputs:
+                input = input_id(key, plaintext)
+                ranks = [self.ranks[input][i] for i in indexes]
+                if min(ranks) < 0:
+                    self.pruned["unexecuted"] += 1
+                    continue
+                if self.crashed[input][combo[ranks.index(min(ranks))]]:
+                    self.pruned["crash"] += 1
+                    continue
+                if not done or (name, input) not in done:
+                    yield indexes, key, plaintext
+
+
+def combined_model(plan, indexes):
+    """Name of the fault models of a combination, e.g. JMP+FLP."""
+    return "+".join(MODELS[plan.model[i]].name for i in indexes)
@@ -0,0 +1,90 @@
+import hashlib
+from array import array
+
+
+def effective_delta(data, patches):
+    """The bytes of a faulted image which differ from the original.
+
+    Two lists of patches producing the same image have the same delta,
+    whatever their fault models: e.g. a NOP over nops or a Z1B of a zero
+    byte change nothing, a bit flip of a jump displacement is a retarget.
+
+    :param data: the original content (bytes, bytearray or memoryview)
+    :param patches: iterable of Patch, applied in order
+    :return: a tuple of (offset, bytes) runs in offset order, () if the
+             patches change nothing
+    """
+    changed = {}
+    for p in patches:
+        current = bytes(changed.get(o, data[o]) for o in range(p.offset, p.end))
+        for o, b in zip(range(p.offset, p.end), p.resolve(current)):
+            changed[o] = b
+    runs = []
+    for o in sorted(changed):
+        if changed[o] == data[o]:
+            continue
+        if runs and runs[-1][0] + len(runs[-1][1]) == o:
+            runs[-1][1].append(changed[o])
+        else:
+            runs.append((o, bytearray([changed[o]])))
+    return tuple((o, bytes(b)) for o, b in runs)
+
+
+def fault_key(image, f):
+    """What determines a run of a materialized fault: its delta, and when
+    it is applied for a transient fault."""
+    delta = effective_delta(image.data, [f["fault"].patch])
+    return f.get("site", -1), f.get("occurrence", 0), delta
+
+
+def digest(key):
+    return int.from_bytes(
+        hashlib.blake2b(repr(key).encode(), digest_size=8).digest(), "little"
+    )
+
+
+def equivalence_classes(plan, image):
+    """Group the faults of a plan which run the same faulted binary.
+
+    Only the first fault of a class (its representative) needs to run, its
+    result holds for the other ones. A fault costs 8 bytes of digest while
+    grouping, the members of a class with the same digest are compared by
+    their actual delta.
+
+    :param plan: the CampaignPlan
+    :param image: the BinaryImage of the original binary
+    :return: (duplicate, members) where duplicate[i] is 1 if the i-th fault
+             is not the representative of its class, and members maps the
+             representatives to the list of the other faults of their class
+    """
+    digests = array("Q", bytes(8 * len(plan)))
+    rejected = bytearray(len(plan))
+    for i in range(len(plan)):
+        f = plan.materialize(i, image)
+        if f is None:
+            rejected[i] = 1  # rejected again when run
+        else:
+            digests[i] = digest(fault_key(image, f))
+    order = sorted(
+        (i for i in range(len(plan)) if not rejected[i]), key=digests.__getitem__
+    )
+    duplicate = bytearray(len(plan))
+    members = {}
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while end < len(order) and digests[order[end]] == digests[order[start]]:
+            end += 1
+        if end - start > 1:
+            group = sorted(order[start:end])
+            classes = {}
+            for i in group:
+                key = fault_key(image, plan.materialize(i, image))
+                classes.setdefault(key, []).append(i)
+            for rep, *others in classes.values():
+                if others:
+                    members[rep] = others
+                    for i in others:
+                        duplicate[i] = 1
+        start = end
+    return duplicate, members
@@ -0,0 +1,95 @@
+from functools import partial
+from multiprocessing import Pool
+
+from image import BinaryImage
+
+from duck.table import InstructionTable
+
+# chunks smaller than this are merged with the next symbol, whatever the
+# number of processes, so the chunking (and thus the result) is deterministic
+CHUNK_SIZE = 64 * 1024
+# below this amount of code the disassembly stays in the current process
+PARALLEL_THRESHOLD = 4 * CHUNK_SIZE
+
+
+def code_sections(image):
+    """(vaddr, offset, size) of the sections to disassemble.
+
+    Only the sections from .init up to .rodata are kept, this is consistent
+    with the "objdump -S binary" command output.
+    """
+    parsing = False
+    for name, addr, offset, view in image.sections():
+        if name == ".rodata":
+            parsing = False
+        elif name == ".init" or parsing:
+            parsing = True
+            yield addr, offset, len(view)
+
+
+def symbol_starts(image):
+    """Sorted addresses of the function symbols, known instruction boundaries."""
+    starts = set()
+    for section in image.elf.iter_sections():
+        if section["sh_type"] not in ("SHT_SYMTAB", "SHT_DYNSYM"):
+            continue
+        for symbol in section.iter_symbols():
+            if symbol["st_info"]["type"] == "STT_FUNC" and symbol["st_value"]:
+                starts.add(symbol["st_value"] & ~1)  # drop the ARM thumb bit
+    return sorted(starts)
+
+
+def code_chunks(image, min_size=CHUNK_SIZE):
+    """Split the code sections on symbol starts into chunks of at least min_size bytes.
+
+    :return: a list of (vaddr, offset, size) in address order
+    """
+    starts = symbol_starts(image)
+    chunks = []
+    for addr, offset, size in code_sections(image):
+        cuts = [s for s in starts if addr < s < addr + size] + [addr + size]
+        begin = addr
+        for cut in cuts:
+            if cut - begin >= min_size or cut == addr + size:
+                chunks.append((begin, offset + begin - addr, cut - begin))
+                begin = cut
+    return chunks
+
+
+# image of the disassembly workers, mapped once per worker
+worker_image = None
+
+
+def init_worker(path):
+    global worker_image
+    worker_image = BinaryImage(path)
+
+
+def decode_in_worker(decode, chunk):
+    return decode(worker_image, chunk)
+
+
+def extract_chunks(image, decode, processes=None):
+    """Disassemble the code of a binary chunk by chunk, in parallel for large binaries.
+
+    :param image: the BinaryImage of the binary
+    :param decode: function (image, (vaddr, offset, size)) -> (table, jumps, cmpsmovs)
+                   decoding one chunk, it must be picklable
+    :param processes: number of processes, None for one per core
+    :return: (table, jumps, cmpsmovs) merged in address order
+    """
+    chunks = code_chunks(image)
+    total = sum(size for _, _, size in chunks)
+    if processes == 1 or len(chunks) < 2 or total < PARALLEL_THRESHOLD:
+        results = [decode(image, chunk) for chunk in chunks]
+    else:
+        with Pool(processes, init_worker, (image.path,)) as pool:
+            results = pool.map(partial(decode_in_worker, decode), chunks)
+    table = InstructionTable()
+    jumps = []
+    cmpsmovs = []
+    for chunk_table, chunk_jumps, chunk_cmpsmovs in results:
+        table.extend(chunk_table)
+        jumps.extend(chunk_jumps)
+        cmpsmovs.extend(chunk_cmpsmovs)
+    return table, jumps, cmpsmovs
@@ -0,0 +1,287 @@
+import os
+import signal
+
+try:
+    import unicorn
+    from unicorn import x86_const
+except ImportError:  # optional, only needed by --emulate
+    unicorn = None
+
+from duck.forkserver import executable_ranges, patchable
+from duck.sandbox import OUTPUT_LIMIT, BoundedBuffer
+from duck.trace import mapped_address, snapshot_x86
+
+# the registers restored from the snapshot, the segment selectors keep the
+# values of the flat 64-bit user mode of unicorn
+REGS = (
+    "rax rbx rcx rdx rsi rdi rbp rsp r8 r9 r10 r11 r12 r13 r14 r15 rip eflags "
+    "fs_base gs_base"
+).split()
+
+SYS_WRITE = 1
+SYS_FSTAT = 5
+SYS_MMAP = 9
+SYS_MPROTECT = 10
+SYS_MUNMAP = 11
+SYS_BRK = 12
+SYS_EXIT = 60
+SYS_KILL = 62
+SYS_EXIT_GROUP = 231
+SYS_TGKILL = 234
+SYS_NEWFSTATAT = 262
+ENOMEM = 12
+ENOSYS = 38
+
+PAGE_SIZE = 0x1000
+MMAP_BASE = 0x100000000000  # anonymous mappings, away from the binary and the libraries
+MAX_ALLOCATION = 1 << 30  # bytes, a larger brk or mmap fails
+S_IFIFO = 0o010000
+
+# signal of the process for the CPU exceptions (interrupt numbers)
+EXCEPTION_SIGNALS = {
+    0: signal.SIGFPE,  # divide error
+    1: signal.SIGTRAP,
+    3: signal.SIGTRAP,  # int3
+    4: signal.SIGSEGV,  # overflow
+    5: signal.SIGSEGV,  # bound
+    6: signal.SIGILL,  # invalid opcode
+    13: signal.SIGSEGV,  # general protection, hlt in user mode
+    14: signal.SIGSEGV,  # page fault
+    16: signal.SIGFPE,  # x87
+    19: signal.SIGFPE,  # SIMD
+}
+
+NEVER = 0xFFFFFFFFFFFFFFFF  # stop address of emu_start, the budget ends the runs
+
+# the snapshot must only need instructions unicorn emulates: no AVX variants
+# of the libc functions, no xsavec in the lazy binding resolver of ld.so (the
+# _Usable names are those of glibc < 2.33)
+SNAPSHOT_ENV = {
+    "GLIBC_TUNABLES": "glibc.cpu.hwcaps=-AVX,-AVX2,-AVX512F,-AVX512VL,-AVX512BW,"
+    "-AVX512DQ,-FMA,-XSAVEC,-AVX_Usable,-AVX2_Usable,-AVX512F_Usable,"
+    "-AVX512VL_Usable,-AVX512BW_Usable,-AVX512DQ_Usable,-FMA_Usable,-XSAVEC_Usable",
+}
+
+
+def emulation_available():
+    return unicorn is not None
+
+
+def function_snapshot(image, entry, args):
+    """Snapshot of the original binary run with args, at the entry of a function.
+
+    :param image: the BinaryImage of the binary
+    :param entry: file offset of the first instruction of the function
+    :param args: the arguments of the program, without argv[0]
+    :return: a trace.Snapshot, None if the function is not called
+    """
+    command = [os.path.abspath(image.path)] + list(args)
+    return snapshot_x86(command, entry, dict(os.environ, **SNAPSHOT_ENV))
+
+
+def page_align(address):
+    return (address + PAGE_SIZE - 1) & ~(PAGE_SIZE - 1)
+
+
+def unicorn_perms(perms):
+    prot = unicorn.UC_PROT_NONE
+    if perms[0] == "r":
+        prot |= unicorn.UC_PROT_READ
+    if perms[1] == "w":
+        prot |= unicorn.UC_PROT_WRITE
+    if perms[2] == "x":
+        prot |= unicorn.UC_PROT_EXEC
+    return prot
+
+
+class Emulator:
+    """The snapshot of a process loaded once in unicorn, restored before each faulted run.
+
+    A run starts at the instruction of the snapshot with the patches written
+    in the emulated code, and ends with the exit of the program, a crash or
+    after a budget of instructions. A few system calls are emulated: the
+    writes to the standard output and error are collected, these are pipes for
+    fstat (the buffering of stdio is the one of the native runs), brk and
+    anonymous mmap allocate memory. The others fail with ENOSYS.
+
+    :param image: the BinaryImage of the original binary
+    :param snapshot: the Snapshot of the original binary, see trace.snapshot_x86()
+    :param budget: maximum number of instructions of a run
+    :param output_limit: bytes of stdout and of stderr kept per run
+    """
+
+    def __init__(self, image, snapshot, budget, output_limit=OUTPUT_LIMIT):
+        super().__init__()
+        self.image = image
+        self.snapshot = snapshot
+        self.budget = budget
+        self.output_limit = output_limit
+        self.code = executable_ranges(image)
+        self.uc = unicorn.Uc(unicorn.UC_ARCH_X86, unicorn.UC_MODE_64)
+        self.writable = []  # (start, data) restored before each run
+        self.heap_end = page_align(snapshot.brk)
+        self.initial_brk = snapshot.brk
+        for start, end, perms, data in snapshot.regions:
+            self.uc.mem_map(start, end - start, unicorn_perms(perms))
+            if data is not None:
+                self.uc.mem_write(start, data)
+                if perms[1] == "w":
+                    self.writable.append((start, data))
+            if start == self.heap_end:  # [heap], the break lies in its last page
+                self.heap_end = self.initial_brk = end
+        self.allocated = []  # (start, size) mapped by the run, unmapped after it
+        self.brk = self.mapped = self.mmap_next = None
+        for name in REGS:
+            reg = getattr(x86_const, "UC_X86_REG_%s" % name.upper())
+            self.uc.reg_write(reg, snapshot.regs[name])
+        self.context = self.uc.context_save()
+        self.uc.hook_add(
+            unicorn.UC_HOOK_INSN,
+            self.syscall,
+            None,
+            1,
+            0,
+            x86_const.UC_X86_INS_SYSCALL,
+        )
+        self.uc.hook_add(unicorn.UC_HOOK_INTR, self.interrupt)
+        self.output = None
+        self.evaluation = None
+        self.exitcode = None
+        self.stopped = False
+
+    def patchable(self, patches):
+        """True if the patches hit code which has not run before the snapshot, see forkserver.patchable()."""
+        return patchable(patches, self.code, self.snapshot.ran)
+
+    def write_code(self, address, data):
+        self.uc.mem_write(address, data)
+        # the translated blocks are found by their start, which may lie up to
+        # the previous page
+        start = (address & ~(PAGE_SIZE - 1)) - PAGE_SIZE
+        self.uc.ctl_remove_cache(start, page_align(address + len(data)))
+
+    def allocate(self, start, size):
+        self.uc.mem_map(start, size, unicorn.UC_PROT_READ | unicorn.UC_PROT_WRITE)
+        self.allocated.append((start, size))
+
+    def sys_brk(self, address):
+        if address - self.mapped > MAX_ALLOCATION:
+            return self.brk  # the break does not move
+        if address > self.mapped:
+            self.allocate(self.mapped, page_align(address) - self.mapped)
+            self.mapped = page_align(address)
+        if address >= self.snapshot.brk:
+            self.brk = address
+        return self.brk
+
+    def sys_mmap(self, size, fd):
+        if fd != 0xFFFFFFFFFFFFFFFF:  # -1, anonymous mapping
+            return -ENOSYS
+        if size > MAX_ALLOCATION:
+            return -ENOMEM
+        start = self.mmap_next
+        self.mmap_next += page_align(size)
+        self.allocate(start, page_align(size))
+        return start
+
+    def sys_fstat(self, fd, buf):
+        if fd > 2:
+            return -ENOSYS
+        stat = bytearray(144)  # struct stat
+        stat[24:28] = (S_IFIFO | 0o600).to_bytes(4, "little")  # st_mode
+        stat[56:64] = PAGE_SIZE.to_bytes(8, "little")  # st_blksize
+        self.uc.mem_write(buf, bytes(stat))
+        return 0
+
+    def syscall(self, uc, user_data):
+        number = uc.reg_read(x86_const.UC_X86_REG_RAX)
+        rdi = uc.reg_read(x86_const.UC_X86_REG_RDI)
+        rsi = uc.reg_read(x86_const.UC_X86_REG_RSI)
+        rdx = uc.reg_read(x86_const.UC_X86_REG_RDX)
+        result = -ENOSYS
+        if number == SYS_WRITE and rdi in (1, 2):
+            data = uc.mem_read(rsi, rdx)
+            self.output[rdi - 1].write(data)
+            result = rdx
+            if self.evaluation is not None and self.evaluation.feed(rdi, bytes(data)):
+                self.exitcode = -signal.SIGKILL
+                self.stopped = True  # on the verdicts
+                uc.emu_stop()
+        elif number == SYS_FSTAT:
+            result = self.sys_fstat(rdi, rsi)
+        elif number == SYS_NEWFSTATAT:
+            result = self.sys_fstat(rdi, rdx)  # fstat(fd) is newfstatat(fd, "")
+        elif number == SYS_BRK:
+            result = self.sys_brk(rdi)
+        elif number == SYS_MMAP:
+            result = self.sys_mmap(rsi, uc.reg_read(x86_const.UC_X86_REG_R8))
+        elif number in (SYS_MUNMAP, SYS_MPROTECT):
+            result = 0  # the memory is released after the run
+        elif number in (SYS_EXIT, SYS_EXIT_GROUP):
+            self.exitcode = rdi & 0xFF
+            uc.emu_stop()
+        elif number in (SYS_KILL, SYS_TGKILL):
+            # abort() and the stack protector, the signal of the program to itself
+            sig = rdx if number == SYS_TGKILL else rsi
+            if sig in (signal.SIGABRT, signal.SIGKILL, signal.SIGSEGV):
+                self.exitcode = -sig
+                uc.emu_stop()
+            result = 0
+        uc.reg_write(x86_const.UC_X86_REG_RAX, result & 0xFFFFFFFFFFFFFFFF)
+
+    def interrupt(self, uc, intno, user_data):
+        self.exitcode = -EXCEPTION_SIGNALS.get(intno, signal.SIGSEGV)
+        uc.emu_stop()
+
+    def run(self, patches, evaluation=None):
+        """Run the snapshot with the patches applied.
+
+        :param patches: iterable of Patch, see patchable()
+        :param evaluation: the oracle.Evaluation fed with the output, the run
+                           is stopped as soon as it is decided
+        :return: (stdout, stderr, returncode, timedout, truncated, stopped) as
+                 with sandbox.run_sandboxed(), a run exceeding the budget is
+                 reported killed by SIGKILL
+        """
+        for start, data in self.writable:
+            self.uc.mem_write(start, data)
+        self.uc.context_restore(self.context)
+        self.brk = self.initial_brk
+        self.mapped = self.heap_end
+        self.mmap_next = MMAP_BASE
+        originals = []
+        for p in patches:
+            original = self.image[p.offset : p.end]
+            address = mapped_address(self.snapshot.mappings, p.offset)
+            self.write_code(address, p.resolve(original))
+            originals.append((address, bytes(original)))
+        self.output = [BoundedBuffer(self.output_limit) for _ in range(2)]
+        self.evaluation = evaluation
+        self.exitcode = None
+        self.stopped = False
+        try:
+            self.uc.emu_start(self.snapshot.regs["rip"], NEVER, count=self.budget)
+        except unicorn.UcError as e:
+            if e.errno in (unicorn.UC_ERR_INSN_INVALID, unicorn.UC_ERR_EXCEPTION):
+                self.exitcode = -signal.SIGILL
+            else:  # unmapped or protected memory
+                self.exitcode = -signal.SIGSEGV
+        finally:
+            for address, original in originals:
+                self.write_code(address, original)
+            for start, size in self.allocated:
+                self.uc.mem_unmap(start, size)
+            self.allocated = []
+        timedout = self.exitcode is None
+        if timedout:
+            self.exitcode = -signal.SIGKILL
+        stdout, stderr = self.output
+        truncated = stdout.truncated or stderr.truncated
+        return (
+            stdout.getvalue(),
+            stderr.getvalue(),
+            self.exitcode,
+            timedout,
+            truncated,
+            self.stopped,
+        )
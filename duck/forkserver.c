@@ -0,0 +1,177 @@
+/*
+ * Fork server preloaded (LD_PRELOAD) in the original binary by chaosduck.py.
+ *
+ * The binary is started once, the dynamic loader and the libc initialization
+ * run as usual, then instead of main the fork server loop takes over. For each
+ * request of chaosduck it forks a child which patches its own code through
+ * /proc/self/mem, redirects its output to the pipes received with the request
+ * and calls the real main with the requested arguments.
+ *
+ * Protocol on the socket whose number is in CHAOSDUCK_FORKSRV_FD, native
+ * endianness:
+ *   request  uint32 patch count, uint32 argument count, uint32 body size
+ *            with the stdout and stderr pipes as SCM_RIGHTS, then the body:
+ *            per patch uint64 vaddr, uint32 size, the bytes,
+ *            per argument uint32 size, the bytes
+ *   replies  int32 pid of the child, then int32 wait status once it is gone
+ *
+ * Build: cc -shared -fPIC -O2 -o forkserver.so forkserver.c -ldl
+ */
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <fcntl.h>
+#include <link.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/socket.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+typedef int (*main_fn)(int, char **, char **);
+typedef int (*start_main_fn)(main_fn, int, char **, void (*)(void),
+                             void (*)(void), void (*)(void), void *);
+
+static main_fn real_main;
+static int server_fd = -1;
+
+static int read_all(int fd, void *buf, size_t len)
+{
+    char *p = buf;
+    while (len > 0) {
+        ssize_t n = read(fd, p, len);
+        if (n <= 0)
+            return -1;
+        p += n;
+        len -= n;
+    }
+    return 0;
+}
+
+static int write_all(int fd, const void *buf, size_t len)
+{
+    const char *p = buf;
+    while (len > 0) {
+        ssize_t n = write(fd, p, len);
+        if (n <= 0)
+            return -1;
+        p += n;
+        len -= n;
+    }
+    return 0;
+}
+
+/* the header of a request, with the two pipes attached to it */
+static int read_header(uint32_t header[3], int fds[2])
+{
+    char control[CMSG_SPACE(2 * sizeof(int))];
+    struct iovec iov = {header, 3 * sizeof(uint32_t)};
+    struct msghdr msg = {0};
+    struct cmsghdr *cmsg;
+    ssize_t n;
+
+    msg.msg_iov = &iov;
+    msg.msg_iovlen = 1;
+    msg.msg_control = control;
+    msg.msg_controllen = sizeof(control);
+    n = recvmsg(server_fd, &msg, MSG_CMSG_CLOEXEC);
+    if (n <= 0)
+        return -1;
+    cmsg = CMSG_FIRSTHDR(&msg);
+    if (cmsg == NULL || cmsg->cmsg_type != SCM_RIGHTS)
+        return -1;
+    memcpy(fds, CMSG_DATA(cmsg), 2 * sizeof(int));
+    if ((size_t)n < iov.iov_len)
+        return read_all(server_fd, (char *)header + n, iov.iov_len - n);
+    return 0;
+}
+
+/* load bias of the main program, the first object reported */
+static int first_object(struct dl_phdr_info *info, size_t size, void *data)
+{
+    (void)size;
+    *(uintptr_t *)data = info->dlpi_addr;
+    return 1;
+}
+
+static void run_child(uint32_t header[3], char *body, char **argv, char **envp)
+{
+    uintptr_t bias = 0;
+    char **args = calloc(header[1] + 2, sizeof(char *));
+    int mem = open("/proc/self/mem", O_RDWR);
+    uint32_t i, size;
+    uint64_t vaddr;
+
+    dl_iterate_phdr(first_object, &bias);
+    for (i = 0; i < header[0]; i++) {
+        memcpy(&vaddr, body, sizeof(vaddr));
+        memcpy(&size, body + sizeof(vaddr), sizeof(size));
+        body += sizeof(vaddr) + sizeof(size);
+        /* /proc/self/mem writes through the read-only code pages */
+        if (pwrite(mem, body, size, bias + vaddr) != (ssize_t)size)
+            _exit(125);
+        body += size;
+    }
+    close(mem);
+    args[0] = argv[0];
+    for (i = 0; i < header[1]; i++) {
+        memcpy(&size, body, sizeof(size));
+        args[i + 1] = strndup(body + sizeof(size), size);
+        body += sizeof(size) + size;
+    }
+    exit(real_main(header[1] + 1, args, envp));
+}
+
+static int serve(int argc, char **argv, char **envp)
+{
+    uint32_t header[3];
+    int fds[2], status;
+    int32_t reply;
+    char *body;
+    pid_t pid;
+
+    (void)argc;
+    while (read_header(header, fds) == 0) {
+        body = malloc(header[2] + 1);
+        if (read_all(server_fd, body, header[2]) < 0)
+            break;
+        pid = fork();
+        if (pid == 0) {
+            close(server_fd);
+            setpgid(0, 0); /* killed with its descendants on timeout */
+            dup2(fds[0], 1);
+            dup2(fds[1], 2);
+            run_child(header, body, argv, envp);
+        }
+        close(fds[0]);
+        close(fds[1]);
+        free(body);
+        reply = pid;
+        if (write_all(server_fd, &reply, sizeof(reply)) < 0)
+            break;
+        if (pid < 0)
+            continue;
+        waitpid(pid, &status, 0);
+        reply = status;
+        if (write_all(server_fd, &reply, sizeof(reply)) < 0)
+            break;
+    }
+    _exit(0); /* chaosduck is gone, do not run the atexit handlers */
+}
+
+int __libc_start_main(main_fn main, int argc, char **argv, void (*init)(void),
+                      void (*fini)(void), void (*rtld_fini)(void), void *stack_end)
+{
+    start_main_fn start_main = (start_main_fn)dlsym(RTLD_NEXT, "__libc_start_main");
+    const char *fd = getenv("CHAOSDUCK_FORKSRV_FD");
+
+    /* a faulted child jumping back to _start must not become a server */
+    if (fd != NULL && server_fd < 0) {
+        server_fd = atoi(fd);
+        real_main = main;
+        main = serve;
+        unsetenv("CHAOSDUCK_FORKSRV_FD");
+    }
+    return start_main(main, argc, argv, init, fini, rtld_fini, stack_end);
+}
@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import os
+import signal
+import socket
+import struct
+from bisect import bisect_left
+from subprocess import DEVNULL, run
+
+from duck.sandbox import DEFAULT_LIMITS, BoundedBuffer, apply_limits
+from duck.trace import trace_x86
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "forkserver.c")
+FD_ENV = "CHAOSDUCK_FORKSRV_FD"
+MAX_INSN_SIZE = 15  # x86
+
+
+def build_shim(cache_dir, elfclass):
+    """Compile the fork server shim for the class of the binary, once per version of its source.
+
+    :param cache_dir: directory receiving the shared library
+    :param elfclass: 32 or 64
+    :return: the path of the shared library
+    """
+    with open(SOURCE, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    path = os.path.join(cache_dir, "forkserver-%s-%d.so" % (digest, elfclass))
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        arch = "-m32" if elfclass == 32 else "-m64"
+        command = ["cc", arch, "-shared", "-fPIC", "-O2", "-o", tmp, SOURCE, "-ldl"]
+        run(command, check=True)
+        os.replace(tmp, path)
+    return path
+
+
+def main_offset(image):
+    """File offset of main, None if the binary has no such symbol."""
+    for section in image.elf.iter_sections():
+        if section["sh_type"] not in ("SHT_SYMTAB", "SHT_DYNSYM"):
+            continue
+        for symbol in section.iter_symbols():
+            if symbol.name == "main" and symbol["st_info"]["type"] == "STT_FUNC":
+                return image.vaddr_to_offset(symbol["st_value"])
+    return None
+
+
+def supports_fork_server(image):
+    """The shim is only preloaded in dynamically linked binaries, and main must be known."""
+    if image.elf is None or main_offset(image) is None:
+        return False
+    return any(seg["p_type"] == "PT_INTERP" for seg in image.elf.iter_segments())
+
+
+def premain_offsets(image):
+    """Sorted file offsets of the instructions of the binary run before main.
+
+    The fork server takes over right before main, patching this code in the
+    forked children would have no effect. The original binary is single-stepped
+    up to main to find it, wherever it lives (crt helpers often have no symbol).
+    """
+    return sorted(trace_x86([os.path.abspath(image.path)], main_offset(image)))
+
+
+def executable_ranges(image):
+    """File offset ranges of the executable PT_LOAD segments."""
+    return [
+        (seg["p_offset"], seg["p_offset"] + seg["p_filesz"])
+        for seg in image.elf.iter_segments()
+        if seg["p_type"] == "PT_LOAD" and seg["p_flags"] & 1  # PF_X
+    ]
+
+
+def patchable(patches, code, ran):
+    """True if the patches can be applied to a process stopped after running some code.
+
+    The patches must lie in the executable segments, and not in an instruction
+    which already ran (any of them starting less than MAX_INSN_SIZE bytes
+    before the end of a patch is conservatively considered overlapping it).
+
+    :param code: the executable_ranges() of the binary
+    :param ran: sorted file offsets of the instructions already run
+    """
+    for p in patches:
+        if not any(s <= p.offset and p.end <= e for s, e in code):
+            return False
+        i = bisect_left(ran, p.offset - MAX_INSN_SIZE + 1)
+        if i < len(ran) and ran[i] < p.end:
+            return False
+    return True
+
+
+class ForkServer:
+    """One original binary stopped before main, forking a patched child per run.
+
+    The patches must hit executable code which has not run yet (see
+    patchable()), the others need a faulted binary executed from scratch.
+
+    :param image: the BinaryImage of the original binary
+    :param shim: the path of the fork server shared library, see build_shim()
+    :param premain: the result of premain_offsets()
+    :param limits: the sandbox.Limits of the children, but the CPU time and
+                   the number of processes (the server forks them)
+    """
+
+    def __init__(self, image, shim, premain, limits=DEFAULT_LIMITS):
+        super().__init__()
+        self.image = image
+        self.shim = shim
+        self.limits = limits._replace(cpu=None, processes=None)
+        self.process = None
+        self.sock = None
+        self.code = executable_ranges(image)
+        self.premain = premain
+
+    def patchable(self, patches):
+        """True if the forked children can apply the patches in memory, see patchable()."""
+        return patchable(patches, self.code, self.premain)
+
+    async def start(self):
+        parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        env = dict(os.environ, LD_PRELOAD=self.shim)
+        env[FD_ENV] = str(child.fileno())
+        self.process = await asyncio.create_subprocess_exec(
+            os.path.abspath(self.image.path),
+            env=env,
+            stdin=DEVNULL,
+            stdout=DEVNULL,
+            stderr=DEVNULL,
+            pass_fds=(child.fileno(),),
+            preexec_fn=lambda: apply_limits(self.limits),
+        )
+        child.close()
+        parent.setblocking(False)
+        self.sock = parent
+
+    async def stop(self):
+        if self.sock is not None:
+            self.sock.close()  # the server exits on the end of file
+            self.sock = None
+        if self.process is not None:
+            if self.process.returncode is None:
+                # not Process.kill(), its poll() reaps the pid behind the child watcher
+                try:
+                    os.kill(self.process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            await self.process.wait()
+            self.process = None
+
+    async def recv_int(self):
+        loop = asyncio.get_running_loop()
+        data = b""
+        while len(data) < 4:
+            chunk = await loop.sock_recv(self.sock, 4 - len(data))
+            if not chunk:
+                raise ConnectionError("the fork server of %s died" % self.image.path)
+            data += chunk
+        return struct.unpack("=i", data)[0]
+
+    async def run(self, patches, args, timeout, evaluation=None):
+        """Run main in a forked child with the patches applied and args as arguments.
+
+        :param patches: iterable of Patch, see patchable()
+        :param args: the arguments of the program, without argv[0]
+        :param timeout: seconds before the child and its process group are killed
+        :param evaluation: the oracle.Evaluation fed with the output, the child
+                           is killed as soon as it is decided
+        :return: (stdout, stderr, returncode, timedout, truncated, stopped) as
+                 with sandbox.run_sandboxed()
+        """
+        if self.sock is None:
+            await self.start()
+        body = []
+        count = 0
+        for p in patches:
+            original = self.image[p.offset : p.end]
+            data = p.resolve(original)
+            vaddr = self.image.offset_to_vaddr(p.offset)
+            body.append(struct.pack("=QI", vaddr, len(data)) + data)
+            count += 1
+        for arg in args:
+            arg = arg.encode()
+            body.append(struct.pack("=I", len(arg)) + arg)
+        body = b"".join(body)
+        header = struct.pack("=III", count, len(args), len(body))
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        try:
+            # a few hundred bytes, they fit in the socket buffer
+            socket.send_fds(self.sock, [header + body], [out_w, err_w])
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+        out_r = os.fdopen(out_r, "rb", 0)
+        err_r = os.fdopen(err_r, "rb", 0)
+        decided = asyncio.get_running_loop().create_future()
+        limit = self.limits.output
+        outs = asyncio.ensure_future(read_pipe(out_r, limit, 1, evaluation, decided))
+        errs = asyncio.ensure_future(read_pipe(err_r, limit, 2, evaluation, decided))
+        try:
+            pid = await self.recv_int()
+            if pid < 0:
+                raise OSError("the fork server of %s cannot fork" % self.image.path)
+            status = asyncio.ensure_future(self.recv_int())
+            await asyncio.wait(
+                (status, decided), timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            timedout = not status.done() and not decided.done()
+            stopped = not status.done() and decided.done()
+            if not status.done():
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass  # the group is already gone
+            returncode = os.waitstatus_to_exitcode(await status)
+        except BaseException:
+            outs.cancel()
+            errs.cancel()
+            await self.stop()  # unknown state, a new server is started next time
+            raise
+        outs, errs = await outs, await errs
+        truncated = outs.truncated or errs.truncated
+        stopped = stopped and returncode == -signal.SIGKILL
+        return (
+            outs.getvalue(),
+            errs.getvalue(),
+            returncode,
+            timedout,
+            truncated,
+            stopped,
+        )
+
+
+class PipeProtocol(asyncio.Protocol):
+    def __init__(self, limit, fd, evaluation, decided):
+        super().__init__()
+        self.output = BoundedBuffer(limit)
+        self.fd = fd
+        self.evaluation = evaluation
+        self.decided = decided
+        self.closed = asyncio.get_running_loop().create_future()
+
+    def data_received(self, data):
+        self.output.write(data)
+        if self.evaluation is not None and self.evaluation.feed(self.fd, data):
+            if not self.decided.done():
+                self.decided.set_result(None)
+
+    def connection_lost(self, exc):
+        self.closed.set_result(None)
+
+
+async def read_pipe(pipe, limit, fd, evaluation, decided):
+    """Read a pipe (an unbuffered file object) until its end in the event loop.
+
+    :param limit: the bytes kept, the rest is read and dropped
+    :param fd: the stream of the pipe, 1 or 2, for the oracles
+    :param evaluation: the oracle.Evaluation fed with the output, or None
+    :param decided: future set when the evaluation is decided
+    :return: a sandbox.BoundedBuffer
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.connect_read_pipe(
+        lambda: PipeProtocol(limit, fd, evaluation, decided), pipe
+    )
+    try:
+        await protocol.closed
+    finally:
+        transport.close()
+    return protocol.output
@@ -0,0 +1,32 @@
+import os
+
+from patch import patched_image
+
+
+def memfd_image(image, patches=(), name="faulted"):
+    """Copy an image into an anonymous in-memory file and apply patches to it.
+
+    The file lives in RAM only (memfd), nothing is written to the filesystem.
+
+    :param image: the original binary content
+    :param patches: iterable of Patch applied on the copy
+    :param name: name of the memfd (only visible in /proc)
+    :return: the file descriptor, to be closed by the caller
+    """
+    fd = os.memfd_create(name, os.MFD_CLOEXEC)
+    try:
+        with os.fdopen(fd, "wb", closefd=False) as f:
+            f.write(patched_image(image, patches))
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def fd_path(fd):
+    """Path under which the process spawned with pass_fds=(fd,) can exec the memfd.
+
+    :param fd: file descriptor returned by memfd_image
+    :return: the path as a string
+    """
+    return "/proc/self/fd/%d" % fd
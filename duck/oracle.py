@@ -0,0 +1,241 @@
+import copy
+import re
+import threading
+
+STDOUT = 1
+STDERR = 2
+MAX_LINE = 4096  # bytes of a line kept for the regular expressions
+
+
+class Oracle:
+    """A predicate on a run, evaluated incrementally while its output arrives.
+
+    verdict is None while undecided, then True or False. feed() receives the
+    output in chunks, exit() ends the run and returns the final verdict. An
+    oracle instance evaluates one run, see Evaluation.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.verdict = None
+
+    def feed(self, fd, data):
+        return self.verdict
+
+    def exit(self, returncode, timedout):
+        if self.verdict is None:
+            self.verdict = False
+        return self.verdict
+
+
+class Contains(Oracle):
+    """True once pattern appears in the stream, even across chunks."""
+
+    def __init__(self, pattern, fd=STDOUT):
+        super().__init__()
+        self.pattern = pattern
+        self.fd = fd
+        self.tail = b""  # the end of the previous chunks, a pattern may span them
+
+    def feed(self, fd, data):
+        if self.verdict is None and fd == self.fd:
+            window = self.tail + data
+            if self.pattern in window:
+                self.verdict = True
+            keep = len(self.pattern) - 1
+            self.tail = window[-keep:] if keep else b""
+        return self.verdict
+
+
+class Matches(Oracle):
+    """Decided by the first line of the stream matching a regular expression.
+
+    The verdict is check(match) for that line, True without check, and False
+    if no line matches.
+
+    :param regex: bytes, searched in each line without its end of line
+    :param check: function of the re.Match
+    """
+
+    def __init__(self, regex, check=None, fd=STDOUT):
+        super().__init__()
+        self.regex = re.compile(regex)
+        self.check = check
+        self.fd = fd
+        self.line = b""  # the incomplete last line
+
+    def feed(self, fd, data):
+        if self.verdict is None and fd == self.fd:
+            lines = (self.line + data).split(b"\n")
+            for line in lines[:-1]:
+                if self.match(line):
+                    return self.verdict
+            self.line = lines[-1][-MAX_LINE:]
+        return self.verdict
+
+    def match(self, line):
+        m = self.regex.search(line)
+        if m is not None:
+            self.verdict = True if self.check is None else bool(self.check(m))
+        return m is not None
+
+    def exit(self, returncode, timedout):
+        if self.verdict is None:
+            self.match(self.line)
+        return super().exit(returncode, timedout)
+
+
+class ExitCode(Oracle):
+    """True if the run exits with one of the codes (negative for a signal), decided at the exit."""
+
+    def __init__(self, codes):
+        super().__init__()
+        self.codes = set(codes)
+
+    def exit(self, returncode, timedout):
+        if self.verdict is None:
+            self.verdict = not timedout and returncode in self.codes
+        return self.verdict
+
+
+class All(Oracle):
+    """True if all the oracles are, decided as soon as one is False."""
+
+    def __init__(self, *oracles):
+        super().__init__()
+        self.oracles = oracles
+
+    def combine(self, verdicts):
+        if False in verdicts:
+            return False
+        return None if None in verdicts else True
+
+    def feed(self, fd, data):
+        if self.verdict is None:
+            verdicts = [o.feed(fd, data) for o in self.oracles]
+            self.verdict = self.combine(verdicts)
+        return self.verdict
+
+    def exit(self, returncode, timedout):
+        if self.verdict is None:
+            verdicts = [o.exit(returncode, timedout) for o in self.oracles]
+            self.verdict = self.combine(verdicts)
+        return self.verdict
+
+
+class Any(All):
+    """True if one of the oracles is, decided as soon as one is True."""
+
+    def combine(self, verdicts):
+        if True in verdicts:
+            return True
+        return None if None in verdicts else False
+
+
+class Not(Oracle):
+    def __init__(self, oracle):
+        super().__init__()
+        self.oracle = oracle
+
+    def feed(self, fd, data):
+        verdict = self.oracle.feed(fd, data)
+        self.verdict = None if verdict is None else not verdict
+        return self.verdict
+
+    def exit(self, returncode, timedout):
+        self.verdict = not self.oracle.exit(returncode, timedout)
+        return self.verdict
+
+
+# the line printed by main() of the VerifyPIN examples (and by the persistent
+# harness), g_authenticated is 1, BOOL_TRUE (aa) or oracle() depending on the
+# variant
+VERIFYPIN_LINE = (
+    rb"g_countermeasure = (-?\d+), g_authenticated = (\w+), g_ptc = (-?\d+)"
+)
+
+
+# functions of the module, the oracles are pickled for the injection workers
+def authenticated(m):
+    """The AUTH oracle of VerifyPIN/*/src/oracle.c: authenticated, no countermeasure."""
+    return m[1] != b"1" and m[2] in (b"1", b"aa")
+
+
+def ptc_kept(m):
+    """The PTC oracle of VerifyPIN/*/src/oracle.c: the try counter was not decremented."""
+    return m[1] != b"1" and int(m[3]) >= 3
+
+
+PRESETS = {
+    "auth": lambda: Matches(VERIFYPIN_LINE, authenticated),
+    "ptc": lambda: Matches(VERIFYPIN_LINE, ptc_kept),
+}
+
+
+def parse_term(spec):
+    if spec.startswith("!"):
+        return Not(parse_term(spec[1:]))
+    if spec in PRESETS:
+        return PRESETS[spec]()
+    kind, sep, arg = spec.partition(":")
+    kind, _, stream = kind.partition("@")
+    if stream not in ("", "stdout", "stderr"):
+        raise ValueError("unknown stream in oracle %r" % spec)
+    fd = STDERR if stream == "stderr" else STDOUT
+    if sep and kind == "contains":
+        return Contains(arg.encode().decode("unicode_escape").encode("latin-1"), fd)
+    if sep and kind == "regex":
+        return Matches(arg.encode(), fd=fd)
+    if sep and kind == "exit":
+        return ExitCode(int(code) for code in arg.split(","))
+    raise ValueError("unknown oracle %r" % spec)
+
+
+def parse_oracle(spec):
+    """Oracle of a command line specification.
+
+    TERM is auth, ptc, contains:TEXT, regex:REGEX, exit:CODE[,CODE...], the
+    stream of contains and regex may be given as contains@stderr:TEXT, and
+    !TERM negates a term. Terms are combined with ' && ' or with ' || '.
+
+    :raise ValueError: if the specification is invalid
+    """
+    if " && " in spec and " || " in spec:
+        raise ValueError("cannot mix && and || in oracle %r" % spec)
+    if " && " in spec:
+        return All(*(parse_term(s) for s in spec.split(" && ")))
+    if " || " in spec:
+        return Any(*(parse_term(s) for s in spec.split(" || ")))
+    return parse_term(spec)
+
+
+class Evaluation:
+    """The oracles of a campaign evaluated on one run, in a single pass over its output.
+
+    :param oracles: the oracles, copied: the instances given are not modified
+    """
+
+    def __init__(self, oracles):
+        super().__init__()
+        self.oracles = copy.deepcopy(oracles)
+        self.decided = False  # every verdict known, the run can be stopped
+        self.lock = threading.Lock()  # the streams may be fed by two threads
+
+    def feed(self, fd, data):
+        with self.lock:
+            verdicts = [o.feed(fd, data) for o in self.oracles]
+            self.decided = bool(verdicts) and None not in verdicts
+        return self.decided
+
+    def exit(self, returncode, timedout):
+        """The verdicts of the run, in the order of the oracles."""
+        return [o.exit(returncode, timedout) for o in self.oracles]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]  # sent to the injection workers
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import signal
+import struct
+from subprocess import DEVNULL, PIPE, TimeoutExpired, run
+
+from duck.sandbox import DEFAULT_LIMITS, apply_limits
+
+PIN_SIZE = 4  # bytes, of the VerifyPIN examples
+# verifyPIN(), oracle(), g_countermeasure, g_authenticated, g_ptc
+RESULT = struct.Struct("=BBBBb")
+
+# the code of VerifyPIN/share/persistent.c and of the C runtime never runs
+# inside an iteration of the harness, the faults there need a faulted binary
+HARNESS_FUNCTIONS = {
+    "main",
+    "read_all",
+    "write_all",
+    "first_object",
+    "write_code",
+    "clear_stack",
+}
+CRT_FUNCTIONS = {"deregister_tm_clones", "register_tm_clones", "frame_dummy"}
+
+
+def benchmark_ranges(image):
+    """File offset ranges of the functions run by an iteration of the persistent harness.
+
+    Those are the functions defined by the binary, except the ones of the
+    harness itself and of the C runtime (including every name starting with
+    an underscore).
+
+    :param image: the BinaryImage of the harness binary
+    :return: a list of (start, end) file offsets, end excluded
+    """
+    ranges = []
+    for section in image.elf.iter_sections():
+        if section["sh_type"] != "SHT_SYMTAB":
+            continue
+        for symbol in section.iter_symbols():
+            name = symbol.name
+            if symbol["st_info"]["type"] != "STT_FUNC" or name.startswith("_"):
+                continue
+            if name in HARNESS_FUNCTIONS or name in CRT_FUNCTIONS:
+                continue
+            start = image.vaddr_to_offset(symbol["st_value"])
+            if start is not None and symbol["st_size"] > 0:
+                ranges.append((start, start + symbol["st_size"]))
+    return ranges
+
+
+def encode_request(image, patches, pin):
+    """Request of one iteration of the harness, see VerifyPIN/share/persistent.c.
+
+    :param image: the BinaryImage of the harness binary
+    :param patches: iterable of Patch applied in memory during the iteration
+    :param pin: the user PIN, PIN_SIZE bytes in hexadecimal
+    """
+    body = []
+    for p in patches:
+        data = p.resolve(image[p.offset : p.end])
+        vaddr = image.offset_to_vaddr(p.offset)
+        body.append(struct.pack("=QI", vaddr, len(data)) + data)
+    pin = bytes.fromhex(pin)
+    assert len(pin) == PIN_SIZE
+    return struct.pack("=I", len(body)) + pin + b"".join(body)
+
+
+def render(result):
+    """Text output of an iteration, the line printed by src/main.c and the oracle."""
+    _, oracle, countermeasure, authenticated, ptc = RESULT.unpack(result)
+    line = "[@] g_countermeasure = %d, g_authenticated = %x, g_ptc = %d, oracle = %d\n"
+    return (line % (countermeasure, authenticated, ptc, oracle)).encode()
+
+
+def probe(path, image, pin, timeout):
+    """True if the binary at path answers one request as a persistent harness."""
+    try:
+        p = run(
+            [path],
+            input=encode_request(image, [], pin),
+            stdout=PIPE,
+            stderr=DEVNULL,
+            timeout=timeout,
+        )
+    except (OSError, TimeoutExpired):
+        return False
+    return p.returncode == 0 and len(p.stdout) == RESULT.size
+
+
+class PersistentHarness:
+    """One persistent harness process running the faulted iterations of a batch.
+
+    The patches are applied by the harness before an iteration and reverted
+    after it. An iteration which crashes or hangs ends the process, a new one
+    is started for the next iteration.
+
+    :param image: the BinaryImage of the harness binary
+    :param patchable_ranges: the benchmark_ranges() of the binary
+    :param limits: the sandbox.Limits of the harness, but the CPU time (it
+                   adds up over the iterations)
+    """
+
+    def __init__(self, image, patchable_ranges, limits=DEFAULT_LIMITS):
+        super().__init__()
+        self.image = image
+        self.ranges = patchable_ranges
+        self.limits = limits._replace(cpu=None)
+        self.process = None
+
+    def patchable(self, patches):
+        """True if the patches hit the code run by an iteration only."""
+        return all(
+            any(s <= p.offset and p.end <= e for s, e in self.ranges) for p in patches
+        )
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            os.path.abspath(self.image.path),
+            stdin=PIPE,
+            stdout=PIPE,
+            stderr=DEVNULL,
+            start_new_session=True,
+            preexec_fn=lambda: apply_limits(self.limits),
+        )
+
+    async def stop(self):
+        """Kill the harness and its process group, return its exit code."""
+        if self.process is None:
+            return None
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass  # the group is already gone
+        returncode = await self.process.wait()
+        self.process = None
+        return returncode
+
+    async def run(self, patches, pin, timeout, evaluation=None):
+        """Run one iteration with the patches applied and pin as the user PIN.
+
+        :param patches: iterable of Patch, see patchable()
+        :param pin: the user PIN, in hexadecimal
+        :param timeout: seconds before the harness and its process group are killed
+        :param evaluation: the oracle.Evaluation fed with the rendered output
+        :return: (stdout, stderr, returncode, timedout, truncated, stopped) as
+                 with sandbox.run_sandboxed(), stdout is rendered by render();
+                 an iteration is never stopped, its result is read at once
+        """
+        if self.process is None:
+            await self.start()
+        timedout = False
+        try:
+            self.process.stdin.write(encode_request(self.image, patches, pin))
+            result = await asyncio.wait_for(
+                self.process.stdout.readexactly(RESULT.size), timeout
+            )
+            stdout = render(result)
+            if evaluation is not None:
+                evaluation.feed(1, stdout)
+            return stdout, b"", 0, False, False, False
+        except asyncio.TimeoutError:
+            timedout = True
+        except asyncio.IncompleteReadError:
+            pass  # the iteration crashed the harness
+        except BaseException:
+            await self.stop()  # unknown state, a new harness is started next time
+            raise
+        returncode = await self.stop()
+        return b"", b"", returncode, timedout, False, False
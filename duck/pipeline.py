@@ -0,0 +1,53 @@
+import asyncio
+
+
+async def bounded_as_completed(func, iterable, concurrency):
+    """Run a coroutine function on each item, at most concurrency at once, in one event loop.
+
+    The next item is only pulled when a slot of the semaphore is free, the
+    results are yielded in the order they complete. When the consumer stops
+    early (e.g. interrupted), the items already started are run to completion
+    and their results dropped.
+
+    :param func: the coroutine function applied to each item
+    :param iterable: the items, usually a generator
+    :param concurrency: maximum number of items being processed
+    :return: an asynchronous generator of the results
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    done = asyncio.Queue()
+    running = set()  # references to the tasks until they complete
+
+    async def run(item):
+        try:
+            done.put_nowait((await func(item), None))
+        except Exception as e:
+            done.put_nowait((None, e))
+        finally:
+            semaphore.release()
+
+    def result(res, error):
+        if error is not None:
+            raise error
+        return res
+
+    pending = 0
+    try:
+        for item in iterable:
+            await semaphore.acquire()
+            task = asyncio.ensure_future(run(item))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            pending += 1
+            while not done.empty():
+                pending -= 1
+                yield result(*done.get_nowait())
+        while pending:
+            pending -= 1
+            yield result(*await done.get())
+    finally:
+        # an interrupted campaign lets the running items complete instead of
+        # cancelling them: a task cancelled while asyncio spawns its
+        # subprocess waits forever for the process, which is left running
+        if running:
+            await asyncio.wait(running)
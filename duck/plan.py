@@ -0,0 +1,304 @@
+import json
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+
+from faults.flp import FLP
+from faults.jbe import JBE
+from faults.jmp import JMP
+from faults.nop import NOP
+from faults.z1b import Z1B
+from faults.z1w import Z1W
+from faults_inject import ExecConfig
+
+# model ids stored in the plan, the index in this tuple is the id
+MODELS = (JMP, JBE, Z1B, Z1W, NOP, FLP)
+MODEL_IDS = {m.name: i for i, m in enumerate(MODELS)}
+
+# one typed array per column, a planned fault costs 39 bytes
+COLUMNS = (
+    ("model", "B"),
+    ("label", "H"),
+    ("offset", "q"),
+    ("param", "q"),
+    ("target", "q"),
+    ("site", "q"),
+    ("occurrence", "I"),
+)
+# value of the columns missing from the plans saved by older versions
+DEFAULTS = {"site": -1, "occurrence": 0}
+
+
+class CampaignPlan:
+    """Compact description of the faults of a campaign, one row per fault.
+
+    Columns:
+      model   id of the fault model class (see MODELS)
+      label   index in labels of the name prefix (e.g. the jump mnemonic)
+      offset  file offset where the fault is applied
+      param   JMP/JBE: original target, Z1W: word size, NOP: length, FLP: bit significance
+      target  JMP/JBE: new target, -1 otherwise
+      site    transient faults: file offset of the instruction whose execution
+              triggers the fault, -1 otherwise
+      occurrence  transient faults: the fault is only applied during the
+              occurrence-th execution of site, 0 for a patched binary
+
+    The fault model objects are only built by materialize().
+    """
+
+    def __init__(self, infile, arch, labels=None):
+        super().__init__()
+        self.infile = infile
+        self.arch = arch
+        self.labels = list(labels or [])
+        self.label_ids = {l: i for i, l in enumerate(self.labels)}
+        for name, typecode in COLUMNS:
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.model)
+
+    def __getitem__(self, index):
+        """Returns a new plan with the selected rows (index must be a slice)."""
+        plan = CampaignPlan(self.infile, self.arch, self.labels)
+        for name, _ in COLUMNS:
+            setattr(plan, name, getattr(self, name)[index])
+        return plan
+
+    def shard(self, index, count):
+        """Returns the index-th of count interleaved parts of the plan."""
+        return self[index::count]
+
+    def label_id(self, label):
+        label_id = self.label_ids.get(label)
+        if label_id is None:
+            label_id = self.label_ids[label] = len(self.labels)
+            self.labels.append(label)
+        return label_id
+
+    def append(self, model, label, offset, param=0, target=-1):
+        self.model.append(MODEL_IDS[model])
+        self.label.append(self.label_id(label))
+        self.offset.append(offset)
+        self.param.append(param)
+        self.target.append(target)
+        self.site.append(DEFAULTS["site"])
+        self.occurrence.append(DEFAULTS["occurrence"])
+
+    def extend_rows(self, count, model, label, offset, param=0, target=-1):
+        """Append count faults of the same model at once.
+
+        Each of label, offset, param and target is either a single value shared
+        by all the faults or an array of count values (label ids for label).
+
+        :param count: number of faults
+        :param model: name of the fault model
+        """
+
+        def column(value, typecode):
+            if isinstance(value, int):
+                return array(typecode, [value]) * count
+            return value
+
+        if isinstance(label, str):
+            label = self.label_id(label)
+        self.model.extend(array("B", [MODEL_IDS[model]]) * count)
+        self.label.extend(column(label, "H"))
+        self.offset.extend(column(offset, "q"))
+        self.param.extend(column(param, "q"))
+        self.target.extend(column(target, "q"))
+        self.site.extend(column(DEFAULTS["site"], "q"))
+        self.occurrence.extend(column(DEFAULTS["occurrence"], "I"))
+
+    def transient(self, table, occurrences, coverage=None):
+        """Returns a plan applying each fault at run time, once per execution of its instruction.
+
+        Each fault becomes occurrences transient faults, triggered by the 1st
+        to occurrences-th execution of the instruction of the table containing
+        its offset. The faults outside the table are dropped.
+
+        :param table: the InstructionTable of the instructions
+        :param occurrences: number of executions faulted per fault
+        :param coverage: dict file offset -> number of executions in a single
+                         golden run (see trace.peak_coverage), caps the
+                         occurrences
+        """
+        order = sorted(range(len(table)), key=table.addr.__getitem__)
+        starts = array("q", (table.addr[i] for i in order))
+        ends = array("q", (table.addr[i] + table.size[i] for i in order))
+        plan = CampaignPlan(self.infile, self.arch, self.labels)
+        for i in range(len(self)):
+            j = bisect_right(starts, self.offset[i]) - 1
+            if j < 0 or self.offset[i] >= ends[j]:
+                continue
+            count = occurrences
+            if coverage is not None:
+                count = min(count, coverage.get(starts[j], 0))
+            for name, typecode in COLUMNS:
+                if name not in DEFAULTS:
+                    value = getattr(self, name)[i]
+                    getattr(plan, name).extend(array(typecode, [value]) * count)
+            plan.site.extend(array("q", [starts[j]]) * count)
+            plan.occurrence.extend(range(1, count + 1))
+        return plan
+
+    def row(self, i):
+        return (
+            self.model[i],
+            self.labels[self.label[i]],
+            self.offset[i],
+            self.param[i],
+            self.target[i],
+        )
+
+    def name(self, i):
+        """Name of the i-th fault, also used as the faulted binary file name."""
+        name = self.static_name(i)
+        if self.occurrence[i]:
+            name += "_occ_%d" % self.occurrence[i]
+        return name
+
+    def static_name(self, i):
+        model, label, offset, param, target = self.row(i)
+        model = MODELS[model]
+        if model in (JMP, JBE):
+            return "%s_at_%s_from_%s_to_%s" % (
+                label,
+                hex(offset),
+                hex(param),
+                hex(target),
+            )
+        elif model in (Z1B, Z1W):
+            return "%s_at_%s_zeroed" % (label, hex(offset))
+        elif model is NOP:
+            return "nop_%s-%s" % (hex(offset), hex(offset + param - 1))
+        return "flp_at_%s_sgnf_%d" % (hex(offset), param)
+
+    def materialize(self, i, image=None):
+        """Build the fault model of the i-th fault.
+
+        :param image: the BinaryImage of the input shared by the fault models
+        :return: a dict with the name and the fault model, plus the site and the
+                 occurrence of a transient fault, None if the fault model rejects it
+        """
+        model, label, offset, param, target = self.row(i)
+        model = MODELS[model]
+        word_length = param if model is Z1W else None
+        config = ExecConfig(
+            os.path.expanduser(self.infile), None, self.arch, word_length, image
+        )
+        if model in (JMP, JBE):
+            args = [hex(offset), hex(target)]
+        elif model is NOP:
+            args = [hex(offset) + "-" + hex(offset + param - 1)]
+        elif model is FLP:
+            args = [hex(offset), param]
+        else:
+            args = [hex(offset)]
+        try:
+            f = {"name": self.name(i), "fault": model(config, args)}
+        except SystemExit:
+            return None  # e.g. target out of range of the jump encoding
+        if self.occurrence[i]:
+            f["site"] = self.site[i]
+            f["occurrence"] = self.occurrence[i]
+        return f
+
+    def faults(self, image=None):
+        """Generator of the materialized faults, skipping the rejected ones."""
+        for i in range(len(self)):
+            f = self.materialize(i, image)
+            if f is not None:
+                yield f
+
+    def save(self, path):
+        """Serialize the plan: a JSON header line followed by the raw columns."""
+        header = {
+            "infile": self.infile,
+            "arch": self.arch,
+            "labels": self.labels,
+            "length": len(self),
+            "columns": [name for name, _ in COLUMNS],
+        }
+        with open(path, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            for name, _ in COLUMNS:
+                getattr(self, name).tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            plan = cls(header["infile"], header["arch"], header["labels"])
+            length = header["length"]
+            columns = header.get("columns")
+            if columns is None:  # the columns without a default
+                columns = [name for name, _ in COLUMNS if name not in DEFAULTS]
+            for name in columns:
+                getattr(plan, name).fromfile(f, length)
+            for name, typecode in COLUMNS:
+                if name not in columns:
+                    setattr(plan, name, array(typecode, [DEFAULTS[name]]) * length)
+        return plan
+
+
+class JumpTargets:
+    """Sorted table of every candidate jump target: each byte of each instruction."""
+
+    def __init__(self, table):
+        super().__init__()
+        self.targets = array("q")  # candidate target
+        self.starts = array("q")  # start of the instruction containing it
+        self.middle = array("B")  # 1 if the target is not an instruction start
+        for i in sorted(range(len(table)), key=table.addr.__getitem__):
+            addr = table.addr[i]
+            size = table.size[i]
+            self.targets.extend(range(addr, addr + size))
+            self.starts.extend(array("q", [addr]) * size)
+            self.middle.append(0)
+            self.middle.extend(array("B", [1]) * (size - 1))
+
+    def select(self, lo, hi, exclude):
+        """Slices of the candidates in [lo, hi] not belonging to the instruction at exclude."""
+        i0 = bisect_left(self.targets, lo)
+        i1 = bisect_right(self.targets, hi)
+        e0 = bisect_left(self.starts, exclude)
+        e1 = bisect_right(self.starts, exclude)
+        if e1 <= i0 or i1 <= e0:
+            return [slice(i0, i1)]
+        return [s for s in (slice(i0, e0), slice(e1, i1)) if s.start < s.stop]
+
+
+def plan_jump_retargets(plan, jump, candidates, image):
+    """Plan all the encodable retargets of one jump, in bulk.
+
+    The jump encoding is decoded once, the window of targets reachable by its
+    displacement is computed and the candidates inside it are selected by
+    bisection, so no fault model object is built and nothing is rejected later.
+
+    :param plan: the CampaignPlan to extend
+    :param jump: dict with the type, from and to of the jump
+    :param candidates: a JumpTargets
+    :param image: the content of the binary
+    :return: number of planned faults, None if the jump encoding is not supported
+    """
+    model = JMP if jump["type"] in ("jmp", "b") else JBE
+    at = int(jump["from"], 16)
+    to = int(jump["to"], 16)
+    decoded = model.decode(image, at, plan.arch)
+    if decoded is None:
+        return None
+    _, _, base, bits = decoded
+    lo = max(0, base - 2 ** (bits - 1))
+    hi = min(len(image) - 1, base + 2 ** (bits - 1) - 1)
+    label = plan.label_id(jump["type"])
+    label_middle = plan.label_id(jump["type"] + "_middlejmp")
+    count = 0
+    for s in candidates.select(lo, hi, to):
+        labels = array(
+            "H", (label_middle if m else label for m in candidates.middle[s])
+        )
+        n = s.stop - s.start
+        plan.extend_rows(n, model.name, labels, at, to, candidates.targets[s])
+        count += n
+    return count
@@ -0,0 +1,178 @@
+import hashlib
+
+from capstone import CS_ARCH_X86, CS_MODE_32, CS_MODE_64, Cs
+from capstone import CS_GRP_CALL, CS_GRP_INT, CS_GRP_IRET, CS_GRP_JUMP, CS_GRP_RET
+from capstone.x86 import X86_OP_IMM
+
+from duck.dedup import effective_delta
+
+VALIDATION_RATE = 0.05  # fraction of the predicted faults still run
+MAX_LENGTH = 15  # bytes, longest x86 instruction
+STEPS = 4  # instructions decoded from an entry before giving up
+
+# exit codes of a run killed by a signal
+SIGILL = -4
+SIGTRAP = -5
+SIGSEGV = -11
+
+# instructions ending a user-mode process, the privileged ones raise a
+# general protection fault
+FAULTING = {
+    "ud0": SIGILL,
+    "ud1": SIGILL,
+    "ud2": SIGILL,
+    "int3": SIGTRAP,
+    "hlt": SIGSEGV,
+    "cli": SIGSEGV,
+    "sti": SIGSEGV,
+    "in": SIGSEGV,
+    "out": SIGSEGV,
+    "insb": SIGSEGV,
+    "insw": SIGSEGV,
+    "insd": SIGSEGV,
+    "outsb": SIGSEGV,
+    "outsw": SIGSEGV,
+    "outsd": SIGSEGV,
+    "lgdt": SIGSEGV,
+    "lidt": SIGSEGV,
+    "lldt": SIGSEGV,
+    "ltr": SIGSEGV,
+    "clts": SIGSEGV,
+    "invd": SIGSEGV,
+    "wbinvd": SIGSEGV,
+    "invlpg": SIGSEGV,
+    "rdmsr": SIGSEGV,
+    "wrmsr": SIGSEGV,
+}
+
+# groups of the instructions leaving the straight-line code
+CONTROL_FLOW = (CS_GRP_JUMP, CS_GRP_CALL, CS_GRP_RET, CS_GRP_INT, CS_GRP_IRET)
+
+
+def executable_ranges(image):
+    """Virtual address ranges of the executable segments of the binary."""
+    return [
+        (s["p_vaddr"], s["p_vaddr"] + s["p_memsz"])
+        for s in image.elf.iter_segments()
+        if s["p_type"] == "PT_LOAD" and s["p_flags"] & 1  # PF_X
+    ]
+
+
+def sampled(name, rate):
+    """True for a fraction rate of the faults, the same ones from a run to the next."""
+    h = hashlib.blake2b(name.encode(), digest_size=8).digest()
+    return int.from_bytes(h, "little") < rate * 2**64
+
+
+class ValidationSample:
+    """Chooses the faults predicted to crash which still run, to validate the predictions.
+
+    A fraction rate of the faults is chosen by sampled(), and at least the
+    first fault predicted for each fault model: a small campaign may have
+    no sampled fault at all. A rate of 0 chooses none.
+
+    :param rate: the fraction of the faults chosen
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.models = set()  # the models with a chosen fault
+        self.forced = set()  # the faults chosen for their model, with any input
+
+    def __call__(self, name, model):
+        """True if the predicted crash of the fault name (of a model) runs."""
+        if self.rate <= 0:
+            return False
+        if name in self.forced or sampled(name, self.rate):
+            self.models.add(model)
+            return True
+        if model not in self.models:
+            self.models.add(model)
+            self.forced.add(name)
+            return True
+        return False
+
+
+class CrashPredictor:
+    """Predicts the x86 faults crashing as soon as their patched code runs.
+
+    The golden run of an input tells which instructions it executes: until
+    one of the instructions overlapping the patched bytes runs, the faulted
+    run is the golden run. From each of these entries the patched code is
+    decoded up to the first instruction touching a patched byte, the fault
+    is predicted to crash if from every entry that instruction is
+    undecodable, faulting in user mode (ud2, int3, hlt, privileged) or an
+    unconditional jmp or call outside the executable segments.
+
+    :param image: the BinaryImage of the original binary
+    :param coverages: dict input id -> the trace.golden_coverage() of its run
+    """
+
+    def __init__(self, image, coverages):
+        super().__init__()
+        self.image = image
+        self.coverages = coverages
+        mode = CS_MODE_64 if image.elf.elfclass == 64 else CS_MODE_32
+        self.md = Cs(CS_ARCH_X86, mode)
+        self.md.detail = True  # the operands of the branches
+        self.executable = executable_ranges(image)
+
+    def predict(self, patches, input):
+        """Exit code of the faulted run of an input, None if it is not predicted.
+
+        :param patches: the Patch list of the fault
+        :param input: the input id of the run, see store.input_id
+        """
+        delta = effective_delta(self.image.data, patches)
+        if not delta:
+            return None  # the golden binary
+        hits = self.coverages[input]
+        lo, hi = delta[0][0], delta[-1][0] + len(delta[-1][1])
+        changed = {o + k: b for o, data in delta for k, b in enumerate(data)}
+        prediction = None
+        entered = False
+        for at in range(max(lo - MAX_LENGTH + 1, 0), hi):
+            if at not in hits:
+                continue
+            original = self.decode(at, {})
+            if original is None or at + original.size <= lo:
+                continue  # does not reach the patched bytes
+            code = self.first_patched(at, lo, changed)
+            if code is None or (entered and code != prediction):
+                return None
+            prediction, entered = code, True
+        return prediction
+
+    def decode(self, at, changed):
+        """The instruction at a file offset of the patched binary, None if undecodable."""
+        vaddr = self.image.offset_to_vaddr(at)
+        if vaddr is None:
+            return None
+        end = min(at + MAX_LENGTH, len(self.image))
+        code = bytes(changed.get(o, self.image.data[o]) for o in range(at, end))
+        return next(self.md.disasm(code, vaddr, 1), None)
+
+    def first_patched(self, at, lo, changed):
+        # straight-line decoding from an entry to the first patched instruction
+        for _ in range(STEPS):
+            insn = self.decode(at, changed)
+            if insn is None:
+                return SIGILL
+            if at + insn.size > lo:
+                return self.classify(insn)
+            if any(insn.group(g) for g in CONTROL_FLOW):
+                return None
+            at += insn.size
+        return None
+
+    def classify(self, insn):
+        code = FAULTING.get(insn.mnemonic)
+        if code is not None:
+            return code
+        if insn.mnemonic in ("jmp", "call") and len(insn.operands) == 1:
+            op = insn.operands[0]
+            if op.type == X86_OP_IMM:
+                if not any(s <= op.imm < e for s, e in self.executable):
+                    return SIGSEGV
+        return None
@@ -0,0 +1,188 @@
+import asyncio
+import math
+import os
+import resource
+import shutil
+import signal
+from collections import namedtuple
+from functools import partial
+
+OUTPUT_LIMIT = 65536  # bytes of stdout and of stderr kept per run
+ADDRESS_SPACE = 1 << 30  # bytes
+FILE_SIZE = 1 << 20  # bytes, largest file a faulted run may write
+# RLIMIT_NPROC counts all the processes of the user: 0 forbids the faulted
+# runs to fork (root is not limited)
+PROCESSES = 0
+
+# rlimits of a faulted run, None for no limit, and the bytes of its output kept
+Limits = namedtuple("Limits", "cpu address_space file_size processes output")
+
+DEFAULT_LIMITS = Limits(None, ADDRESS_SPACE, FILE_SIZE, PROCESSES, OUTPUT_LIMIT)
+
+RLIMITS = (
+    ("cpu", resource.RLIMIT_CPU),
+    ("address_space", resource.RLIMIT_AS),
+    ("file_size", resource.RLIMIT_FSIZE),
+    ("processes", resource.RLIMIT_NPROC),
+)
+
+# prlimit(1) of util-linux sets the rlimits then execs the program
+PRLIMIT = shutil.which("prlimit")
+PRLIMIT_OPTIONS = {
+    "cpu": "--cpu",
+    "address_space": "--as",
+    "file_size": "--fsize",
+    "processes": "--nproc",
+}
+
+
+def run_limits(limits, timeout):
+    """The limits of a run killed after timeout seconds: the CPU time is capped too."""
+    return limits._replace(cpu=math.ceil(timeout) + 1)
+
+
+def apply_limits(limits, pid=0):
+    """Set the rlimits of a process, the current one by default.
+
+    The soft limit of the CPU time sends SIGXCPU, the hard one a second
+    later SIGKILL.
+    """
+    for field, rlimit in RLIMITS:
+        value = getattr(limits, field)
+        if value is not None:
+            hard = value + 1 if rlimit == resource.RLIMIT_CPU else value
+            resource.prlimit(pid, rlimit, (value, hard))
+
+
+def limited_command(args, limits):
+    """The command line running args with the rlimits of limits set by prlimit(1)."""
+    options = []
+    for field, rlimit in RLIMITS:
+        value = getattr(limits, field)
+        if value is not None:
+            hard = value + 1 if rlimit == resource.RLIMIT_CPU else value
+            options.append("%s=%d:%d" % (PRLIMIT_OPTIONS[field], value, hard))
+    return [PRLIMIT] + options + ["--"] + list(args)
+
+
+class BoundedBuffer:
+    """The first bytes written to it, in a buffer allocated once; the rest is counted and dropped.
+
+    :param limit: size of the buffer
+    """
+
+    def __init__(self, limit):
+        super().__init__()
+        self.data = bytearray(limit)
+        self.size = 0
+        self.truncated = False
+
+    def write(self, chunk):
+        n = min(len(chunk), len(self.data) - self.size)
+        self.data[self.size : self.size + n] = chunk[:n]
+        self.size += n
+        if n < len(chunk):
+            self.truncated = True
+
+    def getvalue(self):
+        return bytes(self.data[: self.size])
+
+
+class SandboxProtocol(asyncio.SubprocessProtocol):
+    """Reads the output of a sandboxed process as it comes into bounded buffers.
+
+    The output is also fed to the oracles of the run, exited is set as soon
+    as they are decided (and decided too).
+    """
+
+    def __init__(self, limit, evaluation=None):
+        super().__init__()
+        self.output = {1: BoundedBuffer(limit), 2: BoundedBuffer(limit)}
+        self.evaluation = evaluation
+        self.decided = False
+        loop = asyncio.get_running_loop()
+        self.exited = loop.create_future()  # or decided
+        self.closed = loop.create_future()  # exited, and the pipes closed
+
+    def pipe_data_received(self, fd, data):
+        self.output[fd].write(data)
+        if self.evaluation is not None and self.evaluation.feed(fd, data):
+            if not self.exited.done():
+                self.decided = True
+                self.exited.set_result(None)  # the run is killed
+
+    def process_exited(self):
+        if not self.exited.done():
+            self.exited.set_result(None)
+
+    def connection_lost(self, exc):
+        if not self.closed.done():  # cancelled with its waiter
+            self.closed.set_result(None)
+
+
+async def run_sandboxed(
+    args, timeout, limits, pass_fds=(), stdin=None, evaluation=None
+):
+    """Run a program in a new session with rlimits, keeping the beginning of its output.
+
+    On timeout the whole process group is killed, including the processes
+    the program may have spawned. The rlimits are set before the exec of the
+    program, which never runs without them: by prlimit(1), one more exec of a
+    small binary, or by a preexec_fn when it is not installed (subprocess then
+    forks the whole interpreter instead of using vfork, which doubles the
+    cost of a campaign of short runs). The process group is also killed as
+    soon as the verdicts of the oracles are known.
+
+    :param args: the command line
+    :param timeout: seconds before the process group is killed
+    :param limits: the Limits of the run, the CPU time is derived from timeout
+    :param pass_fds: file descriptors inherited by the program
+    :param stdin: bytes written to the standard input, inherited if None
+    :param evaluation: the oracle.Evaluation fed with the output, if any
+    :return: (stdout, stderr, returncode, timedout, truncated, stopped) where
+             truncated is True if stdout or stderr exceeded limits.output, and
+             stopped if the run was killed once its verdicts were known
+    """
+    loop = asyncio.get_running_loop()
+    limits = run_limits(limits, timeout)
+    preexec_fn = None
+    if PRLIMIT is not None:
+        args = limited_command(args, limits)
+    else:
+        preexec_fn = partial(apply_limits, limits)
+    transport, protocol = await loop.subprocess_exec(
+        lambda: SandboxProtocol(limits.output, evaluation),
+        *args,
+        stdin=None if stdin is None else asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        pass_fds=pass_fds,
+        start_new_session=True,
+        preexec_fn=preexec_fn,
+    )
+    pid = transport.get_pid()
+    try:
+        if stdin is not None:
+            # a request of a few bytes, it fits in the pipe
+            pipe = transport.get_pipe_transport(0)
+            pipe.write(stdin)
+            pipe.close()
+        try:
+            await asyncio.wait_for(asyncio.shield(protocol.exited), timeout)
+            timedout = False
+        except asyncio.TimeoutError:
+            timedout = True
+    finally:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass  # the group is already gone
+        # the rest of the output, the descendants holding the pipes are dead
+        await protocol.closed
+        transport.close()
+    out, err = protocol.output[1], protocol.output[2]
+    truncated = out.truncated or err.truncated
+    returncode = transport.get_returncode()
+    # the run may have exited by itself meanwhile
+    stopped = protocol.decided and returncode == -signal.SIGKILL
+    return (out.getvalue(), err.getvalue(), returncode, timedout, truncated, stopped)
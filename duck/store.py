@@ -0,0 +1,303 @@
+import csv
+import hashlib
+import json
+import sqlite3
+import time
+
+SCHEMA_VERSION = 4  # bump when the schema changes
+BATCH = 1000  # rows per transaction
+BATCH_SECONDS = 1.0  # a smaller batch is committed after this delay
+BLOB_CACHE = 65536  # ids of the outputs remembered, forgotten all at once
+
+# the outputs are interned in blobs, content-addressed by their SHA-256: the
+# runs and the golden runs only hold the ids of their stdout and stderr
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS binaries (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    infile TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    id INTEGER PRIMARY KEY,
+    hash BLOB NOT NULL UNIQUE,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS golden (
+    binary INTEGER NOT NULL REFERENCES binaries,
+    input TEXT NOT NULL,
+    stdout INTEGER NOT NULL REFERENCES blobs,
+    stderr INTEGER NOT NULL REFERENCES blobs,
+    exitcode INTEGER NOT NULL,
+    PRIMARY KEY (binary, input)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    binary INTEGER NOT NULL REFERENCES binaries,
+    fault TEXT NOT NULL,
+    input TEXT NOT NULL,
+    model TEXT NOT NULL,
+    site INTEGER NOT NULL,
+    occurrence INTEGER NOT NULL,
+    stdout INTEGER NOT NULL REFERENCES blobs,
+    stderr INTEGER NOT NULL REFERENCES blobs,
+    exitcode INTEGER NOT NULL,
+    timedout INTEGER NOT NULL,
+    truncated INTEGER NOT NULL,
+    stopped INTEGER NOT NULL,
+    verdicts TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    deviation INTEGER,
+    predicted INTEGER,
+    PRIMARY KEY (binary, fault, input)
+);
+CREATE INDEX IF NOT EXISTS runs_outcome ON runs (binary, outcome);
+CREATE INDEX IF NOT EXISTS runs_site ON runs (binary, site);
+CREATE INDEX IF NOT EXISTS runs_model ON runs (binary, model);
+CREATE INDEX IF NOT EXISTS runs_deviation ON runs (binary, deviation);
+"""
+
+# a run given to ResultStore.add()
+FIELDS = (
+    "binary fault input model site occurrence stdout stderr exitcode timedout "
+    "truncated stopped verdicts executed predicted"
+).split()
+
+# a run read back by ResultStore.rows()
+ROW_FIELDS = (
+    "binary infile fault input model site occurrence stdout stderr exitcode "
+    "timedout truncated stopped verdicts outcome deviation predicted"
+).split()
+
+ROWS = """
+SELECT b.hash, b.infile, r.fault, r.input, r.model, r.site, r.occurrence,
+       o.data, e.data, r.exitcode, r.timedout, r.truncated, r.stopped, r.verdicts,
+       r.outcome, r.deviation, r.predicted
+FROM runs r
+JOIN binaries b ON b.id = r.binary
+JOIN blobs o ON o.id = r.stdout
+JOIN blobs e ON e.id = r.stderr
+"""
+
+
+def input_id(key, plaintext):
+    """Identifier of an input vector of the campaign."""
+    return "%s %s" % (key, plaintext) if plaintext else key
+
+
+def outcome(exitcode, timedout, verdicts, executed=True, stopped=False):
+    """success (an oracle holds), timeout, stopped (killed once the verdicts
+    were known, none holds), crash (killed by a signal), error (exit code),
+    exit, or predicted for a crash predicted and not run."""
+    if not executed:
+        return "predicted"
+    if any(verdicts):
+        return "success"
+    if timedout:
+        return "timeout"
+    if stopped:
+        return "stopped"
+    if exitcode < 0:
+        return "crash"
+    return "error" if exitcode else "exit"
+
+
+class ResultStore:
+    """The results of the campaigns in an SQLite database, one row per run.
+
+    A row is keyed by the original binary, the name of the fault and the
+    input, indexed on the outcome, the site (file offset), the model of the
+    fault and the deviation. The stopped flag tells whether the run was
+    killed once the verdicts of its oracles were known, its exit code (-9) is
+    then not its own. The predicted column holds the exit code of a
+    predicted crash (see predict.CrashPredictor), the run was skipped when
+    its outcome is predicted. The outputs are interned: a row refers to its
+    stdout and stderr, stored once whatever the number of runs printing them,
+    and the deviation flag tells whether the run differs from the golden run
+    of its input (None if the golden run is unknown). The rows are inserted
+    in batched transactions, the database is in WAL mode: it can be queried
+    during a campaign.
+
+    :param path: the database file, created if needed
+    :raise ValueError: if the database has the schema of another version
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.db = sqlite3.connect(path)
+        (version,) = self.db.execute("PRAGMA user_version").fetchone()
+        tables = self.db.execute("SELECT name FROM sqlite_master").fetchall()
+        if version != SCHEMA_VERSION and tables:
+            self.db.close()
+            raise ValueError("%s was written by another version of Chaos Duck" % path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")  # WAL stays consistent
+        self.db.executescript(SCHEMA)
+        self.db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+        self.blob_ids = {}
+        self.goldens = {}  # (binary, input): (stdout, stderr, exitcode) ids
+        self.uncommitted = 0
+        self.committed = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def binary(self, digest, infile):
+        """Id of a binary in the database, from its SHA-256 (see cache.image_hash)."""
+        self.db.execute(
+            "INSERT OR IGNORE INTO binaries (hash, infile) VALUES (?, ?)",
+            (digest, infile),
+        )
+        self.db.commit()
+        query = "SELECT id FROM binaries WHERE hash = ?"
+        return self.db.execute(query, (digest,)).fetchone()[0]
+
+    def intern(self, data):
+        """Id of the blob holding data, stored if new."""
+        digest = hashlib.sha256(data).digest()
+        blob = self.blob_ids.get(digest)
+        if blob is None:
+            query = "SELECT id FROM blobs WHERE hash = ?"
+            row = self.db.execute(query, (digest,)).fetchone()
+            if row is not None:
+                blob = row[0]
+            else:
+                query = "INSERT INTO blobs (hash, data) VALUES (?, ?)"
+                blob = self.db.execute(query, (digest, data)).lastrowid
+            if len(self.blob_ids) >= BLOB_CACHE:
+                self.blob_ids.clear()  # a campaign printing garbage
+            self.blob_ids[digest] = blob
+        return blob
+
+    def completed(self, binary):
+        """The (fault, input) of the runs of a binary already stored."""
+        query = "SELECT fault, input FROM runs WHERE binary = ?"
+        return set(self.db.execute(query, (binary,)))
+
+    def crashed(self, binary):
+        """The (fault, input) of the runs of a binary which crashed, or are
+        predicted to."""
+        query = (
+            "SELECT fault, input FROM runs WHERE binary = ? AND exitcode < 0 "
+            "AND NOT timedout AND NOT stopped"
+        )
+        return set(self.db.execute(query, (binary,)))
+
+    def load_goldens(self, binary):
+        """Load the golden runs of a binary already stored, return their inputs."""
+        query = "SELECT input, stdout, stderr, exitcode FROM golden WHERE binary = ?"
+        for input, stdout, stderr, exitcode in self.db.execute(query, (binary,)):
+            self.goldens[binary, input] = (stdout, stderr, exitcode)
+        return {input for b, input in self.goldens if b == binary}
+
+    def set_golden(self, binary, input, stdout, stderr, exitcode):
+        """Store the output of the original binary with an input."""
+        golden = (self.intern(stdout), self.intern(stderr), exitcode)
+        self.db.execute(
+            "INSERT OR REPLACE INTO golden VALUES (?, ?, ?, ?, ?)",
+            (binary, input) + golden,
+        )
+        self.db.commit()
+        self.goldens[binary, input] = golden
+
+    def add(self, row):
+        """Store a run, given as a dict of the FIELDS, in the current batch."""
+        stdout, stderr = self.intern(row["stdout"]), self.intern(row["stderr"])
+        golden = self.goldens.get((row["binary"], row["input"]))
+        deviation = None
+        if golden is not None:
+            deviation = row["timedout"] or golden[:2] != (stdout, stderr)
+            # the exit code of a stopped run is the kill of the oracles
+            if not row["stopped"]:
+                deviation = deviation or golden[2] != row["exitcode"]
+        values = [row[f] for f in FIELDS[: FIELDS.index("executed")]]
+        values[FIELDS.index("stdout")] = stdout
+        values[FIELDS.index("stderr")] = stderr
+        values[FIELDS.index("verdicts")] = json.dumps(row["verdicts"])
+        values.append(
+            outcome(
+                row["exitcode"],
+                row["timedout"],
+                row["verdicts"],
+                row["executed"],
+                row["stopped"],
+            )
+        )
+        values.append(deviation)
+        values.append(row["predicted"])
+        self.db.execute(
+            "INSERT OR REPLACE INTO runs VALUES (%s)" % ", ".join("?" * len(values)),
+            values,
+        )
+        self.uncommitted += 1
+        if (
+            self.uncommitted >= BATCH
+            or time.monotonic() - self.committed > BATCH_SECONDS
+        ):
+            self.flush()
+
+    def flush(self):
+        """Commit the current batch."""
+        self.db.commit()
+        self.uncommitted = 0
+        self.committed = time.monotonic()
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            self.db.close()
+            self.db = None
+
+    def rows(self, binary=None):
+        """The stored runs as dicts of the ROW_FIELDS plus key and plaintext, in
+        the order they were stored."""
+        if binary is not None:
+            query = ROWS + " WHERE r.binary = ? ORDER BY r.rowid"
+            cursor = self.db.execute(query, (binary,))
+        else:
+            cursor = self.db.execute(ROWS + " ORDER BY r.rowid")
+        for values in cursor:
+            row = dict(zip(ROW_FIELDS, values))
+            row["key"], _, row["plaintext"] = row["input"].partition(" ")
+            row["verdicts"] = json.loads(row["verdicts"])
+            yield row
+
+    def export(self, path, binary=None):
+        """Write the runs to a .csv or a .jsonl file, by the extension of path.
+
+        The CSV has the columns of the former results.csv: binary path,
+        fault, key, plaintext, stdout and stderr (as Python bytes literals),
+        exit code, timed out, truncated, then one column per oracle. The JSONL
+        has one object per run with all the fields, stdout and stderr decoded
+        as latin-1.
+        """
+        self.flush()
+        with open(path, "w", newline="") as f:
+            if path.endswith(".jsonl"):
+                for row in self.rows(binary):
+                    row["stdout"] = row["stdout"].decode("latin-1")
+                    row["stderr"] = row["stderr"].decode("latin-1")
+                    for field in ("timedout", "truncated", "stopped", "deviation"):
+                        if row[field] is not None:
+                            row[field] = bool(row[field])
+                    f.write(json.dumps(row) + "\n")
+            elif path.endswith(".csv"):
+                writer = csv.writer(f, delimiter=",")
+                for row in self.rows(binary):
+                    writer.writerow(
+                        [
+                            row["infile"],
+                            row["fault"],
+                            row["key"],
+                            row["plaintext"],
+                            row["stdout"],
+                            row["stderr"],
+                            row["exitcode"],
+                            bool(row["timedout"]),
+                            bool(row["truncated"]),
+                        ]
+                        + row["verdicts"]
+                    )
+            else:
+                raise ValueError("cannot export to %s: not .csv or .jsonl" % path)
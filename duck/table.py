@@ -0,0 +1,99 @@
+from array import array
+
+# operand kinds of the kind column
+KIND_NONE = 0  # nothing the campaigns care about
+KIND_BRANCH = 1  # branch with an immediate target, see the target column
+KIND_INDIRECT = 2  # branch through a register or memory
+KIND_IMM = 3  # cmp/mov with a static immediate value
+
+COLUMNS = (
+    ("addr", "q"),
+    ("size", "B"),
+    ("mnemonic", "H"),
+    ("target", "q"),
+    ("kind", "B"),
+)
+
+
+class InstructionTable:
+    """Columnar table of the disassembled instructions, one typed array per column.
+
+    Columns:
+      addr      file offset of the instruction
+      size      size in bytes
+      mnemonic  index in mnemonics
+      target    file offset of the immediate branch target, -1 if none
+      kind      operand kind (KIND_*)
+    """
+
+    def __init__(self, mnemonics=None):
+        super().__init__()
+        self.mnemonics = list(mnemonics or [])
+        self.mnemonic_ids = {m: i for i, m in enumerate(self.mnemonics)}
+        for name, typecode in COLUMNS:
+            setattr(self, name, array(typecode))
+
+    def __len__(self):
+        return len(self.addr)
+
+    def __getitem__(self, index):
+        """Returns a new table with the selected rows (index must be a slice)."""
+        table = InstructionTable(self.mnemonics)
+        for name, _ in COLUMNS:
+            setattr(table, name, getattr(self, name)[index])
+        return table
+
+    def take(self, rows):
+        """Returns a new table with the rows of the given indices."""
+        table = InstructionTable(self.mnemonics)
+        for name, typecode in COLUMNS:
+            column = getattr(self, name)
+            setattr(table, name, array(typecode, (column[i] for i in rows)))
+        return table
+
+    def mnemonic_id(self, mnemonic):
+        mnemonic_id = self.mnemonic_ids.get(mnemonic)
+        if mnemonic_id is None:
+            mnemonic_id = self.mnemonic_ids[mnemonic] = len(self.mnemonics)
+            self.mnemonics.append(mnemonic)
+        return mnemonic_id
+
+    def append(self, addr, size, mnemonic, target=-1, kind=KIND_NONE):
+        self.addr.append(addr)
+        self.size.append(size)
+        self.mnemonic.append(self.mnemonic_id(mnemonic))
+        self.target.append(target)
+        self.kind.append(kind)
+
+    def extend(self, other):
+        """Append the rows of another table, translating its mnemonic ids."""
+        ids = [self.mnemonic_id(m) for m in other.mnemonics]
+        self.addr.extend(other.addr)
+        self.size.extend(other.size)
+        self.mnemonic.extend(array("H", (ids[m] for m in other.mnemonic)))
+        self.target.extend(other.target)
+        self.kind.extend(other.kind)
+
+    def name(self, i):
+        """Mnemonic of the i-th instruction."""
+        return self.mnemonics[self.mnemonic[i]]
+
+    def tofile(self, f):
+        for name, _ in COLUMNS:
+            getattr(self, name).tofile(f)
+
+    @classmethod
+    def fromfile(cls, f, mnemonics, count):
+        table = cls(mnemonics)
+        for name, _ in COLUMNS:
+            getattr(table, name).fromfile(f, count)
+        return table
+
+
+def parse_imm(op_str):
+    """Value of an operand string made of a single immediate ('0x1134' or '#0x1134'), None otherwise."""
+    op_str = op_str.lstrip("#")
+    try:
+        return int(op_str, 0)
+    except ValueError:
+        return None
@@ -0,0 +1,123 @@
+import os
+from bisect import bisect_right
+
+
+def function_ranges(image, names):
+    """File offset ranges of the named functions, from the symbol tables.
+
+    :param image: the BinaryImage of the binary
+    :param names: names of the functions
+    :return: a list of (start, end) file offsets, end excluded
+    :raise ValueError: if a function is not found
+    """
+    ranges = []
+    found = set()
+    for section in image.elf.iter_sections():
+        if section["sh_type"] not in ("SHT_SYMTAB", "SHT_DYNSYM"):
+            continue
+        for symbol in section.iter_symbols():
+            if symbol.name not in names or symbol["st_info"]["type"] != "STT_FUNC":
+                continue
+            start = image.vaddr_to_offset(symbol["st_value"] & ~1)  # thumb bit
+            if start is None or symbol["st_size"] == 0:
+                continue  # imported or without size, nothing to fault
+            ranges.append((start, start + symbol["st_size"]))
+            found.add(symbol.name)
+    missing = [n for n in names if n not in found]
+    if missing:
+        raise ValueError(
+            "function not found in %s: %s" % (image.path, ", ".join(missing))
+        )
+    return ranges
+
+
+def line_ranges(image, filename, first, last):
+    """File offset ranges of the code generated for lines first to last of a source file.
+
+    The ranges come from the DWARF line programs, the binary must be compiled
+    with -g. The file matches by its name or the end of its path.
+
+    :return: a list of (start, end) file offsets, end excluded
+    :raise ValueError: if the binary has no line info for these lines
+    """
+    if not image.elf.has_dwarf_info():
+        raise ValueError("%s has no debug info, compile it with -g" % image.path)
+    dwarf = image.elf.get_dwarf_info()
+    ranges = []
+    for cu in dwarf.iter_CUs():
+        lineprog = dwarf.line_program_for_CU(cu)
+        if lineprog is None:
+            continue
+        # DWARF 5 counts the files and directories from 0, the earlier
+        # versions from 1 with 0 standing for the compilation directory
+        base = 0 if lineprog.header.version >= 5 else 1
+        dirs = [b""] * base + list(lineprog["include_directory"])
+        paths = [
+            os.path.join(dirs[f.dir_index], f.name).decode()
+            for f in lineprog["file_entry"]
+        ]
+        previous = None
+        for entry in lineprog.get_entries():
+            state = entry.state
+            if state is None:
+                continue
+            if previous is not None and first <= previous.line <= last:
+                path = paths[previous.file - base]
+                if path == filename or path.endswith(os.sep + filename):
+                    start = image.vaddr_to_offset(previous.address)
+                    if start is not None:
+                        ranges.append((start, start + state.address - previous.address))
+            previous = None if state.end_sequence else state
+    if not ranges:
+        raise ValueError(
+            "no code for %s:%d-%d in %s" % (filename, first, last, image.path)
+        )
+    return ranges
+
+
+def address_ranges(image, start, end):
+    """File offset range of the virtual addresses start to end (included), as shown by objdump."""
+    offset = image.vaddr_to_offset(start)
+    if offset is None or image.vaddr_to_offset(end) is None:
+        raise ValueError(
+            "%s-%s is not mapped from %s" % (hex(start), hex(end), image.path)
+        )
+    return [(offset, offset + end - start + 1)]
+
+
+def parse_line_range(spec):
+    """'file.c:10-20' or 'file.c:10' -> (filename, first, last)"""
+    filename, _, lines = spec.rpartition(":")
+    first, _, last = lines.partition("-")
+    return filename, int(first), int(last or first)
+
+
+def parse_address_range(spec):
+    """'0x1140-0x11bf' -> (start, end)"""
+    start, _, end = spec.partition("-")
+    return int(start, 0), int(end, 0)
+
+
+def restrict(table, jumps, cmpsmovs, ranges):
+    """Keep the instructions starting in one of the ranges, and the faults candidates they contain.
+
+    Jump targets are drawn from the table, so the retargets stay in the ranges too.
+
+    :param ranges: a list of (start, end) file offsets, end excluded
+    :return: (table, jumps, cmpsmovs) restricted to the ranges
+    """
+
+    ranges = sorted(ranges)
+    starts = [start for start, _ in ranges]
+    ends = []  # largest end of the ranges starting before, ranges may overlap
+    for _, end in ranges:
+        ends.append(max(end, ends[-1]) if ends else end)
+
+    def inside(offset):
+        i = bisect_right(starts, offset) - 1
+        return i >= 0 and offset < ends[i]
+
+    rows = [i for i in range(len(table)) if inside(table.addr[i])]
+    jumps = [j for j in jumps if inside(int(j["from"], 16))]
+    cmpsmovs = [c for c in cmpsmovs if inside(int(c["loc"], 16))]
+    return table.take(rows), jumps, cmpsmovs
@@ -0,0 +1,372 @@
+import ctypes
+import hashlib
+import json
+import os
+import re
+import signal
+import tempfile
+from array import array
+from subprocess import DEVNULL, run
+
+from duck.cache import image_hash
+from duck.sandbox import apply_limits
+
+# bump when the traces change, it invalidates the cache (2: in the order of
+# the first executions)
+TRACER_VERSION = 2
+
+PTRACE_TRACEME = 0
+PTRACE_PEEKUSER = 3
+PTRACE_POKEUSER = 6
+PTRACE_CONT = 7
+PTRACE_KILL = 8
+PTRACE_SINGLESTEP = 9
+PTRACE_GETREGS = 12
+PTRACE_DETACH = 17
+# fields of the x86_64 user_regs_struct
+USER_REGS = (
+    "r15 r14 r13 r12 rbp rbx r11 r10 r9 r8 rax rcx rdx rsi rdi orig_rax rip cs "
+    "eflags rsp ss fs_base gs_base ds es fs gs"
+).split()
+RIP = USER_REGS.index("rip") * 8  # offset of rip in the user_regs_struct
+
+# a runaway golden run is stopped after this many instructions
+MAX_STEPS = 50 * 1000 * 1000
+
+libc = ctypes.CDLL(None, use_errno=True)
+libc.ptrace.restype = ctypes.c_long
+libc.ptrace.argtypes = (ctypes.c_long, ctypes.c_long, ctypes.c_void_p, ctypes.c_void_p)
+
+
+def ptrace(request, pid, addr=0, data=0):
+    ctypes.set_errno(0)
+    res = libc.ptrace(request, pid, addr, data)
+    if res == -1 and ctypes.get_errno() != 0:
+        raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    return res
+
+
+def executable_mappings(pid, path):
+    """(start, end, file offset) of the executable mappings of the file path in the process."""
+    path = os.path.realpath(path)
+    mappings = []
+    with open("/proc/%d/maps" % pid) as f:
+        for line in f:
+            fields = line.split(None, 5)
+            if len(fields) == 6 and "x" in fields[1] and fields[5].strip() == path:
+                start, end = (int(a, 16) for a in fields[0].split("-"))
+                mappings.append((start, end, int(fields[2], 16)))
+    return mappings
+
+
+def mapped_address(mappings, offset):
+    """Address of a file offset of the binary in the process, from its executable_mappings()."""
+    for start, end, file_offset in mappings:
+        if file_offset <= offset < file_offset + end - start:
+            return start + offset - file_offset
+    raise ValueError("offset %#x is not mapped" % offset)
+
+
+def traced_process(args, env=None, output=None, limits=None):
+    """Fork and exec args[0] under ptrace.
+
+    :param env: the environment of the program, default: the current one
+    :param output: (stdout, stderr) file descriptors of the program, which then
+                   runs in a new session, default: its output is discarded
+    :param limits: the sandbox.Limits of the program, default: none
+    :return: the pid of the child, stopped right after the exec
+    """
+    pid = os.fork()
+    if pid == 0:  # child: stop at the exec and let the parent step through
+        try:
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            if output is not None:
+                os.setsid()  # killed with its descendants on timeout
+                os.dup2(output[0], 1)
+                os.dup2(output[1], 2)
+            if limits is not None:
+                apply_limits(limits)
+            ptrace(PTRACE_TRACEME, 0)
+            os.execve(args[0], args, os.environ if env is None else env)
+        finally:
+            os._exit(127)
+    _, status = os.waitpid(pid, 0)  # SIGTRAP of the exec, the binary is mapped
+    if not os.WIFSTOPPED(status):
+        raise OSError("cannot trace %s" % args[0])
+    return pid
+
+
+def step(pid, mappings, hits, stop_at=None):
+    """Single-step a traced process, counting the executions of the instructions of the binary.
+
+    :param mappings: the executable_mappings() of the binary
+    :param hits: dict file offset -> number of executions, updated
+    :param stop_at: file offset of an instruction of the binary, stepping
+                    stops when it is reached, before it executes
+    :return: the file offset where the still running process stopped (None
+             if outside the binary), False if it terminated
+    """
+    steps = 0
+    sig = 0
+    at = None
+    while steps < MAX_STEPS:
+        rip = ptrace(PTRACE_PEEKUSER, pid, RIP) & 0xFFFFFFFFFFFFFFFF
+        at = None
+        for start, end, offset in mappings:
+            if start <= rip < end:
+                at = rip - start + offset
+                break
+        if at is not None:
+            if at == stop_at:
+                return at
+            hits[at] = hits.get(at, 0) + 1
+        ptrace(PTRACE_SINGLESTEP, pid, 0, sig)
+        _, status = os.waitpid(pid, 0)
+        if os.WIFEXITED(status) or os.WIFSIGNALED(status):
+            return False
+        # forward the signals received by the program, not the step traps
+        sig = os.WSTOPSIG(status)
+        sig = 0 if sig == signal.SIGTRAP else sig
+        steps += 1
+    print("Traced run (pid %d) stopped after %d instructions" % (pid, steps))
+    return at
+
+
+def kill(pid):
+    ptrace(PTRACE_KILL, pid)
+    os.waitpid(pid, 0)
+
+
+def trace_x86(args, stop_at=None):
+    """Single-step a native run with ptrace and count the executions of each instruction of the binary.
+
+    :param args: the command line, args[0] is the traced binary
+    :param stop_at: file offset of an instruction of the binary, the run is
+                    killed when it is reached, before it executes
+    :return: a dict file offset -> number of executions, in the order of
+             their first execution
+    """
+    pid = traced_process(args)
+    hits = {}
+    if step(pid, executable_mappings(pid, args[0]), hits, stop_at) is not False:
+        kill(pid)
+    return hits
+
+
+class Snapshot:
+    """State of a native x86_64 process stopped at an instruction of its binary.
+
+    Attributes:
+      regs      dict name -> value of the user_regs_struct fields
+      regions   list of (start, end, perms, data) of its memory mappings,
+                perms as in /proc/pid/maps ('r-xp'), data None if unreadable
+      mappings  the executable_mappings() of the binary
+      ran       sorted file offsets of the instructions executed before
+      brk       start of the heap (program break)
+    """
+
+    def __init__(self, regs, regions, mappings, ran, brk):
+        super().__init__()
+        self.regs = regs
+        self.regions = regions
+        self.mappings = mappings
+        self.ran = ran
+        self.brk = brk
+
+
+def start_brk(pid):
+    with open("/proc/%d/stat" % pid) as f:
+        # the fields after the command, which may contain spaces
+        fields = f.read().rsplit(")", 1)[1].split()
+    return int(fields[47 - 3])  # field 47, start_brk
+
+
+def read_regions(pid):
+    regions = []
+    with open("/proc/%d/maps" % pid) as maps, open(
+        "/proc/%d/mem" % pid, "rb", 0
+    ) as mem:
+        for line in maps:
+            fields = line.split()
+            start, end = (int(a, 16) for a in fields[0].split("-"))
+            if start >= 1 << 47:
+                continue  # [vsyscall], above the user address space
+            try:
+                data = os.pread(mem.fileno(), end - start, start)
+            except OSError:
+                data = None  # [vvar]
+            regions.append((start, end, fields[1], data))
+    return regions
+
+
+def snapshot_x86(args, stop_at, env=None):
+    """Single-step a native run up to an instruction and capture the process there.
+
+    :param args: the command line, args[0] is the binary
+    :param stop_at: file offset of an instruction of the binary
+    :param env: the environment of the program, default: the current one
+    :return: a Snapshot, None if the run never reaches stop_at
+    """
+    pid = traced_process(args, env)
+    hits = {}
+    mappings = executable_mappings(pid, args[0])
+    at = step(pid, mappings, hits, stop_at)
+    if at is False:
+        return None
+    try:
+        if at != stop_at:
+            return None
+        regs = (ctypes.c_ulonglong * len(USER_REGS))()
+        ptrace(PTRACE_GETREGS, pid, 0, ctypes.addressof(regs))
+        regions = read_regions(pid)
+        brk = start_brk(pid)
+    finally:
+        kill(pid)
+    regs = dict(zip(USER_REGS, regs))
+    return Snapshot(regs, regions, mappings, sorted(hits), brk)
+
+
+def trace_arm(image, args, qemu_prefix):
+    """Run under qemu with the translation and execution logs and count the executions of each instruction.
+
+    qemu logs the instructions of each translated block once (in_asm) and each
+    execution of a block (exec, with nochain so every execution is logged),
+    the load address of the binary comes from the page log.
+
+    :param image: the BinaryImage of the traced binary
+    :param args: the command line, args[0] is the traced binary
+    :param qemu_prefix: the qemu command line preceding args, e.g. ['qemu-arm', '-L', '/usr/arm-linux-gnueabi/']
+    :return: a dict file offset -> number of executions, in the order of
+             the first execution of their block
+    """
+    with tempfile.NamedTemporaryFile("r", suffix=".log") as log:
+        run(
+            qemu_prefix + ["-d", "in_asm,exec,nochain,page", "-D", log.name] + args,
+            stdin=DEVNULL,
+            stdout=DEVNULL,
+            stderr=DEVNULL,
+        )
+        blocks = {}  # block address -> addresses of its instructions
+        executions = {}  # block address -> number of executions
+        bias = 0
+        block = None
+        for line in log:
+            if line.startswith("IN:"):
+                block = []
+            elif block is not None and line.startswith("0x"):
+                pc = int(line.split(":", 1)[0], 16)
+                if not block:
+                    blocks[pc] = block
+                block.append(pc)
+            elif line.startswith("Trace"):
+                block = None
+                # 'Trace 0: 0x7f12 [00000000/00010438/...] main', the pc is the
+                # second field of the recent versions, the only one before
+                fields = re.search(r"\[([0-9a-fA-F/]+)\]", line).group(1).split("/")
+                pc = int(fields[1] if len(fields) > 1 else fields[0], 16)
+                executions[pc] = executions.get(pc, 0) + 1
+            elif line.startswith("entry"):
+                block = None
+                bias = (int(line.split()[1], 16) & ~1) - (image.elf.header.e_entry & ~1)
+            else:
+                block = None
+    hits = {}
+    for pc, count in executions.items():
+        for insn in blocks.get(pc, ()):
+            at = image.vaddr_to_offset(insn - bias)
+            if at is not None:
+                hits[at] = hits.get(at, 0) + count
+    return hits
+
+
+def trace_path(cache_dir, image, arch, args):
+    """Path of the cached trace of the binary run with the inputs args[1:]."""
+    inputs = hashlib.sha256(json.dumps(args[1:]).encode()).hexdigest()[:16]
+    name = "%s-%s-%s-v%d.trace" % (image_hash(image), arch, inputs, TRACER_VERSION)
+    return os.path.join(cache_dir, name)
+
+
+def save_trace(path, hits):
+    # the offsets keep the order of the dict, the order of their first execution
+    offsets = array("q", hits)
+    counts = array("Q", (hits[at] for at in offsets))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(json.dumps({"count": len(offsets)}).encode() + b"\n")
+        offsets.tofile(f)
+        counts.tofile(f)
+    os.replace(tmp, path)
+
+
+def load_trace(path):
+    """:return: the dict stored by save_trace, None if there is no valid entry"""
+    try:
+        with open(path, "rb") as f:
+            count = json.loads(f.readline())["count"]
+            offsets = array("q")
+            offsets.fromfile(f, count)
+            counts = array("Q")
+            counts.fromfile(f, count)
+    except (OSError, ValueError, EOFError, KeyError):
+        return None
+    return dict(zip(offsets, counts))
+
+
+def golden_coverage(image, arch, commands, cache_dir, qemu_prefix=()):
+    """Execution counts of the instructions of the original binary over all the inputs.
+
+    Each golden run is traced once, then reused from the cache.
+
+    :param image: the BinaryImage of the binary
+    :param arch: 'x86' or 'arm'
+    :param commands: the command lines of the golden runs, without the qemu prefix
+    :param cache_dir: directory of the cache, None to disable it
+    :param qemu_prefix: the qemu command line of the ARM runs
+    :return: a dict file offset -> number of executions, summed over the
+             runs, in the order of their first execution for a single run
+    """
+    coverage = {}
+    for hits in golden_traces(image, arch, commands, cache_dir, qemu_prefix):
+        for at, count in hits.items():
+            coverage[at] = coverage.get(at, 0) + count
+    return coverage
+
+
+def peak_coverage(image, arch, commands, cache_dir, qemu_prefix=()):
+    """Execution counts of the instructions of the original binary in a single run.
+
+    Same as golden_coverage(), but an instruction counts the executions of
+    the golden run executing it the most times, not the sum over the runs.
+    """
+    coverage = {}
+    for hits in golden_traces(image, arch, commands, cache_dir, qemu_prefix):
+        for at, count in hits.items():
+            coverage[at] = max(coverage.get(at, 0), count)
+    return coverage
+
+
+def golden_traces(image, arch, commands, cache_dir, qemu_prefix=()):
+    # the traces of the golden runs, from the cache when they are in it
+    for args in commands:
+        path = None if cache_dir is None else trace_path(cache_dir, image, arch, args)
+        hits = None if path is None else load_trace(path)
+        if hits is None:
+            if arch == "x86":
+                hits = trace_x86(args)
+            else:
+                hits = trace_arm(image, args, list(qemu_prefix))
+            if path is not None:
+                save_trace(path, hits)
+        yield hits
+
+
+def executed_ranges(table, coverage):
+    """File offset ranges of the instructions of the table executed at least once."""
+    return [
+        (table.addr[i], table.addr[i] + table.size[i])
+        for i in range(len(table))
+        if table.addr[i] in coverage
+    ]
@@ -0,0 +1,173 @@
+import os
+import signal
+import threading
+
+from duck.trace import PTRACE_CONT, PTRACE_DETACH, PTRACE_PEEKUSER, PTRACE_POKEUSER
+from duck.trace import PTRACE_SINGLESTEP, RIP, executable_mappings, mapped_address
+from duck.trace import ptrace, traced_process
+from duck.sandbox import DEFAULT_LIMITS, BoundedBuffer, run_limits
+
+INT3 = b"\xcc"
+# the corrupted code is single-stepped while the program runs inside it, a jump
+# back into it does not keep the fault alive forever
+MAX_CORRUPTED_STEPS = 16
+
+
+def rip(pid):
+    return ptrace(PTRACE_PEEKUSER, pid, RIP) & 0xFFFFFFFFFFFFFFFF
+
+
+def drain(fd, output, stream, evaluation, decide):
+    with open(fd, "rb", 0) as pipe:
+        for chunk in iter(lambda: pipe.read(65536), b""):
+            output.write(chunk)
+            if evaluation is not None and evaluation.feed(stream, chunk):
+                decide()
+
+
+def inject(
+    args, site, patches, occurrence, timeout, limits=DEFAULT_LIMITS, evaluation=None
+):
+    """Run the unmodified binary under ptrace and fault one execution of an instruction.
+
+    A breakpoint counts the executions of the instruction at site, the patches
+    are written in the code of the process on the occurrence-th one only. The
+    corrupted code is single-stepped as long as the program runs inside it,
+    then the original code is restored and the process runs untraced.
+
+    :param args: the command line, args[0] is the binary
+    :param site: file offset of the instruction triggering the fault
+    :param patches: list of (file offset, bytes) written in the code
+    :param occurrence: the faulted execution, from 1
+    :param timeout: seconds before the process and its group are killed
+    :param limits: the sandbox.Limits of the process
+    :param evaluation: the oracle.Evaluation fed with the output, the process
+                       is killed as soon as it is decided
+    :return: (stdout, stderr, returncode, timedout, truncated, stopped,
+             evaluation), as with sandbox.run_sandboxed() and the evaluation,
+             which is a copy in the worker process
+    """
+    limits = run_limits(limits, timeout)
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    try:
+        pid = traced_process(args, output=(out_w, err_w), limits=limits)
+    except BaseException:
+        os.close(out_r)
+        os.close(err_r)
+        raise
+    finally:
+        os.close(out_w)
+        os.close(err_w)
+    # the pipes are read while the process runs, it may write more than they hold
+    decided = threading.Event()
+
+    def decide():
+        # the verdicts are known, stop the run
+        decided.set()
+        kill_group(pid)
+
+    outs, errs = BoundedBuffer(limits.output), BoundedBuffer(limits.output)
+    readers = [
+        threading.Thread(target=drain, args=(out_r, outs, 1, evaluation, decide)),
+        threading.Thread(target=drain, args=(err_r, errs, 2, evaluation, decide)),
+    ]
+    for reader in readers:
+        reader.start()
+    expired = threading.Event()
+
+    def expire():
+        expired.set()
+        kill_group(pid)
+
+    timer = threading.Timer(timeout, expire)
+    timer.start()
+    try:
+        status = fault(pid, args[0], site, patches, occurrence)
+    except OSError:
+        _, status = os.waitpid(pid, 0)  # killed while traced
+    finally:
+        timer.cancel()
+        kill_group(pid)  # what the program may have spawned
+        for reader in readers:
+            reader.join()
+    returncode = os.waitstatus_to_exitcode(status)
+    truncated = outs.truncated or errs.truncated
+    timedout = expired.is_set()
+    stopped = decided.is_set() and not timedout and returncode == -signal.SIGKILL
+    return (
+        outs.getvalue(),
+        errs.getvalue(),
+        returncode,
+        timedout,
+        truncated,
+        stopped,
+        evaluation,
+    )
+
+
+def kill_group(pid):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass  # the group is already gone
+
+
+def fault(pid, path, site, patches, occurrence):
+    """Drive the traced process up to its exit, see inject().
+
+    :return: the wait status of the process
+    """
+    mappings = executable_mappings(pid, path)
+    at = mapped_address(mappings, site)
+    with open("/proc/%d/mem" % pid, "r+b", 0) as mem:
+        # the tracer writes through the read-only code pages
+        fd = mem.fileno()
+        original = os.pread(fd, 1, at)
+        os.pwrite(fd, INT3, at)
+        hits = 0
+        sig = 0
+        while True:
+            ptrace(PTRACE_CONT, pid, 0, sig)
+            _, status = os.waitpid(pid, 0)
+            if not os.WIFSTOPPED(status):
+                return status  # the occurrence never came
+            sig = os.WSTOPSIG(status)
+            if sig != signal.SIGTRAP or rip(pid) != at + 1:
+                continue  # a signal of the program, forwarded
+            sig = 0
+            hits += 1
+            # back to the instruction, with its original code
+            os.pwrite(fd, original, at)
+            ptrace(PTRACE_POKEUSER, pid, RIP, at)
+            if hits == occurrence:
+                break
+            ptrace(PTRACE_SINGLESTEP, pid, 0, 0)
+            _, status = os.waitpid(pid, 0)
+            if not os.WIFSTOPPED(status):
+                return status
+            sig = os.WSTOPSIG(status)
+            sig = 0 if sig == signal.SIGTRAP else sig
+            os.pwrite(fd, INT3, at)
+        saved = []
+        lo = hi = at
+        for offset, data in patches:
+            address = mapped_address(mappings, offset)
+            saved.append((address, os.pread(fd, len(data), address)))
+            os.pwrite(fd, data, address)
+            lo = min(lo, address)
+            hi = max(hi, address + len(data))
+        for _ in range(MAX_CORRUPTED_STEPS):
+            ptrace(PTRACE_SINGLESTEP, pid, 0, 0)
+            _, status = os.waitpid(pid, 0)
+            if not os.WIFSTOPPED(status):
+                return status
+            sig = os.WSTOPSIG(status)
+            sig = 0 if sig == signal.SIGTRAP else sig
+            if sig or not lo <= rip(pid) < hi:
+                break  # out of the corrupted code, or crashed in it
+        for address, data in saved:
+            os.pwrite(fd, data, address)
+    ptrace(PTRACE_DETACH, pid, 0, sig)
+    _, status = os.waitpid(pid, 0)
+    return status
@@ -1,3 +1,6 @@
+from patch import write_patches
+
+
 class FaultModel:
     """A fault model with its characteristics and behavior."""
     name = ""
@@ -8,9 +11,12 @@ class FaultModel:
         super().__init__()
         self.config = config
         self.args = args
+        self.patch = None  # compiled Patch, set by the fault model
 
     def edited_memory_locations(self):
         """Returns the locations of the bits edited by the fault model."""
+        return self.patch.edited_bits()
 
     def apply(self, opened_file):
         """Apply the fault model to the given file."""
+        write_patches(opened_file, [self.patch])
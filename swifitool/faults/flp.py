@@ -1,4 +1,6 @@
 from faults.faultmodel import FaultModel
+from image import config_image
+from patch import Patch
 from utils import *
 
 
@@ -18,12 +20,8 @@ class FLP(FaultModel):
                           "Significance must be between 0 and 7 : " + str(self.significance))
         except ValueError:
             check_or_fail(False, "Wrong significance format : " + args[1])
-
-    def edited_memory_locations(self):
-        return [self.addr[0] * 8 + self.significance]
-
-    def apply(self, opened_file):
-        opened_file.seek(self.addr[0])
-        prev_value = ord(opened_file.read(1))
-        prev_value ^= (1 << self.significance)
-        set_bytes(opened_file, self.addr[0], prev_value)
+        bit = 1 << self.significance
+        with config_image(config) as image:
+            check_or_fail(0 <= self.addr[0] < len(image), "Address outside file content : byte " + hex(self.addr[0]))
+            prev_value = image[self.addr[0]]
+        self.patch = Patch(self.addr[0], bytes([prev_value ^ bit]), bytes([bit]))
@@ -1,6 +1,6 @@
-import os
-
 from faults.faultmodel import FaultModel
+from image import config_image
+from patch import Patch, le_bytes
 from utils import *
 
 
@@ -19,75 +19,54 @@ class JBE(FaultModel):
             absolute_target = int(args[1], 0)
         except ValueError:
             check_or_fail(False, "Invalid target for JBE : " + args[1])
-        check_or_fail(0 <= absolute_target < os.stat(config.infile).st_size, "Target outside the file")
-        f = open(self.config.infile, 'rb')
-        f.seek(self.addr[0])
-        if self.config.arch == 'x86':
-            b0 = ord(f.read(1))
-            b1 = ord(f.read(1))
-            b2 = ord(f.read(1))
+        with config_image(self.config) as image:
+            check_or_fail(0 <= absolute_target < len(image), "Target outside the file")
+            decoded = self.decode(image, self.addr[0], self.config.arch)
+            if decoded is None:
+                opcode = self.addr[0] if self.config.arch == 'x86' else self.addr[0] + 3
+                check_or_fail(False, "Unknown opcode at JBE address : " +
+                              (hex(image[opcode]) if opcode < len(image) else "EOF"))
+        self.type, addr, base, bits = decoded
+        self.addr = [addr]
+        self.target = absolute_target - base
+        check_or_fail(-2 ** (bits - 1) <= self.target < 2 ** (bits - 1),
+                      "Target value out of range : " + str(self.target))
+        self.patch = self.compile_patch()
+
+    @staticmethod
+    def decode(image, addr, arch):
+        """Decode the encoding of the conditional jump at the given offset.
+
+        :param image: the file content (any bytes-like object)
+        :param addr: offset of the jump in the file
+        :param arch: 'x86' or 'arm'
+        :return: (type, offset of the instruction, base of the displacement, number of bits of the displacement)
+                 or None if the opcode is not supported
+        """
+        if arch == 'x86' and addr + 2 < len(image):
+            b0 = image[addr]
+            b1 = image[addr + 1]
+            b2 = image[addr + 2]
             if 0x70 <= b0 <= 0x7F or b0 == 0xE3:  # there might be a prefix 0x67 before 0xE3
-                self.target = absolute_target - (self.addr[0] + 1 + 1)
-                check_or_fail(-2 ** 7 <= self.target < 2 ** 7, "Target value out of range : " + str(self.target))
-                self.type = 0
+                return 0, addr, addr + 1 + 1, 8
             elif b0 == 0x0F and 0x80 <= b1 <= 0x8F:
-                try:
-                    f.seek(self.addr[0] - 1)
-                    b_prev = ord(f.read(1))
-                except ValueError:
-                    b_prev = 0
+                b_prev = image[addr - 1] if addr > 0 else 0
                 if b_prev == 0x66:
-                    self.addr = [self.addr[0] - 1]
-                    self.target = absolute_target - (self.addr[0] + 3 + 2)
-                    check_or_fail(-2 ** 15 <= self.target < 2 ** 15, "Target value out of range : " + str(self.target))
-                    self.type = 2
-                else:
-                    self.target = absolute_target - (self.addr[0] + 2 + 4)
-                    check_or_fail(-2 ** 31 <= self.target < 2 ** 31, "Target value out of range : " + str(self.target))
-                    self.type = 1
+                    return 2, addr - 1, addr - 1 + 3 + 2, 16
+                return 1, addr, addr + 2 + 4, 32
             elif b0 == 0x66 and b1 == 0x0F and 0x80 <= b2 <= 0x8F:
-                self.target = absolute_target - (self.addr[0] + 3 + 2)
-                check_or_fail(-2 ** 15 <= self.target < 2 ** 15, "Target value out of range : " + str(self.target))
-                self.type = 2
-            else:
-                check_or_fail(False, "Unknown opcode at JBE address : " + hex(b0))
-        elif self.config.arch == 'arm':
-            f.seek(self.addr[0] + 3)
-            b3 = ord(f.read(1))
-            if b3 & 0x0E == 0x0A:
-                self.target = absolute_target - (self.addr[0] + 8)
-                check_or_fail(-2 ** 25 <= self.target < 2 ** 25, "Target value out of range : " + str(self.target))
-                self.type = 3  # B or BL
-            else:
-                check_or_fail(False, "Unknown opcode at JBE address : " + hex(b3))
-        f.close()
-
-    def edited_memory_locations(self):
-        if self.type == 0:
-            return bits_list(range(self.addr[0] + 1, self.addr[0] + 2))
-        elif self.type == 1:
-            return bits_list(range(self.addr[0] + 2, self.addr[0] + 6))
-        elif self.type == 2:
-            return bits_list(range(self.addr[0] + 3, self.addr[0] + 5))
-        elif self.type == 3:
-            return bits_list(range(self.addr[0], self.addr[0] + 3))
+                return 2, addr, addr + 3 + 2, 16
+        elif arch == 'arm' and addr + 3 < len(image):
+            if image[addr + 3] & 0x0E == 0x0A:
+                return 3, addr, addr + 8, 26  # B or BL
+        return None
 
-    def apply(self, opened_file):
+    def compile_patch(self):
         if self.type == 0:
-            opened_file.seek(self.addr[0] + 1)
-            opened_file.write(bytes([self.target & 0xFF]))
+            return Patch(self.addr[0] + 1, le_bytes(self.target, 1))
         elif self.type == 1:
-            opened_file.seek(self.addr[0] + 2)
-            opened_file.write(bytes([self.target & 0xFF]))
-            opened_file.write(bytes([self.target >> 8 & 0xFF]))
-            opened_file.write(bytes([self.target >> 16 & 0xFF]))
-            opened_file.write(bytes([self.target >> 24 & 0xFF]))
+            return Patch(self.addr[0] + 2, le_bytes(self.target, 4))
         elif self.type == 2:
-            opened_file.seek(self.addr[0] + 3)
-            opened_file.write(bytes([self.target & 0xFF]))
-            opened_file.write(bytes([self.target >> 8 & 0xFF]))
+            return Patch(self.addr[0] + 3, le_bytes(self.target, 2))
         elif self.type == 3:
-            opened_file.seek(self.addr[0])
-            opened_file.write(bytes([self.target >> 2 & 0xFF]))
-            opened_file.write(bytes([self.target >> 10 & 0xFF]))
-            opened_file.write(bytes([self.target >> 18 & 0xFF]))
+            return Patch(self.addr[0], le_bytes(self.target >> 2, 3))
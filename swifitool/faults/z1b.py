@@ -1,4 +1,5 @@
 from faults.faultmodel import FaultModel
+from patch import Patch
 from utils import *
 
 
@@ -10,9 +11,4 @@ class Z1B(FaultModel):
     def __init__(self, config, args):
         super().__init__(config, args)
         self.addr = parse_addr(args[0])
-
-    def edited_memory_locations(self):
-        return bits_list(self.addr)
-
-    def apply(self, opened_file):
-        set_bytes(opened_file, self.addr[0], nb_repeat=len(self.addr))
+        self.patch = Patch(self.addr[0], bytes(len(self.addr)))
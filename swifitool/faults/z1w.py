@@ -1,4 +1,5 @@
 from faults.faultmodel import FaultModel
+from patch import Patch
 from utils import *
 
 
@@ -13,15 +14,7 @@ class Z1W(FaultModel):
         check_or_fail(config.word_length is not None, "Word size required when using Z1W")
         check_or_fail(len(self.addr) == 1 or len(self.addr) % config.word_length == 0,
                       "Range of addresses for Z1W must be multiple of the word length")
-
-    def edited_memory_locations(self):
-        if len(self.addr) == 1:
-            return bits_list(range(self.addr[0], self.addr[0] + self.config.word_length))
-        else:
-            return bits_list(self.addr)
-
-    def apply(self, opened_file):
         if len(self.addr) == 1:
-            set_bytes(opened_file, self.addr[0], nb_repeat=self.config.word_length)
+            self.patch = Patch(self.addr[0], bytes(self.config.word_length))
         else:
-            set_bytes(opened_file, self.addr[0], nb_repeat=len(self.addr))
+            self.patch = Patch(self.addr[0], bytes(len(self.addr)))
@@ -9,18 +9,21 @@ from faults.jmp import JMP
 from faults.nop import NOP
 from faults.z1b import Z1B
 from faults.z1w import Z1W
+from image import BinaryImage
+from patch import patched_image
 from utils import check_or_fail
 
 
 class ExecConfig:
     """Keeps the configuration variables."""
 
-    def __init__(self, infile, outfile, arch, word_length):
+    def __init__(self, infile, outfile, arch, word_length, image=None):
         super().__init__()
         self.infile = infile
         self.outfile = outfile
         self.arch = arch
         self.word_length = word_length
+        self.image = image  # BinaryImage of infile shared by the fault models, mapped on demand if None
 
 
 def main(argv):
@@ -48,7 +51,8 @@ def main(argv):
     check_or_fail(args.wordsize is None or args.wordsize > 0, "Word size must be positive")
 
     # General configuration
-    config = ExecConfig(os.path.expanduser(args.infile), os.path.expanduser(args.outfile), args.arch, args.wordsize)
+    infile = os.path.expanduser(args.infile)
+    config = ExecConfig(infile, os.path.expanduser(args.outfile), args.arch, args.wordsize, BinaryImage(infile))
 
     # Fault models asked
     if args.fromfile is not None:
@@ -72,18 +76,17 @@ def main(argv):
 
     # Check that the faults do not overlap and do not write outside the end of the file
     mem = {}
-    max_bits = os.stat(config.infile).st_size * 8
+    max_bits = len(config.image) * 8
     for f in fm_list:
         for m in f.edited_memory_locations():
             check_or_fail(0 <= m < max_bits, "Address outside file content : byte " + hex(m // 8))
             check_or_fail(mem.get(m) is None, "Applying two fault models at the same place : byte " + hex(m // 8))
             mem[m] = f.name
 
-    # Duplicate the input and then apply the faults
-    shutil.copy(config.infile, config.outfile)
-    with open(config.outfile, "r+b") as file:
-        for f in fm_list:
-            f.apply(file)
+    # Duplicate the input in memory, apply all the patches at once and write the output
+    with open(config.outfile, 'wb') as file:
+        file.write(patched_image(config.image.data, [f.patch for f in fm_list]))
+    shutil.copymode(config.infile, config.outfile)
 
     # Open a window for comparing the Input/Output with the faults highlighted
     if args.graphical:
@@ -0,0 +1,89 @@
+import mmap
+from contextlib import contextmanager
+
+from elftools.common.exceptions import ELFError
+from elftools.elf.elffile import ELFFile
+
+
+class BinaryImage:
+    """A binary mapped once in memory and shared by the disassembler, the fault models and the bounds checks.
+
+    The content is a private copy-on-write mapping which is never written: every view handed out is read-only,
+    except the ones of code_view() which let C decoders (capstone) read the mapping without copying it.
+    Indexing and slicing the image itself behave like on bytes (slices are read-only memoryviews).
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.data = memoryview(self.mmap).toreadonly()
+        self.segments = []  # (vaddr, offset, filesz) of the PT_LOAD segments
+        try:
+            self.elf = ELFFile(self.file)
+            for seg in self.elf.iter_segments():
+                if seg['p_type'] == 'PT_LOAD':
+                    self.segments.append((seg['p_vaddr'], seg['p_offset'], seg['p_filesz']))
+        except ELFError:
+            self.elf = None  # raw file, only the byte level access is available
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def code_view(self, start, end):
+        """Zero-copy writable-typed view for C decoders, the mapping must not be written through it."""
+        return memoryview(self.mmap)[start:end]
+
+    def sections(self):
+        """Generator of (name, vaddr, offset, view) for each section present in the file."""
+        if self.elf is None:
+            return
+        for section in self.elf.iter_sections():
+            if section['sh_type'] == 'SHT_NOBITS':
+                continue
+            start = section['sh_offset']
+            yield section.name, section['sh_addr'], start, self.data[start:start + section['sh_size']]
+
+    def section(self, name):
+        """Returns (vaddr, offset, view) of the named section or None."""
+        for s_name, vaddr, offset, view in self.sections():
+            if s_name == name:
+                return vaddr, offset, view
+        return None
+
+    def vaddr_to_offset(self, vaddr):
+        """Translate a virtual address to a file offset, None if it is not backed by the file."""
+        for seg_vaddr, seg_offset, filesz in self.segments:
+            if seg_vaddr <= vaddr < seg_vaddr + filesz:
+                return vaddr - seg_vaddr + seg_offset
+        return None
+
+    def offset_to_vaddr(self, offset):
+        """Translate a file offset to a virtual address, None if it is not loaded in memory."""
+        for seg_vaddr, seg_offset, filesz in self.segments:
+            if seg_offset <= offset < seg_offset + filesz:
+                return offset - seg_offset + seg_vaddr
+        return None
+
+
+@contextmanager
+def config_image(config):
+    """Yield the image shared through the configuration, or map the input file for the time of the block.
+
+    :param config: an ExecConfig
+    """
+    if getattr(config, 'image', None) is not None:
+        yield config.image
+    else:
+        with open(config.infile, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as image:
+            yield image
@@ -0,0 +1,88 @@
+from collections import namedtuple
+
+
+class Patch(namedtuple('Patch', ['offset', 'data', 'mask'])):
+    """An immutable byte patch : the bits selected by the mask are replaced by those of data at the file offset.
+
+    A mask of None means that data replaces the bytes entirely.
+    """
+    __slots__ = ()
+
+    def __new__(cls, offset, data, mask=None):
+        data = bytes(data)
+        if mask is not None:
+            mask = bytes(mask)
+            if len(mask) != len(data):
+                raise ValueError("Patch mask and data must have the same length")
+        return super().__new__(cls, offset, data, mask)
+
+    @property
+    def end(self):
+        """Offset of the first byte after the patch."""
+        return self.offset + len(self.data)
+
+    def edited_bits(self):
+        """Returns the locations of the bits edited by the patch."""
+        if self.mask is None:
+            return list(range(self.offset * 8, self.end * 8))
+        return [(self.offset + i) * 8 + b for i, m in enumerate(self.mask) for b in range(8) if m >> b & 1]
+
+    def resolve(self, original):
+        """Returns the bytes found at the patch location once it is applied.
+
+        :param original: the original bytes at [offset, end)
+        :return: the patched bytes
+        """
+        if self.mask is None:
+            return self.data
+        return bytes((o & ~m) | (d & m) for o, d, m in zip(original, self.data, self.mask))
+
+
+def le_bytes(value, nb_bytes):
+    """Encode a (possibly negative) integer as little endian two's complement.
+
+    :param value: the integer
+    :param nb_bytes: number of bytes kept
+    :return: the bytes
+    """
+    return (value & ((1 << (8 * nb_bytes)) - 1)).to_bytes(nb_bytes, 'little')
+
+
+def apply_patches(buf, patches):
+    """Apply the patches to a writable buffer in a single pass.
+
+    :param buf: a bytearray or writable memoryview of the whole file
+    :param patches: iterable of Patch
+    :return: the buffer
+    """
+    for p in patches:
+        if p.mask is None:
+            buf[p.offset:p.end] = p.data
+        else:
+            buf[p.offset:p.end] = p.resolve(buf[p.offset:p.end])
+    return buf
+
+
+def patched_image(image, patches):
+    """Copy an image and apply the patches to the copy.
+
+    :param image: the original content (bytes, bytearray or memoryview)
+    :param patches: iterable of Patch
+    :return: a new bytearray
+    """
+    return apply_patches(bytearray(image), patches)
+
+
+def write_patches(opened_file, patches):
+    """Apply the patches to an opened file, with one write per patch.
+
+    :param opened_file: the IO stream of the file, opened in r+b mode
+    :param patches: iterable of Patch
+    """
+    for p in patches:
+        data = p.data
+        if p.mask is not None:
+            opened_file.seek(p.offset)
+            data = p.resolve(opened_file.read(len(p.data)))
+        opened_file.seek(p.offset)
+        opened_file.write(data)
@@ -0,0 +1,40 @@
+import pytest
+
+from chaosduck import decode_arm_chunk, plan_zero_faults
+from duck.dedup import effective_delta
+from duck.plan import CampaignPlan
+from image import BinaryImage
+
+
+def arm_image(tmp_path, *words):
+    path = tmp_path / "code.bin"
+    path.write_bytes(b"".join(w.to_bytes(4, "little") for w in words))
+    return BinaryImage(str(path))
+
+
+@pytest.mark.parametrize(
+    "word",
+    [
+        0xE3500001,  # cmp r0, #1
+        0xE3500FFF,  # cmp r0, #0x3fc
+        0xE35004FF,  # cmp r0, #0xff000000
+        0xE3A014FF,  # mov r1, #0xff000000
+    ],
+)
+def test_arm_immediate_zeroes_imm8(tmp_path, word):
+    image = arm_image(tmp_path, word)
+    _, _, cmpsmovs = decode_arm_chunk(image, (0, 0, len(image)))
+    plan = CampaignPlan(image.path, "arm")
+    plan_zero_faults(plan, cmpsmovs)
+    assert len(plan) == 1
+    patch = plan.materialize(0, image)["fault"].patch
+    # only imm8 is zeroed, the rotation, the registers and the opcode are kept
+    assert effective_delta(image.data, [patch]) == ((0, b"\x00"),)
+
+
+def test_arm_shifted_register_is_not_zeroed(tmp_path):
+    image = arm_image(
+        tmp_path, 0xE1A00101, 0xE3500000
+    )  # mov r0, r1, lsl #2; cmp r0, #0
+    _, _, cmpsmovs = decode_arm_chunk(image, (0, 0, len(image)))
+    assert cmpsmovs == []
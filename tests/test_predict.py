@@ -0,0 +1,33 @@
+from duck.predict import ValidationSample, sampled
+
+
+def test_validation_sample_runs_a_fault_per_model():
+    names = [
+        "flp_at_0x%x_sgnf_%d" % (at, bit)
+        for at in range(0x1240, 0x12A0)
+        for bit in range(8)
+    ]
+    names = [n for n in names if not sampled(n, 0.001)]  # none sampled by the rate
+    validation = ValidationSample(0.001)
+    chosen = [n for n in names if validation(n, "FLP")]
+    assert chosen == names[:1]
+    assert validation("nop_0x1240-0x1242", "NOP")
+    # a chosen fault runs with every input, the others with none
+    assert validation(names[0], "FLP")
+    assert not validation(names[1], "FLP")
+
+
+def test_validation_sample_keeps_the_rate():
+    names = [
+        "flp_at_0x%x_sgnf_%d" % (at, bit)
+        for at in range(0x1000, 0x1400)
+        for bit in range(8)
+    ]
+    validation = ValidationSample(0.05)
+    chosen = sum(validation(n, "FLP") for n in names)
+    assert 0.03 * len(names) < chosen < 0.07 * len(names)
+
+
+def test_validation_sample_rate_zero_runs_none():
+    validation = ValidationSample(0)
+    assert not any(validation("flp_at_0x%x_sgnf_0" % at, "FLP") for at in range(100))